@@ -0,0 +1,184 @@
+#!/usr/bin/python
+
+import bz2
+import multiprocessing
+import numpy
+import traceformat
+import tracereader
+
+
+# bzip2 marks every compressed block and the end of every stream with a 48-bit magic number. Neither is byte
+# aligned inside a stream, so they are searched at all 8 bit offsets.
+_blockMagic = '\x31\x41\x59\x26\x53\x59'
+_endMagic = '\x17\x72\x45\x38\x50\x90'
+_streamHeader = 'BZh9'
+
+# Compressed blocks decoded by a single worker task (each block holds up to 900kB of trace text)
+DEFAULT_BLOCKS_PER_TASK = 4
+
+_scanWindow = 16 * 1024 * 1024
+
+
+def _ReadBits(inputFile, start, length):
+    """Return bits [start, start + length) of inputFile as an array of 0/1 values"""
+    inputFile.seek(start // 8)
+    data = numpy.frombuffer(inputFile.read((start % 8 + length + 7) // 8), dtype=numpy.uint8)
+    return numpy.unpackbits(data)[start % 8:start % 8 + length]
+
+
+def _BitsToInt(bits):
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def _FindMagics(inputFile):
+    """Return the sorted bit offsets of every block magic and end of stream magic in inputFile"""
+    blocks = set()
+    ends = set()
+    offset = 0
+    carry = ''
+    while True:
+        data = inputFile.read(_scanWindow)
+        if len(data) == 0:
+            break
+        window = carry + data
+        start = offset - len(carry)
+        current = numpy.frombuffer(window, dtype=numpy.uint8)
+        for shift in range(0, 8):
+            if shift == 0:
+                shifted = window
+            else:
+                shifted = ((current[:-1] << shift) | (current[1:] >> (8 - shift))).astype(numpy.uint8).tostring()
+            for magic, found in ((_blockMagic, blocks), (_endMagic, ends)):
+                position = shifted.find(magic)
+                while position >= 0:
+                    found.add((start + position) * 8 + shift)
+                    position = shifted.find(magic, position + 1)
+        offset += len(data)
+        carry = window[-8:]
+    return sorted(blocks), sorted(ends)
+
+
+def _CombineCRC(combined, blockCRC):
+    return (((combined << 1) | (combined >> 31)) & 0xffffffff) ^ blockCRC
+
+
+def FindBlocks(fileName):
+    """Locate the compressed blocks of a (possibly multistream) bz2 file.
+
+    Returns a list of (startBit, endBit, crc) for every block, in file order, or None if the block boundaries
+    could not be verified against the stream checksums (e.g. a magic number occurring by chance inside the
+    compressed data), in which case the file must be decompressed serially.
+    """
+    inputFile = open(fileName, 'rb')
+    blockMagics, endMagics = _FindMagics(inputFile)
+
+    blocks = []
+    ends = iter(endMagics)
+    streamEnd = next(ends, None)
+    combined = 0
+    for i, start in enumerate(blockMagics):
+        if streamEnd is None or start > streamEnd:
+            return None
+        crc = _BitsToInt(_ReadBits(inputFile, start + 48, 32))
+        combined = _CombineCRC(combined, crc)
+        if i + 1 < len(blockMagics) and blockMagics[i + 1] < streamEnd:
+            end = blockMagics[i + 1]
+        else:
+            end = streamEnd
+            if combined != _BitsToInt(_ReadBits(inputFile, streamEnd + 48, 32)):
+                return None
+            combined = 0
+            streamEnd = next(ends, None)
+        blocks.append((start, end, crc))
+    return blocks
+
+
+def _DecompressBlocks(fileName, blocks):
+    """Rebuild a standalone bz2 stream holding the given blocks and decompress it"""
+    inputFile = open(fileName, 'rb')
+    pieces = [numpy.unpackbits(numpy.frombuffer(_streamHeader, dtype=numpy.uint8))]
+    combined = 0
+    for start, end, crc in blocks:
+        pieces.append(_ReadBits(inputFile, start, end - start))
+        combined = _CombineCRC(combined, crc)
+    pieces.append(numpy.unpackbits(numpy.frombuffer(_endMagic, dtype=numpy.uint8)))
+    pieces.append(numpy.array([(combined >> (31 - i)) & 1 for i in range(0, 32)], dtype=numpy.uint8))
+    return bz2.decompress(numpy.packbits(numpy.concatenate(pieces)).tostring())
+
+
+def _ParseBlocks(task):
+    """Worker: decompress some blocks and parse the complete lines they contain.
+
+    The text before the first and after the last newline belongs to lines shared with the neighbouring tasks and
+    is handed back untouched, together with the parsed arrays, the local opcode names and the skipped lines.
+    """
+    fileName, blocks, formatName = task
+    text = _DecompressBlocks(fileName, blocks)
+    first = text.find('\n') + 1
+    last = text.rfind('\n') + 1
+    if first == 0:
+        return (text, '', None)
+    parser = tracereader.TraceParser(tracereader.OpcodeIndex(), formatName)
+    starts, ends, positions, cores, executed, ids = parser.Parse(text[first:last])
+    return (text[:first], text[last:], (cores, executed, ids, parser.opcodes.names, parser.skipped))
+
+
+def _Remap(arrays, opcodes):
+    cores, executed, ids, names, skipped = arrays
+    table = numpy.array([opcodes.Intern(name) for name in names], dtype=numpy.int32)
+    if len(ids) > 0:
+        ids = table[ids]
+    return (cores, executed, ids)
+
+
+def _DetectFormat(fileName):
+    """Return the name of the format of a bz2 trace, detected on its beginning"""
+    inputFile = tracereader.OpenTrace(fileName)
+    data = inputFile.read(65536)
+    inputFile.close()
+    return traceformat.DetectFormat(data).name
+
+
+def ReadTraceArrays(fileName, parser, jobs=None, blocksPerTask=DEFAULT_BLOCKS_PER_TASK):
+    """Parallel counterpart of tracereader.ReadTraceArrays for bz2 files.
+
+    Groups of compressed blocks are decompressed and parsed in a pool of jobs processes (all CPUs by default).
+    Chunks are yielded in trace order, so the results are the same as those of the serial reader.
+    """
+    blocks = FindBlocks(fileName)
+    if blocks is None:
+        print 'Could not split %s into bz2 blocks, decompressing serially' % fileName
+        for chunk in tracereader.ReadTraceArrays(tracereader.OpenTrace(fileName), parser):
+            yield chunk
+        return
+
+    # Every worker must parse the same format, so it is settled before splitting the trace
+    if parser.traceFormat is None:
+        parser.traceFormat = traceformat.GetFormat(_DetectFormat(fileName))
+    formatName = parser.traceFormat.name
+    tasks = [(fileName, blocks[i:i + blocksPerTask], formatName) for i in range(0, len(blocks), blocksPerTask)]
+    pool = multiprocessing.Pool(jobs)
+    try:
+        pending = ''
+        for head, tail, arrays in pool.imap(_ParseBlocks, tasks):
+            if arrays is None:
+                # No newline in the whole task, the line goes on in the next one
+                pending += head
+                continue
+            starts, ends, positions, cores, executed, ids = parser.Parse(pending + head)
+            if len(positions) > 0:
+                yield (cores, executed, ids)
+            parser.skipped += arrays[4]
+            cores, executed, ids = _Remap(arrays, parser.opcodes)
+            if len(ids) > 0:
+                yield (cores, executed, ids)
+            pending = tail
+        if len(pending) > 0:
+            starts, ends, positions, cores, executed, ids = parser.Parse(pending)
+            if len(positions) > 0:
+                yield (cores, executed, ids)
+    finally:
+        pool.terminate()
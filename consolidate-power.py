@@ -2,6 +2,7 @@
 
 import csv
 import sys
+import powerreport
 
 
 if __name__ == '__main__':
@@ -11,18 +12,11 @@ if __name__ == '__main__':
 
     outputTable = []
 
-    # Read all files adding the instruction counter to allInstructions.
-    # Side effect: every instruction used will be in the dictionary
+    # Reports are parsed in parallel, those read before and unchanged come from the cache
+    print 'Reading', len(sys.argv) - 2, 'reports ...'
+    reports = powerreport.ReadReports(sys.argv[2:])
     for fileName in sys.argv[2:]:
-        print 'Reading', fileName, '...'
-
-        lines = open(fileName).readlines()
-        splited = lines[13].split()
-        if (splited[0] == 'Rocket'):
-            powerConsumption = float(splited[3])
-        else:
-            powerConsumption = 0.0
-        outputTable.append([fileName, powerConsumption])
+        outputTable.append([fileName, reports[fileName].RocketPower()])
 
     print 'Writing', sys.argv[1], '...'
     csv.writer(open(sys.argv[1], 'wt')).writerows(outputTable)
@@ -1,10 +1,47 @@
 #!/usr/bin/python
 
 import argparse
-import random
+import csv
+import hashlib
+import multiprocessing
 import string
 import os
 import numpy
+import rv64asm
+
+
+class OperandSampler:
+    """Draws the registers, immediates and offsets of a whole program at once.
+
+    Every draw returns count values from a numpy RandomState (numpy.random.Generator is newer than the numpy of
+    these scripts). Weighted draws search a cumulative distribution computed once, where numpy.random.choice
+    rebuilds it on every call.
+    """
+    def __init__(self, seed=None):
+        self.state = numpy.random.RandomState(seed)
+
+    def Choice(self, values, count):
+        """count values picked uniformly from a list"""
+        return [values[i] for i in self.state.randint(0, len(values), count)]
+
+    def Integers(self, low, high, count):
+        """count integers from low to high, both included"""
+        return self.state.randint(low, high + 1, count).tolist()
+
+    def Uniform(self, count):
+        return self.state.random_sample(count)
+
+    def Weighted(self, cdf, count):
+        """count indexes drawn with the probabilities whose cumulative distribution is cdf (ending in 1)"""
+        return numpy.searchsorted(cdf, self.state.random_sample(count), side='right')
+
+    def Sample(self, values, count):
+        """count distinct values of a list, in random order"""
+        return [values[i] for i in self.state.permutation(len(values))[:count]]
+
+
+def _Lines(lineFormat, *columns):
+    return [lineFormat % values for values in zip(*columns)]
 
 
 class InstructionBasedTemplate:
@@ -39,9 +76,16 @@ end:    beq     x0, x0, end
                      0.0069444,  0.0138889,  0.0208333,  0.0208333,  0.0208333,  0.0138889,
                      0.0138889,  0.0069444,  0,    0.0138889,  0.0138889,  0.0277778,  0,
                      0.0069444,  0,    0,    0.0069444,  0.0069444,  0,    0,    0.0069444 ]
+    # Rounded to 7 digits, the weights add up to 0.9999997: normalized so that the distribution ends in 1
+    _randomCDF = numpy.cumsum(_randomWeight) / sum(_randomWeight)
 
     _randomRegisters = []
 
+    # Assembly text, or machine code assembled by rv64asm.py in a loadable ELF or a hex image for the Rocket emulator
+    _extensions = {'asm': '.s', 'elf': '.elf', 'hex': '.hex'}
+    # Address the machine code is laid out from, where the emulator loads hex images
+    loadAddress = 0
+
     def __init__(self, i, n, instruction):
         """This constructor receives the three basic parameters to create template instructions:
            * i: the number of iterations the loop will execute
@@ -51,60 +95,85 @@ end:    beq     x0, x0, end
         self.iterations = i
         self.nInstructions = n
         self.instructionName = instruction
-        self.program = ''
+        # Lines of the program, joined only when it is written
+        self.program = []
         self.dir = 'test-programs'
         self.prefix = ''
+        self.format = 'asm'
         self._randomRegisters = self._tRegisters[1:]
         self._randomRegisters.extend(self._aRegisters)
         self._randomRegisters.extend(self._sRegisters)
         self._destRegisters = []
+        self.sampler = OperandSampler()
+        # Content hash of the program written before under the same name, if known
+        self.knownHash = None
+        self.hash = None
+        self.written = False
 
         return
 
+    def ProgramName(self):
+        return os.path.join(self.dir,
+                            self.prefix +
+                            self.instructionName +
+                            '_' +
+                            str(self.iterations) +
+                            'x' +
+                            str(self.nInstructions) +
+                            self._extensions[self.format])
+
     def SaveProgram(self):
-        programName = os.path.join(self.dir,
-                                   self.prefix +
-                                   self.instructionName +
-                                   '_' +
-                                   str(self.iterations) +
-                                   'x' +
-                                   str(self.nInstructions) +
-                                   '.s')
-        open(programName, 'wt').write(self.program)
+        """Write the program, unless the file already holds the same content (knownHash)"""
+        programName = self.ProgramName()
+        content = ''.join(self.program)
+        if self.format != 'asm':
+            image, symbols = rv64asm.Assemble(content, self.loadAddress)
+            if self.format == 'elf':
+                content = rv64asm.ELF(image, self.loadAddress, symbols.get('_start', self.loadAddress))
+            else:
+                content = rv64asm.HexImage(image)
+        self.hash = hashlib.sha1(content).hexdigest()
+        self.written = self.hash != self.knownHash or not os.path.isfile(programName)
+        if self.written:
+            outputFile = open(programName, 'wb', 1 << 16)
+            outputFile.write(content)
+            outputFile.close()
 
     def RandomInitialize16bitRegisters(self, registers):
-        for r in registers:
-            self.program += "        li %s, %d\n" % (r, random.randint(0, 2 ** 14 - 1) * 4)
+        values = self.sampler.Integers(0, 2 ** 14 - 1, len(registers))
+        self.program.extend(_Lines("        li %s, %d\n", registers, [value * 4 for value in values]))
 
     def RandomInitializeRegisters(self, registers, noZero = False, multipleOf4 = False):
-        for r in registers:
-            value = 2 ** numpy.random.choice(self._randomRange, p=self._randomWeight) - 1
-            if noZero:
-                value += 1
-            if multipleOf4:
-                value &= ~3
-            self.program += "        li %s, %d\n" % (r, value)
+        values = numpy.left_shift(1, self.sampler.Weighted(self._randomCDF, len(registers)).astype(numpy.int64)) - 1
+        if noZero:
+            values += 1
+        if multipleOf4:
+            values &= ~3
+        self.program.extend(_Lines("        li %s, %d\n", registers, values.tolist()))
 
     def ReserveDestinationRegisters(self, number):
-        for i in range(0, number):
-            register = random.choice(self._randomRegisters)
+        for register in self.sampler.Sample(self._randomRegisters, number):
             self._randomRegisters.remove(register)
             self._destRegisters.append(register)
 
     def AddHeader(self):
-        self.program += string.replace(self._templateHeader, '$iterations', str(self.iterations))
+        self.program.append(string.replace(self._templateHeader, '$iterations', str(self.iterations)))
 
     def AddLoopLabel(self):
-        self.program += "\nloop:\n"
+        self.program.append("\nloop:\n")
 
     def AddFooter(self):
-        self.program += self._templateFooter
+        self.program.append(self._templateFooter)
 
     def AddRandomInstruction(self):
         return '# No template given\n'
 
+    def AddRandomInstructions(self, count):
+        """Return the lines of count instructions of the loop body, drawn together"""
+        return [self.AddRandomInstruction() for i in range(0, count)]
+
     def ForceAlignment(self):
-        self.program += '        .align 7'
+        self.program.append('        .align 7')
 
     def GenerateProgram(self, removeZero = False):
         self.AddHeader()
@@ -112,8 +181,7 @@ end:    beq     x0, x0, end
         self.RandomInitializeRegisters(self._destRegisters, removeZero)
         self.ForceAlignment()
         self.AddLoopLabel()
-        for i in range(0, self.nInstructions):
-            self.program += self.AddRandomInstruction()
+        self.program.extend(self.AddRandomInstructions(self.nInstructions))
         self.AddFooter()
         self.SaveProgram()
 
@@ -123,13 +191,20 @@ end:    beq     x0, x0, end
     def SetPrefix(self, newPrefix):
         self.prefix = newPrefix
 
+    def SetFormat(self, newFormat):
+        self.format = newFormat
+
+    def SetSeed(self, seed):
+        """Draw every random value of the program from seed, before registers are reserved"""
+        self.sampler = OperandSampler(seed)
+
 
 class IBTemplateTypeR(InstructionBasedTemplate):
-    def AddRandomInstruction(self):
-        return "        %s    %s, %s, %s\n" % (self.instructionName,
-                                               random.choice(self._destRegisters),
-                                               random.choice(self._randomRegisters),
-                                               random.choice(self._randomRegisters))
+    def AddRandomInstructions(self, count):
+        return _Lines("        %s    %s, %s, %s\n", [self.instructionName] * count,
+                      self.sampler.Choice(self._destRegisters, count),
+                      self.sampler.Choice(self._randomRegisters, count),
+                      self.sampler.Choice(self._randomRegisters, count))
 
 
 class IBTemplateTypeI(InstructionBasedTemplate):
@@ -138,37 +213,37 @@ class IBTemplateTypeI(InstructionBasedTemplate):
         self.minI = minI
         self.maxI = maxI
 
-    def AddRandomInstruction(self):
-        return "        %s    %s, %s, %d\n" % (self.instructionName,
-                                                        random.choice(self._randomRegisters),
-                                                        random.choice(self._randomRegisters),
-                                                        random.randint(self.minI, self.maxI))
+    def AddRandomInstructions(self, count):
+        return _Lines("        %s    %s, %s, %d\n", [self.instructionName] * count,
+                      self.sampler.Choice(self._randomRegisters, count),
+                      self.sampler.Choice(self._randomRegisters, count),
+                      self.sampler.Integers(self.minI, self.maxI, count))
 
 
 class IBTemplateLI(IBTemplateTypeI):
-    def AddRandomInstruction(self):
-        return "        %s    %s, %d\n" % (self.instructionName,
-                                                    random.choice(self._randomRegisters),
-                                                    random.randint(self.minI, self.maxI))
+    def AddRandomInstructions(self, count):
+        return _Lines("        %s    %s, %d\n", [self.instructionName] * count,
+                      self.sampler.Choice(self._randomRegisters, count),
+                      self.sampler.Integers(self.minI, self.maxI, count))
 
 
 class IBTemplateTypeU(InstructionBasedTemplate):
-    def AddRandomInstruction(self):
-        return "        %s    %s, %d\n" % (self.instructionName,
-                                                        random.choice(self._randomRegisters),
-                                                        random.randint(0, 2 ** 20 - 1))
+    def AddRandomInstructions(self, count):
+        return _Lines("        %s    %s, %d\n", [self.instructionName] * count,
+                      self.sampler.Choice(self._randomRegisters, count),
+                      self.sampler.Integers(0, 2 ** 20 - 1, count))
 
 
 class IBTemplate2Registers(InstructionBasedTemplate):
-    def AddRandomInstruction(self):
-        return "        %s    %s, %s\n" % (self.instructionName,
-                                                        random.choice(self._randomRegisters),
-                                                        random.choice(self._randomRegisters))
+    def AddRandomInstructions(self, count):
+        return _Lines("        %s    %s, %s\n", [self.instructionName] * count,
+                      self.sampler.Choice(self._randomRegisters, count),
+                      self.sampler.Choice(self._randomRegisters, count))
 
 
 class IBTemplateNOP(InstructionBasedTemplate):
-    def AddRandomInstruction(self):
-        return "        nop\n"
+    def AddRandomInstructions(self, count):
+        return ["        nop\n"] * count
 
 
 class IBTemplateMemLoad(InstructionBasedTemplate):
@@ -178,42 +253,35 @@ class IBTemplateMemLoad(InstructionBasedTemplate):
         self.endAddress = endAddress
         self.range = int((endAddress - baseAddress) / 4)
 
-    def AddRandomInstruction(self):
-        return "        %s    %s, %d(%s)\n" % (self.instructionName,
-                                                        random.choice(self._destRegisters),
-                                                        self.baseAddress + 4 * random.randint(0, self.range),
-                                                        random.choice(self._randomRegisters))
+    def AddRandomInstructions(self, count):
+        offsets = [self.baseAddress + 4 * offset for offset in self.sampler.Integers(0, self.range, count)]
+        return _Lines("        %s    %s, %d(%s)\n", [self.instructionName] * count,
+                      self.sampler.Choice(self._destRegisters, count), offsets,
+                      self.sampler.Choice(self._randomRegisters, count))
 
 
-class IBTemplateMemStore(InstructionBasedTemplate):
-    def __init__(self, i, n, instruction, baseAddress, endAddress):
-        InstructionBasedTemplate.__init__(self, i, n, instruction)
-        self.baseAddress = baseAddress
-        self.endAddress = endAddress
-        self.range = int((endAddress - baseAddress) / 4)
-
+class IBTemplateMemStore(IBTemplateMemLoad):
     def RandomInitializeRegisters(self, registers, noZero = False, multipleOf4 = True):
-        for r in registers:
-            self.program += "        li %s, %d\n" % (r, 1024 + random.randint(0, 2**10) * 4)
-
-    def AddRandomInstruction(self):
-        return "        %s    %s, %d(%s)\n" % (self.instructionName,
-                                                        random.choice(self._destRegisters),
-                                                        self.baseAddress + 4 * random.randint(0, self.range),
-                                                        random.choice(self._randomRegisters))
+        values = self.sampler.Integers(0, 2 ** 10, len(registers))
+        self.program.extend(_Lines("        li %s, %d\n", registers, [1024 + value * 4 for value in values]))
 
 
 class IBTemplateTypeShift(InstructionBasedTemplate):
-    def AddRandomInstruction(self):
-        return "        %s    %s, %s, %d\n" % (self.instructionName,
-                                                        random.choice(self._destRegisters),
-                                                        random.choice(self._randomRegisters),
-                                                        random.randint(0, 31))
+    def AddRandomInstructions(self, count):
+        return _Lines("        %s    %s, %s, %d\n", [self.instructionName] * count,
+                      self.sampler.Choice(self._destRegisters, count),
+                      self.sampler.Choice(self._randomRegisters, count),
+                      self.sampler.Integers(0, 31, count))
 
 
 class IPCTemplate(InstructionBasedTemplate):
 
     _addrRegisters = []
+    _slowRInstructions = ['mul', 'mulw', 'mulh', 'mulhsu', 'mulhu']
+    _slowLoadInstructions = ['lb', 'lh', 'lw', 'lbu', 'lhu']
+    _fastRInstructions = ['add', 'addw', 'sub', 'subw', 'sll', 'sllw', 'srl', 'srlw', 'sra', 'sraw', 'xor', 'or',
+                          'and', 'slt', 'sltu']
+    _fastIInstructions = ['addi', 'addiw', 'xori', 'ori', 'andi', 'slti', 'sltiu']
 
     def __init__(self, i, n, ratio):
         """This constructor receives the three basic parameters to create template instructions:
@@ -231,44 +299,52 @@ class IPCTemplate(InstructionBasedTemplate):
         self._addrRegisters = []
 
     def ReserveAddressRegisters(self, number):
-        for i in range(0, number):
-            register = random.choice(self._randomRegisters)
+        for register in self.sampler.Sample(self._randomRegisters, number):
             self._randomRegisters.remove(register)
             self._addrRegisters.append(register)
 
-    def AddSlowInstruction(self):
-        if (random.random() * 2 < 1):
-            instructionName = random.choice(['mul', 'mulw', 'mulh', 'mulhsu', 'mulhu'])
-            return "        %s    %s, %s, %s\n" % (instructionName,
-                                                   random.choice(self._destRegisters),
-                                                   random.choice(self._randomRegisters),
-                                                   random.choice(self._randomRegisters))
-        else:
-            instructionName = random.choice(['lb', 'lh', 'lw', 'lbu', 'lhu'])
-            return "        %s    %s, %d(%s)\n" % (instructionName,
-                                                   random.choice(self._destRegisters),
-                                                   self.baseAddress + 4 * random.randint(0, self.range),
-                                                   random.choice(self._addrRegisters))
-    def AddFastInstruction(self):
-        if (random.random() * 2 < 1):
-            instructionName = random.choice(['add', 'addw', 'sub', 'subw', 'sll', 'sllw', 'srl', 'srlw', 'sra', 'sraw',
-                                             'xor', 'or', 'and', 'slt', 'sltu'])
-            return "        %s    %s, %s, %s\n" % (instructionName,
-                                                   random.choice(self._destRegisters),
-                                                   random.choice(self._randomRegisters),
-                                                   random.choice(self._randomRegisters))
-        else:
-            instructionName = random.choice(['addi', 'addiw', 'xori', 'ori', 'andi', 'slti', 'sltiu'])
-            return "        %s    %s, %s, %d\n" % (instructionName,
-                                                   random.choice(self._destRegisters),
-                                                   random.choice(self._randomRegisters),
-                                                   random.randint(self.minI, self.maxI))
-
-    def AddRandomInstruction(self):
-        if random.random() * 100 < self.ratio:
-            return self.AddFastInstruction()
-        else:
-            return self.AddSlowInstruction()
+    def AddSlowInstructions(self, count):
+        """Return count multiplications and loads, half of each on average"""
+        multiply = self.sampler.Uniform(count) * 2 < 1
+        lines = numpy.empty(count, dtype=object)
+        registerCount = int(numpy.count_nonzero(multiply))
+        lines[multiply] = _Lines("        %s    %s, %s, %s\n",
+                                 self.sampler.Choice(self._slowRInstructions, registerCount),
+                                 self.sampler.Choice(self._destRegisters, registerCount),
+                                 self.sampler.Choice(self._randomRegisters, registerCount),
+                                 self.sampler.Choice(self._randomRegisters, registerCount))
+        loadCount = count - registerCount
+        offsets = [self.baseAddress + 4 * offset for offset in self.sampler.Integers(0, self.range, loadCount)]
+        lines[~multiply] = _Lines("        %s    %s, %d(%s)\n",
+                                  self.sampler.Choice(self._slowLoadInstructions, loadCount),
+                                  self.sampler.Choice(self._destRegisters, loadCount), offsets,
+                                  self.sampler.Choice(self._addrRegisters, loadCount))
+        return lines
+
+    def AddFastInstructions(self, count):
+        """Return count register and immediate ALU instructions, half of each on average"""
+        registerType = self.sampler.Uniform(count) * 2 < 1
+        lines = numpy.empty(count, dtype=object)
+        registerCount = int(numpy.count_nonzero(registerType))
+        lines[registerType] = _Lines("        %s    %s, %s, %s\n",
+                                     self.sampler.Choice(self._fastRInstructions, registerCount),
+                                     self.sampler.Choice(self._destRegisters, registerCount),
+                                     self.sampler.Choice(self._randomRegisters, registerCount),
+                                     self.sampler.Choice(self._randomRegisters, registerCount))
+        immediateCount = count - registerCount
+        lines[~registerType] = _Lines("        %s    %s, %s, %d\n",
+                                      self.sampler.Choice(self._fastIInstructions, immediateCount),
+                                      self.sampler.Choice(self._destRegisters, immediateCount),
+                                      self.sampler.Choice(self._randomRegisters, immediateCount),
+                                      self.sampler.Integers(self.minI, self.maxI, immediateCount))
+        return lines
+
+    def AddRandomInstructions(self, count):
+        fast = self.sampler.Uniform(count) * 100 < self.ratio
+        lines = numpy.empty(count, dtype=object)
+        lines[fast] = self.AddFastInstructions(int(numpy.count_nonzero(fast)))
+        lines[~fast] = self.AddSlowInstructions(count - int(numpy.count_nonzero(fast)))
+        return lines.tolist()
 
     def GenerateProgram(self, removeZero=False):
         self.AddHeader()
@@ -277,151 +353,181 @@ class IPCTemplate(InstructionBasedTemplate):
         self.RandomInitializeRegisters(self._addrRegisters, removeZero, True)
         self.ForceAlignment()
         self.AddLoopLabel()
-        for i in range(0, self.nInstructions):
-            self.program += self.AddRandomInstruction()
+        self.program.extend(self.AddRandomInstructions(self.nInstructions))
         self.AddFooter()
         self.SaveProgram()
 
 
-if __name__ == '__main__':
-    random.seed()
+rTypeInstructions = ['add', 'addw', 'sub', 'subw', 'sll', 'sllw', 'srl', 'srlw', 'sra', 'sraw', 'xor', 'or', 'and',
+                     'slt', 'sltu', 'mul', 'mulw', 'mulh', 'mulhsu', 'mulhu']
+divInstructions = ['div', 'divw', 'divu', 'divuw', 'rem', 'remw', 'remu', 'remuw']
+iTypeInstructions = ['addi', 'addiw', 'xori', 'ori', 'andi', 'slti', 'sltiu']
+liInstruction = ['li']
+uTypeInstructions = ['lui', 'auipc']
+r2TypeInstructions = ['mv']
+nopInstruction = ['nop']
+memLoadInstructions = ['lb', 'lh', 'lw', 'lbu', 'lhu']
+memStoreInstructions = ['sb', 'sh', 'sw']
+shiftImmediate = ['slli', 'slliw', 'srli', 'srliw', 'srai', 'sraiw']
+branchInstructions = ['beq', 'bne', 'blt', 'bge', 'bltu', 'bgeu']
+jumpInstructions = ['jal', 'jalr']
+
+# Template class, instructions, extra constructor arguments, destination registers reserved and whether registers
+# are initialized with nonzero values, for every group of single instruction templates
+templateGroups = [(IBTemplateTypeR, rTypeInstructions, (), 6, False),
+                  (IBTemplateTypeR, divInstructions, (), 6, True),
+                  (IBTemplateTypeI, iTypeInstructions, (0, 2047), 0, False),
+                  (IBTemplateLI, liInstruction, (0, 2047), 0, False),
+                  (IBTemplateTypeU, uTypeInstructions, (), 0, False),
+                  (IBTemplate2Registers, r2TypeInstructions, (), 0, False),
+                  (IBTemplateNOP, nopInstruction, (), 0, False),
+                  (IBTemplateMemLoad, memLoadInstructions, (0, 512), 6, False),
+                  (IBTemplateMemStore, memStoreInstructions, (0, 512), 6, False),
+                  (IBTemplateTypeShift, shiftImmediate, (), 6, False)]
+
+
+def ParseValues(text):
+    """Return the values of a comma separated list of numbers and inclusive ranges start-stop[:step]
+    (e.g. 10,50,100-1000:100)"""
+    values = []
+    for item in text.split(','):
+        if '-' in item[1:]:
+            bounds, step = (item.split(':') + ['1'])[:2]
+            start, stop = bounds.split('-', 1)
+            values.extend(range(int(start), int(stop) + 1, int(step)))
+        else:
+            values.append(int(item))
+    return values
 
-    parser = argparse.ArgumentParser(description = 'Generate characterization programs for Instruction Based Power Models')
 
-    parser.add_argument('-i', '--iterations', type=int, required=True, help='Number of loop iterations')
-    parser.add_argument('-n', '--number', type=int, required=True, help='Number of instructions to include in the loop body')
-    parser.add_argument('-o', '--output', required=False, help='Output directory for template programs')
-    parser.add_argument('-v', '--verbose', required=False, action='store_true', help='Show debug information')
-    parser.add_argument('-p', '--prefix', required=False, help='Add this prefix to all filenames')
-    args = parser.parse_args()
+# Columns of the manifest written next to the programs
+manifestColumns = ['program', 'sha1', 'template', 'instruction', 'iterations', 'body', 'ratio', 'seed']
 
-    rTypeInstructions = ['add', 'addw', 'sub', 'subw', 'sll', 'sllw', 'srl', 'srlw', 'sra', 'sraw', 'xor', 'or', 'and',
-                         'slt', 'sltu', 'mul', 'mulw', 'mulh', 'mulhsu', 'mulhu']
-    divInstructions = ['div', 'divw', 'divu', 'divuw', 'rem', 'remw', 'remu', 'remuw']
-    iTypeInstructions = ['addi', 'addiw', 'xori', 'ori', 'andi', 'slti', 'sltiu']
-    liInstruction = ['li']
-    uTypeInstructions = ['lui', 'auipc']
-    r2TypeInstructions = ['mv']
-    nopInstruction = ['nop']
-    memLoadInstructions = ['lb', 'lh', 'lw', 'lbu', 'lhu']
-    memStoreInstructions = ['sb', 'sh', 'sw']
-    shiftImmediate = ['slli', 'slliw', 'srli', 'srliw', 'srai', 'sraiw']
-    branchInstructions = ['beq', 'bne', 'blt', 'bge', 'bltu', 'bgeu']
-    jumpInstructions = ['jal', 'jalr']
-
-    for instruction in rTypeInstructions:
-        if (args.verbose):
-            print 'Instruction:', instruction
-        gen = IBTemplateTypeR(args.iterations, args.number, instruction)
-        gen.ReserveDestinationRegisters(6)
-        if (args.output is not None):
-            gen.SetDir(args.output)
-        if (args.prefix is not None):
-            gen.SetPrefix(args.prefix)
-        gen.GenerateProgram()
+# Content hashes of the programs already generated, by file name, set in every worker
+_knownHashes = {}
 
-    for instruction in divInstructions:
-        if (args.verbose):
-            print 'Instruction:', instruction
-        gen = IBTemplateTypeR(args.iterations, args.number, instruction)
-        gen.ReserveDestinationRegisters(6)
-        if (args.output is not None):
-            gen.SetDir(args.output)
-        if (args.prefix is not None):
-            gen.SetPrefix(args.prefix)
-        gen.GenerateProgram(True)
 
-    for instruction in iTypeInstructions:
-        if (args.verbose):
-            print 'Instruction:', instruction
-        gen = IBTemplateTypeI(args.iterations, args.number, instruction, 0, 2047)
-        if (args.output is not None):
-            gen.SetDir(args.output)
-        if (args.prefix is not None):
-            gen.SetPrefix(args.prefix)
-        gen.GenerateProgram()
-
-    for instruction in liInstruction:
-        if (args.verbose):
-            print 'Instruction:', instruction
-        gen = IBTemplateLI(args.iterations, args.number, instruction, 0, 2047)
-        if (args.output is not None):
-            gen.SetDir(args.output)
-        if (args.prefix is not None):
-            gen.SetPrefix(args.prefix)
-        gen.GenerateProgram()
-
-    for instruction in uTypeInstructions:
-        if (args.verbose):
-            print 'Instruction:', instruction
-        gen = IBTemplateTypeU(args.iterations, args.number, instruction)
-        if (args.output is not None):
-            gen.SetDir(args.output)
-        if (args.prefix is not None):
-            gen.SetPrefix(args.prefix)
-        gen.GenerateProgram()
-
-    for instruction in r2TypeInstructions:
-        if (args.verbose):
-            print 'Instruction:', instruction
-        gen = IBTemplate2Registers(args.iterations, args.number, instruction)
-        if (args.output is not None):
-            gen.SetDir(args.output)
-        if (args.prefix is not None):
-            gen.SetPrefix(args.prefix)
-        gen.GenerateProgram()
-
-    for instruction in nopInstruction:
-        if (args.verbose):
-            print 'Instruction:', instruction
-        gen = IBTemplateNOP(args.iterations, args.number, instruction)
-        if (args.output is not None):
-            gen.SetDir(args.output)
-        if (args.prefix is not None):
-            gen.SetPrefix(args.prefix)
-        gen.GenerateProgram()
-
-    for instruction in memLoadInstructions:
-        if (args.verbose):
-            print 'Instruction:', instruction
-        gen = IBTemplateMemLoad(args.iterations, args.number, instruction, 0, 512)
-        gen.ReserveDestinationRegisters(6)
-        if (args.output is not None):
-            gen.SetDir(args.output)
-        if (args.prefix is not None):
-            gen.SetPrefix(args.prefix)
-        gen.GenerateProgram()
+def SweepTasks(iterations, numbers, ratios, output, prefix, seed=0, programFormat='asm'):
+    """Return the (group, instruction, iterations, number, ratio, output, prefix, seed, format) of every program of a
+    sweep, group indexing templateGroups or None for the IPC templates"""
+    tasks = []
+    for i in iterations:
+        for n in numbers:
+            for group, (templateClass, instructions, arguments, destinations, removeZero) in enumerate(templateGroups):
+                tasks.extend([(group, instruction, i, n, None, output, prefix, seed, programFormat)
+                              for instruction in instructions])
+            tasks.extend([(None, None, i, n, ratio, output, prefix, seed, programFormat) for ratio in ratios])
+    return tasks
 
-    for instruction in memStoreInstructions:
-        if (args.verbose):
-            print 'Instruction:', instruction
-        gen = IBTemplateMemStore(args.iterations, args.number, instruction, 0, 512)
-        gen.ReserveDestinationRegisters(6)
-        if (args.output is not None):
-            gen.SetDir(args.output)
-        if (args.prefix is not None):
-            gen.SetPrefix(args.prefix)
-        gen.GenerateProgram()
 
-    for instruction in shiftImmediate:
-        if (args.verbose):
-            print 'Instruction:', instruction
-        gen = IBTemplateTypeShift(args.iterations, args.number, instruction)
-        gen.ReserveDestinationRegisters(6)
-        if (args.output is not None):
-            gen.SetDir(args.output)
-        if (args.prefix is not None):
-            gen.SetPrefix(args.prefix)
-        gen.GenerateProgram()
+def TemplateSeed(templateName, instruction, iterations, number, ratio, seed=0):
+    """Seed of the random values of one program, the same on every run for the same parameters"""
+    key = '%s:%s:%d:%d:%s:%d' % (templateName, instruction, iterations, number, ratio, seed)
+    return int(hashlib.sha1(key).hexdigest()[:8], 16)
 
-    for ratio in range(0, 101):
-        if (args.verbose):
-            print 'IPC:', ratio
-        gen = IPCTemplate(args.iterations, args.number, ratio)
+
+def ReadManifest(fileName):
+    """Return the rows of a program manifest by program name, empty if there is none"""
+    if not os.path.isfile(fileName):
+        return {}
+    rows = list(csv.DictReader(open(fileName)))
+    return dict([(row['program'], row) for row in rows])
+
+
+def _InitializeWorker(knownHashes):
+    global _knownHashes
+    _knownHashes = knownHashes
+
+
+def GenerateTemplate(task):
+    """Write the program of a sweep task, unless unchanged, and return its manifest row and whether it was written"""
+    group, instruction, i, n, ratio, output, prefix, seed, programFormat = task
+    templateName = templateGroups[group][0].__name__ if group is not None else IPCTemplate.__name__
+    programSeed = TemplateSeed(templateName, instruction, i, n, ratio, seed)
+    if group is None:
+        gen = IPCTemplate(i, n, ratio)
+        gen.SetSeed(programSeed)
         gen.ReserveDestinationRegisters(6)
         gen.ReserveAddressRegisters(6)
-        if (args.output is not None):
-            gen.SetDir(args.output)
-        if (args.prefix is not None):
-            gen.SetPrefix(args.prefix)
-        gen.GenerateProgram()
+        removeZero = False
+    else:
+        templateClass, instructions, arguments, destinations, removeZero = templateGroups[group]
+        gen = templateClass(i, n, instruction, *arguments)
+        gen.SetSeed(programSeed)
+        if destinations > 0:
+            gen.ReserveDestinationRegisters(destinations)
+    if output is not None:
+        gen.SetDir(output)
+    if prefix is not None:
+        gen.SetPrefix(prefix)
+    gen.SetFormat(programFormat)
+    programName = os.path.basename(gen.ProgramName())
+    gen.knownHash = _knownHashes.get(programName)
+    gen.GenerateProgram(removeZero)
+    row = {'program': programName, 'sha1': gen.hash, 'template': templateName, 'instruction': gen.instructionName,
+           'iterations': i, 'body': n, 'ratio': ratio if ratio is not None else '', 'seed': programSeed}
+    return row, gen.written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Generate characterization programs for Instruction Based Power Models')
+
+    parser.add_argument('-i', '--iterations', required=True,
+                        help='Number of loop iterations, or a list and ranges of them (e.g. 10,50,100-1000:100)')
+    parser.add_argument('-n', '--number', required=True,
+                        help='Number of instructions to include in the loop body, or a list and ranges of them')
+    parser.add_argument('-r', '--ratios', required=False, default='0-100',
+                        help='Ratios of fast instructions (in percent) of the IPC templates (default 0-100)')
+    parser.add_argument('-o', '--output', required=False, help='Output directory for template programs')
+    parser.add_argument('-v', '--verbose', required=False, action='store_true', help='Show debug information')
+    parser.add_argument('-p', '--prefix', required=False, help='Add this prefix to all filenames')
+    parser.add_argument('-j', '--jobs', required=False, type=int, default=0,
+                        help='Processes generating programs in parallel (0, the default, uses every CPU)')
+    parser.add_argument('-s', '--seed', required=False, type=int, default=0,
+                        help='Base of the per program seeds, change it for a different set of programs (default 0)')
+    parser.add_argument('-f', '--format', required=False, default='asm', choices=['asm', 'elf', 'hex'],
+                        help='Write assembly (the default), or assemble the programs into an ELF executable or a hex '
+                        'image for the Rocket emulator, without the cross toolchain')
+    parser.add_argument('-c', '--changed', required=False,
+                        help='File receiving the names of the programs written this time (new or changed), the ones '
+                        'to simulate again')
+    args = parser.parse_args()
+
+    # Programs are only rewritten when their content changes, as recorded in the manifest next to them
+    outputDir = args.output if args.output is not None else 'test-programs'
+    manifestName = os.path.join(outputDir, 'manifest.csv')
+    manifest = ReadManifest(manifestName)
+    knownHashes = dict([(program, row['sha1']) for program, row in manifest.items()])
+
+    tasks = SweepTasks(ParseValues(args.iterations), ParseValues(args.number), ParseValues(args.ratios),
+                       args.output, args.prefix, args.seed, args.format)
+
+    if args.jobs == 1:
+        _InitializeWorker(knownHashes)
+        results = (GenerateTemplate(task) for task in tasks)
+    else:
+        pool = multiprocessing.Pool(args.jobs or None, _InitializeWorker, (knownHashes,))
+        results = pool.imap(GenerateTemplate, tasks, chunksize=8)
+    changed = []
+    for row, written in results:
+        manifest[row['program']] = row
+        if written:
+            changed.append(os.path.join(outputDir, row['program']))
+        if (args.verbose):
+            print '%s %s (%d iterations, %d instructions)' % ('Generated' if written else 'Unchanged',
+                                                              row['instruction'], row['iterations'], row['body'])
+    if args.jobs != 1:
+        pool.close()
+        pool.join()
+
+    temporaryName = '%s.%d' % (manifestName, os.getpid())
+    outputFile = open(temporaryName, 'wt')
+    writer = csv.DictWriter(outputFile, manifestColumns)
+    writer.writeheader()
+    writer.writerows([manifest[program] for program in sorted(manifest.keys())])
+    outputFile.close()
+    os.rename(temporaryName, manifestName)
+
+    if args.changed is not None:
+        open(args.changed, 'wt').writelines([programName + '\n' for programName in changed])
+    print '%d programs written, %d unchanged' % (len(changed), len(tasks) - len(changed))
@@ -2,143 +2,176 @@
 
 import argparse
 import random
-import string
 import sys
-import yaml
-import bz2
-import csv
+import time
+import os
+import tracereader
+import bz2parallel
+import ibtrace
+import loopfold
+import tracewriter
+from powertable import PowerTable, TraceScorer, CoreScorer, MakeTimelines, PrintReports
+
+
+def PrintRolling(scorer, lastCycles, lastEnergy):
+    """Print the energy and power so far and over the cycles since the last call, returning the energy per table"""
+    cycles = scorer.Running + scorer.Stalled
+    energy = [scorer.RunningPower(table) + scorer.StalledPower(table) for table in range(0, len(scorer.powerTables))]
+    for table, powerTable in enumerate(scorer.powerTables):
+        frequency = powerTable.GetFrequency * 1000000
+        averagePower = 0.0
+        recentPower = 0.0
+        if cycles > 0:
+            averagePower = frequency / cycles * (energy[table] + powerTable.GetLeakage * cycles)
+        if cycles > lastCycles:
+            recentPower = frequency / (cycles - lastCycles) * (energy[table] - lastEnergy[table] +
+                                                               powerTable.GetLeakage * (cycles - lastCycles))
+        print '[%s] %s: %d cycles, %.2f %s, %.2f uW total, %.2f uW over the last %d cycles' % (
+            time.strftime('%H:%M:%S'), powerTable.library, cycles, energy[table], powerTable.unit, averagePower,
+            recentPower, cycles - lastCycles)
+    sys.stdout.flush()
+    return energy
 
 
-class PowerTable:
-    def __init__(self, inputFile):
-        inputContent = yaml.load(open(inputFile))
-
-        self.defaultCount = 0
-        self.defaultInstructions = []
-
-        self.info = inputContent['info']
-        self.stall = float(self.info.get(('stall'), 0.0))
-        self.unit = self.info.get('unit', 'unknown')
-        self.frequency = float(self.info.get('frequency', 0.0))
-        self.library = self.info.get('library', 'unknown')
-        self.leakage = self.info.get('leakage', 0.0)
-        self.default = self.info.get('default', 0.0)
-
-        if self.frequency == 0:
-            print 'Frequency not provided in YAML file, considering energy per instruction'
-            frequency = 1
-        else:
-            frequency = self.frequency
-
-        self.leakage /= frequency * 1000000
-        self.stall /= frequency * 1000000
-        self.default /= frequency * 1000000
-
-        self.instructions = inputContent['instructions']
-        for i in self.instructions.keys():
-            self.instructions[i] = float(self.instructions[i]) / (frequency * 1000000)
-
-    def GetPower(self, instruction):
-        if instruction in self.instructions:
-            return self.instructions[instruction]
-        else:
-            self.defaultCount += 1
-            if instruction not in self.defaultInstructions:
-                self.defaultInstructions.append(instruction)
-            return self.default
-
-    @property
-    def GetStallPower(self):
-        return self.stall
-
-    @property
-    def GetLeakage(self):
-        return self.leakage
-
-    @property
-    def GetFrequency(self):
-        return self.frequency
-
 if __name__ == '__main__':
     random.seed()
 
     parser = argparse.ArgumentParser(description = 'Apply the Instruction Based Power Model to a stream of instructions')
 
-    parser.add_argument('-t', '--table', required=True, help='Instruction Based Power Table to use')
-    parser.add_argument('-i', '--input', required=False, help='Input file containing instruction trace')
-    parser.add_argument('-g', '--graph', required=False, help='Generate a graphic containing power consumption')
+    parser.add_argument('-t', '--table', required=True, nargs='+', action='append',
+                        help='Instruction Based Power Table to use, several tables are scored in the same pass')
+    parser.add_argument('-i', '--input', required=False, help='Input file containing instruction trace (text, bz2 or .ibt)')
+    parser.add_argument('-g', '--graph', required=False,
+                        help='CSV file receiving the energy of every window of cycles, one row per window')
+    parser.add_argument('-w', '--window', required=False,
+                        help='Comma separated window sizes in cycles for the timeline and peak power (default 1000)')
+    parser.add_argument('-a', '--average', required=False, type=int, default=10,
+                        help='Number of windows in the moving average power (default 10)')
     parser.add_argument('-f', '--frequency', required=False, type=float, help='Processor operation frequency')
     parser.add_argument('-q', '--quiet', required=False, action='store_true', help='Show only power results')
+    parser.add_argument('--format', required=False, default='auto', choices=['auto', 'rocket', 'spike'],
+                        help='Trace format, detected from the first lines by default')
+    parser.add_argument('--no-loops', required=False, action='store_true',
+                        help='Parse and score every record, instead of folding repeated loop iterations')
+    parser.add_argument('-o', '--annotate', required=False,
+                        help='Write the annotated trace to this file instead of stdout (.bz2, .gz and .xz compress it)')
+    parser.add_argument('--annotate-cores', required=False,
+                        help='Comma separated cores whose records are annotated, other lines are left out')
+    parser.add_argument('--annotate-cycles', required=False,
+                        help='Only annotate cycles in the range start:end, other lines are left out')
+    parser.add_argument('-j', '--jobs', required=False, type=int, default=1,
+                        help='Processes decompressing a bz2 trace in parallel when not annotating (0 uses every CPU)')
+    parser.add_argument('-c', '--cores', required=False, action='store_true',
+                        help='Also report every core separately, scoring each core in its own process')
+    parser.add_argument('-F', '--follow', required=False, action='store_true',
+                        help='Follow a trace still being written (growing file or FIFO), reporting as it goes')
+    parser.add_argument('--report-cycles', required=False, type=int, default=1000000,
+                        help='With --follow, report every this many cycles (default 1000000)')
+    parser.add_argument('--report-seconds', required=False, type=float, default=10.0,
+                        help='With --follow, report at least this often (default 10 seconds)')
+    parser.add_argument('--idle', required=False, type=float,
+                        help='With --follow, stop after this many seconds without new trace lines')
 
     args = parser.parse_args()
 
-    powerTable = PowerTable(args.table)
-
-    if args.input is None:
-        inputFile = open(args.input)
-    elif args.input[-3:] == 'bz2':
-        inputFile = bz2.BZ2File(args.input)
+    if args.follow and args.input is not None and (os.path.splitext(args.input)[1] in ('.bz2', '.gz', '.xz') or
+                                                   ibtrace.IsIBT(args.input)):
+        parser.error('--follow reads plain text traces, not %s; pipe the decompressed trace through a FIFO or '
+                     'stdin instead' % args.input)
+    if ibtrace.IsIBT(args.input) and (args.annotate is not None or args.annotate_cores is not None or
+                                      args.annotate_cycles is not None):
+        parser.error('.ibt traces carry no text to annotate, give the text or bz2 trace to --annotate it')
+
+    tableNames = sum(args.table, [])
+    powerTables = [PowerTable(tableName) for tableName in tableNames]
+
+    windows = []
+    if args.window is not None:
+        windows = [int(window) for window in args.window.split(',')]
+    elif args.graph is not None:
+        windows = [1000]
+    if any([window < 1 for window in windows]):
+        parser.error('window sizes must be at least 1 cycle, not %s' % args.window)
+    if args.average < 1:
+        parser.error('the moving average needs at least 1 window, not %d' % args.average)
+    tableColumns = [os.path.splitext(os.path.basename(tableName))[0] for tableName in tableNames]
+
+    opcodes = tracereader.OpcodeIndex()
+    folder = None
+    if not args.no_loops:
+        folder = loopfold.LoopFolder()
+    traceParser = tracereader.TraceParser(opcodes, args.format, folder)
+    scorer = TraceScorer(powerTables, opcodes, MakeTimelines(windows, args.graph, tableColumns, args.average))
+    coreScorer = None
+    if args.cores:
+        coreScorer = CoreScorer(powerTables, opcodes, windows, args.graph, tableColumns, args.average)
+
+    writer = None
+    # Binary traces carry no text to annotate
+    if not ibtrace.IsIBT(args.input) and (args.annotate is not None or not args.quiet):
+        annotateCores = None
+        if args.annotate_cores is not None:
+            annotateCores = [int(core) for core in args.annotate_cores.split(',')]
+        annotateCycles = None
+        if args.annotate_cycles is not None:
+            annotateCycles = tracewriter.ParseRange(args.annotate_cycles)
+        writer = tracewriter.AnnotatedTraceWriter(tracewriter.OpenAnnotated(args.annotate),
+                                                  [powerTable.unit for powerTable in powerTables],
+                                                  annotateCores, annotateCycles)
+
+    chunks = None
+    if ibtrace.IsIBT(args.input):
+        chunks = ibtrace.ReadTraceArrays(args.input, opcodes)
+    elif writer is None and args.jobs != 1 and args.input is not None and args.input[-3:] == 'bz2':
+        chunks = bz2parallel.ReadTraceArrays(args.input, traceParser, args.jobs or None)
+
+    if chunks is not None:
+        for cores, executed, ids in chunks:
+            scorer.Score(executed, ids)
+            if coreScorer is not None:
+                coreScorer.Score(cores, executed, ids)
     else:
-        inputFile = sys.stdin
-
-    running = 0
-    runningPower = 0
-    stalled = 0
-    stalledPower = 0
-
-    energyThroughTime = []
-    cycleCounter = 0
-    energyBlock = 0.0
-
-    for line in inputFile.readlines():
-        if len(line) > 126:
-            if line[0] == 'C' and line[2] == ':':
-                core = int(line[1:2])
-                executed = line[16:17]
-                instruction = string.split(line[126:])[0]
-                if executed == '1':
-                    power = powerTable.GetPower(instruction)
-                    running += 1
-                    runningPower += power
-                else:
-                    power = powerTable.GetStallPower
-                    stalled += 1
-                    stalledPower += power
-
-                energyBlock += power
-                cycleCounter += 1
-                if (cycleCounter == 1000):
-                    energyThroughTime.append(energyBlock)
-                    cycleCounter = 0
-                    energyBlock = 0.0
-                if not args.quiet:
-                    print line[:-1], '\t', power, powerTable.unit
-            else:
-                if not args.quiet:
-                    print line
+        if args.follow:
+            buffers = tracereader.FollowBuffers(args.input, min(args.report_seconds, 0.5), args.idle)
         else:
-            if not args.quiet:
-                print line
-
-    print '***** Execution Report *****'
-    print 'Executed Instructions: %d' % (running)
-    print 'Stalled Cycles       : %d' % (stalled)
-    print 'Total Cycles         : %d' % (running + stalled)
-    print '***** Energy Consumption *****'
-    print 'Executed Instructions: %.2f %s' % (runningPower, powerTable.unit)
-    print 'Stalled Cycles       : %.2f %s' % (stalledPower, powerTable.unit)
-    print 'Total Cycles         : %.2f %s' % (runningPower + stalledPower, powerTable.unit)
-    print 'Leakage              : %.2f %s' % ((running + stalled) * powerTable.GetLeakage, powerTable.unit)
-    print '***** Power Report *****'
-    print 'Leakage              : %.2f uW' % (powerTable.GetLeakage * powerTable.GetFrequency * 1000000)
-    print 'Dynamic Power        : %.2f uW' % (powerTable.GetFrequency * 1000000 / (running + stalled) *
-                                              (runningPower + stalledPower))
-    print 'Power Total          : %.2f uW' % (powerTable.GetFrequency * 1000000 / (running + stalled) *
-                                              (runningPower + stalledPower + powerTable.GetLeakage * (running + stalled)))
-
-    if powerTable.defaultCount != 0:
-        print '%d instructions used default power:' % powerTable.defaultCount, powerTable.defaultInstructions
-
-    if (args.graph is not None):
-        csv.writer(open(args.graph, 'wt')).writerows([energyThroughTime])
-
+            buffers = tracereader.ReadBuffers(tracereader.OpenTrace(args.input))
+        lastReport = time.time()
+        lastCycles = 0
+        lastEnergy = [0.0] * len(powerTables)
+        try:
+            # Reports only need totals, so repeated records are scored once and counted as many times as they occur
+            folded = writer is None and coreScorer is None and len(windows) == 0
+            for data in buffers:
+                if len(data) > 0 and folded:
+                    cores, executed, ids, weights = traceParser.ParseFolded(data)
+                    scorer.Score(executed, ids, weights)
+                elif len(data) > 0:
+                    starts, ends, positions, cores, executed, ids = traceParser.Parse(data)
+                    power = scorer.Score(executed, ids)
+                    if coreScorer is not None:
+                        coreScorer.Score(cores, executed, ids)
+                    if writer is not None:
+                        writer.Write(data, starts, ends, positions, cores, power)
+                if args.follow:
+                    if (scorer.Running + scorer.Stalled - lastCycles >= args.report_cycles or
+                            time.time() - lastReport >= args.report_seconds):
+                        lastEnergy = PrintRolling(scorer, lastCycles, lastEnergy)
+                        lastCycles = scorer.Running + scorer.Stalled
+                        lastReport = time.time()
+        except KeyboardInterrupt:
+            # Stopping to follow a run still reports everything scored so far
+            if not args.follow:
+                raise
+
+    if writer is not None:
+        writer.Close()
+    scorer.Close()
+
+    if traceParser.skipped > 0:
+        print '%d malformed trace lines skipped' % traceParser.skipped
+
+    PrintReports(scorer, tableNames)
+
+    if coreScorer is not None:
+        for core, perCore in sorted(coreScorer.Finish().items()):
+            PrintReports(perCore, tableNames, 'Core %d' % core)
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+import argparse
+import bz2parallel
+import numpy
+import os
+import shutil
+import struct
+import tempfile
+import tracereader
+
+
+# Compact columnar trace cache (.ibt). Layout, every section aligned to 8 bytes:
+#   header     magic 'IBT1', uint64 records, uint32 opcodes, uint32 dictionary size (little endian)
+#   dictionary opcode names separated by '\n', opcode id i is the i-th name
+#   cores      uint8 per record
+#   executed   one bit per record, numpy.packbits order
+#   ids        little endian uint16 opcode id per record
+_magic = 'IBT1'
+_header = struct.Struct('<4sQII')
+
+
+def _Align(size):
+    return (size + 7) & ~7
+
+
+def _Layout(records, dictionarySize):
+    """Return the offsets of the dictionary, cores, executed and ids sections"""
+    dictionary = _header.size
+    cores = _Align(dictionary + dictionarySize)
+    executed = _Align(cores + records)
+    ids = _Align(executed + (records + 7) // 8)
+    return dictionary, cores, executed, ids
+
+
+def WriteIBT(chunks, opcodes, fileName):
+    """Write the (cores, executed, ids) chunks of a trace to fileName, returning the number of records.
+
+    Opcode ids are stored as given, so opcodes must be the OpcodeIndex the chunks were parsed with.
+    """
+    columns = [tempfile.TemporaryFile(), tempfile.TemporaryFile(), tempfile.TemporaryFile()]
+    records = 0
+    pendingBits = numpy.zeros(0, dtype=bool)
+    for cores, executed, ids in chunks:
+        if len(opcodes) > 65536:
+            raise ValueError('Too many distinct opcodes for the .ibt format: %d' % len(opcodes))
+        records += len(ids)
+        columns[0].write(cores.astype(numpy.uint8).tostring())
+        # packbits works on whole bytes, bits left over are written with the next chunk
+        bits = numpy.concatenate((pendingBits, executed))
+        whole = len(bits) & ~7
+        columns[1].write(numpy.packbits(bits[:whole]).tostring())
+        pendingBits = bits[whole:]
+        columns[2].write(ids.astype('<u2').tostring())
+    if len(pendingBits) > 0:
+        columns[1].write(numpy.packbits(pendingBits).tostring())
+
+    dictionary = '\n'.join(opcodes.names)
+    offsets = _Layout(records, len(dictionary))
+    outputFile = open(fileName, 'wb')
+    outputFile.write(_header.pack(_magic, records, len(opcodes), len(dictionary)))
+    outputFile.write(dictionary)
+    for column, offset in zip(columns, offsets[1:]):
+        outputFile.write('\0' * (offset - outputFile.tell()))
+        column.seek(0)
+        shutil.copyfileobj(column, outputFile)
+    outputFile.close()
+    return records
+
+
+def IsIBT(fileName):
+    return fileName is not None and fileName[-4:] == '.ibt'
+
+
+def ReadTraceArrays(fileName, opcodes, chunkSize=tracereader.DEFAULT_CHUNK_SIZE):
+    """Counterpart of tracereader.ReadTraceArrays for .ibt files, mapped with numpy.memmap instead of parsed"""
+    inputFile = open(fileName, 'rb')
+    magic, records, opcodeCount, dictionarySize = _header.unpack(inputFile.read(_header.size))
+    if magic != _magic:
+        raise ValueError('%s is not an .ibt trace' % fileName)
+    names = inputFile.read(dictionarySize).split('\n') if opcodeCount > 0 else []
+    inputFile.close()
+
+    table = numpy.array([opcodes.Intern(name) for name in names], dtype=numpy.int32)
+    if records == 0:
+        return
+    dictionary, coresOffset, executedOffset, idsOffset = _Layout(records, dictionarySize)
+    content = numpy.memmap(fileName, dtype=numpy.uint8, mode='r')
+    cores = content[coresOffset:coresOffset + records]
+    executed = content[executedOffset:executedOffset + (records + 7) // 8]
+    ids = content[idsOffset:idsOffset + 2 * records].view('<u2')
+
+    # Keep chunks a multiple of 8 records so they start on a byte of the executed bits
+    chunkSize = max(8, chunkSize & ~7)
+    for start in range(0, records, chunkSize):
+        end = min(start + chunkSize, records)
+        bits = numpy.unpackbits(executed[start // 8:(end + 7) // 8])[:end - start].astype(bool)
+        yield (numpy.array(cores[start:end]), bits, table[ids[start:end]])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Convert an instruction trace to the compact .ibt format')
+
+    parser.add_argument('-i', '--input', required=False, help='Input file containing instruction trace')
+    parser.add_argument('-o', '--output', required=True, help='Output .ibt file')
+    parser.add_argument('--format', required=False, default='auto', choices=['auto', 'rocket', 'spike'],
+                        help='Trace format, detected from the first lines by default')
+    parser.add_argument('-j', '--jobs', required=False, type=int, default=1,
+                        help='Processes decompressing a bz2 trace in parallel (0 uses every CPU)')
+
+    args = parser.parse_args()
+
+    opcodes = tracereader.OpcodeIndex()
+    traceParser = tracereader.TraceParser(opcodes, args.format)
+    # Both readers go through every stream of multistream (pbzip2, concatenated) bz2 traces
+    if args.jobs != 1 and args.input is not None and args.input[-3:] == 'bz2':
+        chunks = bz2parallel.ReadTraceArrays(args.input, traceParser, args.jobs or None)
+    else:
+        chunks = tracereader.ReadTraceArrays(tracereader.OpenTrace(args.input), traceParser)
+    records = WriteIBT(chunks, opcodes, args.output)
+    print 'Wrote %d records, %d opcodes, %d bytes to %s' % (records, len(opcodes), os.path.getsize(args.output),
+                                                             args.output)
+    if traceParser.skipped > 0:
+        print '%d malformed trace lines skipped' % traceParser.skipped
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+import numpy
+
+
+# Records hashed together when looking for a repeated sequence, and number of places of a buffer where a
+# repetition is looked for
+DEFAULT_WIDTH = 16
+DEFAULT_PROBES = 8
+
+# Odd multiplier of the rolling hash, so it has an inverse modulo 2**64
+_base = 0x100000001b3
+_baseInverse = pow(_base, 2 ** 63 - 1, 2 ** 64)
+
+
+def _Powers(base, count):
+    """Return base**i modulo 2**64 for i in [0, count)"""
+    powers = numpy.empty(count, dtype=numpy.uint64)
+    powers[0] = 1
+    powers[1:] = base
+    return numpy.cumprod(powers, dtype=numpy.uint64)
+
+
+def RollingHashes(keys, width):
+    """Return the polynomial hash of every width consecutive keys, entry i covering keys [i, i + width).
+
+    Computed with prefix sums modulo 2**64: the keys are scaled by decreasing powers of the base, summed, and every
+    window sum is scaled back by the power of its last key.
+    """
+    sums = numpy.cumsum(keys * _Powers(_baseInverse, len(keys)), dtype=numpy.uint64)
+    windows = sums[width - 1:].copy()
+    windows[1:] -= sums[:-width]
+    return windows * _Powers(_base, len(keys))[width - 1:]
+
+
+class LoopFolder:
+    """Finds trace records repeating an earlier record of the same buffer, as found in the iterations of a loop.
+
+    Records are given as rows of the bytes identifying them (core, executed flag, pc and instruction word, see
+    traceformat.py), two records being the same instruction when their rows are equal. Candidate loop periods are
+    taken from rolling hashes of the row stream at a few places of the buffer, then every record equal to the one a
+    period earlier is folded onto it. Rows are compared exactly, hashes only propose periods.
+    """
+    def __init__(self, width=DEFAULT_WIDTH, probes=DEFAULT_PROBES):
+        self.width = width
+        self.probes = probes
+        self.records = 0
+        self.folded = 0
+
+    def Fold(self, rows):
+        """Return, for every row, the index of the first equal row reached through the detected periods"""
+        count = len(rows)
+        source = numpy.arange(0, count)
+        self.records += count
+        if count < 2 * self.width:
+            return source
+
+        rows = numpy.ascontiguousarray(rows)
+        text = rows.view('S%d' % rows.shape[1]).ravel()
+        multipliers = _Powers(_base, rows.shape[1])
+        hashes = RollingHashes(rows.astype(numpy.uint64).dot(multipliers), self.width)
+
+        periods = []
+        for anchor in numpy.linspace(0, len(hashes) - 1, self.probes).astype(int).tolist():
+            if source[anchor] != anchor:
+                continue
+            later = numpy.flatnonzero(hashes[anchor + 1:] == hashes[anchor])
+            if len(later) == 0 or later[0] + 1 in periods:
+                continue
+            period = int(later[0]) + 1
+            periods.append(period)
+            repeated = numpy.flatnonzero(text[period:] == text[:-period]) + period
+            repeated = repeated[source[repeated] == repeated]
+            source[repeated] = repeated - period
+
+        # Follow chains of folded records (one per loop iteration) back to the first one
+        while True:
+            first = source[source]
+            if numpy.array_equal(first, source):
+                break
+            source = first
+        self.folded += count - int(numpy.count_nonzero(source == numpy.arange(0, count)))
+        return source
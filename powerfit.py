@@ -0,0 +1,227 @@
+#!/usr/bin/python
+
+import argparse
+import csv
+import numpy
+import sys
+import time
+import powerreport
+from resultcsv import LoadResults
+
+
+# The measured power of a run is modeled as the mean of the power of its cycles: sum over instructions (and 'stall')
+# of the fraction of the cycles spent on it times its power per cycle, the values of a power table. Leakage cannot
+# be told apart from these (the fractions of every run add up to one), so it is given or read from power reports.
+_infoKeys = ['frequency', 'library', 'unit', 'stall', 'leakage', 'default']
+
+
+def NNLS(gram, moment, tolerance=1e-10, iterations=None):
+    """Lawson-Hanson non-negative least squares on the normal equations.
+
+    Returns the x >= 0 minimizing |Ax - b| given gram = A'A and moment = A'b, so that the cost of an iteration only
+    depends on the number of columns of A, not on its rows.
+    """
+    count = len(moment)
+    if iterations is None:
+        iterations = 3 * count
+    x = numpy.zeros(count)
+    passive = numpy.zeros(count, dtype=bool)
+    scale = tolerance * max(1.0, numpy.abs(gram).max())
+    gradient = moment.copy()
+
+    for iteration in range(0, iterations):
+        candidates = numpy.where(passive, -numpy.inf, gradient)
+        best = int(numpy.argmax(candidates))
+        if candidates[best] <= scale:
+            break
+        passive[best] = True
+        while True:
+            z = numpy.zeros(count)
+            selected = numpy.flatnonzero(passive)
+            z[selected] = numpy.linalg.lstsq(gram[numpy.ix_(selected, selected)], moment[selected], rcond=None)[0]
+            negative = passive & (z <= 0)
+            if not negative.any():
+                break
+            # Step back towards x until the first passive coefficient reaches zero, and release it
+            alpha = numpy.min(x[negative] / (x[negative] - z[negative]))
+            x += alpha * (z - x)
+            passive &= x > scale
+            x[~passive] = 0.0
+        x = z
+        gradient = moment - gram.dot(x)
+    return x
+
+
+def MergeResults(results):
+    """Join the (runs, opcodes, counts, power) of several result CSVs over the union of their instructions"""
+    names = sorted(set().union(*[set(opcodes.tolist()) for runs, opcodes, counts, power in results]))
+    column = dict([(name, index) for index, name in enumerate(names)])
+    allRuns = []
+    allCounts = []
+    allPower = []
+    for runs, opcodes, counts, power in results:
+        merged = numpy.zeros((len(runs), len(names)), dtype=numpy.int64)
+        merged[:, [column[opcode] for opcode in opcodes.tolist()]] = counts
+        allRuns.append(runs)
+        allCounts.append(merged)
+        allPower.append(power)
+    return (numpy.concatenate(allRuns), numpy.array(names), numpy.vstack(allCounts), numpy.concatenate(allPower))
+
+
+def DesignMatrix(opcodes, counts):
+    """Return (names, fractions): the instructions executed by some run and the share of the cycles of every run
+    spent on each of them"""
+    used = counts.sum(axis=0) > 0
+    cycles = counts.sum(axis=1).astype(numpy.float64)
+    return opcodes[used], counts[:, used] / cycles[:, numpy.newaxis]
+
+
+def Fit(fractions, power):
+    """Fit the non-negative power per cycle of every column of fractions to the measured power of the runs"""
+    return NNLS(fractions.T.dot(fractions), fractions.T.dot(power))
+
+
+def CrossValidate(fractions, power, folds, seed=0):
+    """Return the prediction of every run by a fit to the runs of the other folds (k-fold cross-validation).
+
+    The normal equations of each fold are those of all runs minus the runs of the fold, so that the matrix is only
+    multiplied once.
+    """
+    fold = numpy.empty(len(power), dtype=numpy.int64)
+    fold[numpy.random.RandomState(seed).permutation(len(power))] = numpy.arange(len(power)) % folds
+    gram = fractions.T.dot(fractions)
+    moment = fractions.T.dot(power)
+    predicted = numpy.zeros(len(power))
+    for k in range(0, folds):
+        held = fold == k
+        heldFractions = fractions[held]
+        x = NNLS(gram - heldFractions.T.dot(heldFractions), moment - heldFractions.T.dot(power[held]))
+        predicted[held] = heldFractions.dot(x)
+    return predicted
+
+
+def ReadTableValues(fileName):
+    """Return the (info, instructions) of a YAML power table as written, not scaled to energy per cycle"""
+    import yaml
+
+    content = yaml.safe_load(open(fileName).read())
+    return dict(content['info']), dict(content['instructions'])
+
+
+def ReportLeakage(patterns):
+    """Mean leakage of the top block of the power reports named by directories and glob patterns, None if none"""
+    fileNames = powerreport.ExpandReports(patterns)
+    reports = powerreport.ReadReports(fileNames)
+    leakages = [reports[fileName].Top().Leakage() for fileName in fileNames if reports[fileName].Top() is not None]
+    if len(leakages) == 0:
+        return None
+    return sum(leakages) / len(leakages)
+
+
+def _Value(value):
+    if isinstance(value, float):
+        return '%.6g' % value
+    return str(value)
+
+
+def WriteTable(fileName, info, instructions):
+    """Write a power table in the layout of the riscv-ib-*.yaml files"""
+    keys = [key for key in _infoKeys if key in info] + sorted([key for key in info if key not in _infoKeys])
+    outputFile = open(fileName, 'wt')
+    outputFile.write('info: {\n' + ',\n'.join([' %s: %s' % (key, _Value(info[key])) for key in keys]) + '\n}\n')
+    outputFile.write('instructions: {\n' + ',\n'.join(['%s: %s' % (name, _Value(instructions[name]))
+                                                    for name in sorted(instructions.keys())]) + '\n}\n')
+    outputFile.close()
+
+
+def _Summary(label, measured, predicted):
+    residual = measured - predicted
+    print '%-16s: RMS residual %.2f, mean relative error %.2f%%, worst %.2f%%' % (
+        label, numpy.sqrt(numpy.mean(residual ** 2)), 100 * numpy.mean(numpy.abs(residual) / measured),
+        100 * numpy.max(numpy.abs(residual) / measured))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Fit the instruction powers of a power table to the measured '
+                                     'power of characterization runs')
+
+    parser.add_argument('results', nargs='+', help='Result CSVs with the instruction counts and power of runs '
+                        '(consolidateResults.py or resultstore.py exports, see resultcsv.py)')
+    parser.add_argument('-o', '--output', required=True, help='YAML power table to write')
+    parser.add_argument('-b', '--base', required=False,
+                        help='Power table the info fields and the instructions missing from the runs are taken from')
+    parser.add_argument('-k', '--folds', required=False, type=int, default=0,
+                        help='Number of folds of the cross-validation (default none)')
+    parser.add_argument('-r', '--residuals', required=False,
+                        help='CSV file receiving the measured, fitted and cross-validated power of every run')
+    parser.add_argument('-p', '--reports', required=False, nargs='+',
+                        help='Power reports, directories or glob patterns of them, to take the mean leakage from')
+    parser.add_argument('--leakage', required=False, type=float, help='Leakage power of the table')
+    parser.add_argument('--default', required=False, type=float,
+                        help='Power of instructions missing from the table (default the mean of the fitted ones, '
+                        'weighted by their counts)')
+    parser.add_argument('--frequency', required=False, type=float, help='Clock frequency in MHz')
+    parser.add_argument('--library', required=False, help='Library name')
+    parser.add_argument('--unit', required=False, help='Energy unit')
+    parser.add_argument('--seed', required=False, type=int, default=0, help='Seed of the fold assignment')
+
+    args = parser.parse_args()
+
+    started = time.time()
+    runs, opcodes, counts, power = MergeResults([LoadResults(fileName) for fileName in args.results])
+    valid = ~numpy.isnan(power) & (power > 0) & (counts.sum(axis=1) > 0)
+    if numpy.count_nonzero(~valid) > 0:
+        print 'Skipping %d runs without power or instructions' % numpy.count_nonzero(~valid)
+    runs, counts, power = runs[valid], counts[valid], power[valid]
+    if len(runs) == 0:
+        sys.exit('No run with both power and instruction counts')
+
+    names, fractions = DesignMatrix(opcodes, counts)
+    x = Fit(fractions, power)
+    fitted = fractions.dot(x)
+    print 'Fitted %d instructions to %d runs in %.2f s' % (len(names), len(runs), time.time() - started)
+    _Summary('Fit', power, fitted)
+    predicted = None
+    if args.folds > 1:
+        predicted = CrossValidate(fractions, power, min(args.folds, len(runs)), args.seed)
+        _Summary('%d-fold' % args.folds, power, predicted)
+
+    info, instructions = {'frequency': 50, 'library': 'unknown', 'unit': 'uJ', 'leakage': 0}, {}
+    if args.base is not None:
+        info, instructions = ReadTableValues(args.base)
+    fittedPower = dict(zip(names.tolist(), x.tolist()))
+    if 'stall' in fittedPower:
+        info['stall'] = fittedPower.pop('stall')
+    instructions.update(fittedPower)
+
+    if args.default is not None:
+        info['default'] = args.default
+    else:
+        executed = names != 'stall'
+        totals = counts.sum(axis=0)
+        weights = totals[totals > 0][executed]
+        info['default'] = float(numpy.dot(x[executed], weights) / weights.sum())
+    if 'stall' not in info:
+        info['stall'] = info['default']
+    if args.reports is not None:
+        leakage = ReportLeakage(args.reports)
+        if leakage is None:
+            print 'No power report found, leakage left unchanged'
+        else:
+            info['leakage'] = leakage
+    for key in ['leakage', 'frequency', 'library', 'unit']:
+        if getattr(args, key) is not None:
+            info[key] = getattr(args, key)
+
+    WriteTable(args.output, info, instructions)
+    print 'Wrote %s' % args.output
+
+    if args.residuals is not None:
+        outputTable = [['run', 'measured', 'fitted', 'residual'] + (['predicted', 'error'] if predicted is not None
+                                                                    else [])]
+        for run in range(0, len(runs)):
+            outputLine = [runs[run], power[run], fitted[run], power[run] - fitted[run]]
+            if predicted is not None:
+                outputLine += [predicted[run], power[run] - predicted[run]]
+            outputTable.append(outputLine)
+        csv.writer(open(args.residuals, 'wt')).writerows(outputTable)
@@ -0,0 +1,274 @@
+#!/usr/bin/python
+
+import argparse
+import cPickle
+import csv
+import glob
+import multiprocessing
+import os
+import re
+import sys
+
+
+# Column headers of hierarchical power reports (Design Compiler report_power -hier, RTL Compiler/Genus
+# report power), matched by their first letters
+_columnNames = [('cell', 'cells'), ('leak', 'leakage'), ('dyn', 'dynamic'), ('int', 'internal'),
+                ('switch', 'switching'), ('total', 'total'), ('%', 'percent')]
+_unit = re.compile(r'\((\w+)\)')
+_token = re.compile(r'\S+')
+
+# Parsed reports of a directory are cached in this file, next to them
+_cacheName = '.pwrcache'
+_cacheVersion = 1
+
+
+def _ColumnName(token):
+    token = token.lower()
+    for prefix, name in _columnNames:
+        if token.startswith(prefix):
+            return name
+    return None
+
+
+def _IsNumber(token):
+    try:
+        float(token)
+        return True
+    except ValueError:
+        return False
+
+
+class PowerBlock:
+    """One row of the hierarchy of a power report: a block, its indentation level and its power columns"""
+    def __init__(self, name, module, depth, values, tokens):
+        self.name = name
+        self.module = module
+        self.depth = depth
+        self.values = values
+        self.tokens = tokens
+
+    def Dynamic(self):
+        if 'dynamic' in self.values:
+            return self.values['dynamic']
+        return self.values.get('internal', 0.0) + self.values.get('switching', 0.0)
+
+    def Leakage(self):
+        return self.values.get('leakage', 0.0)
+
+    def Total(self):
+        if 'total' in self.values:
+            return self.values['total']
+        return self.Dynamic() + self.Leakage()
+
+
+class PowerReport:
+    """The blocks of a hierarchical power report, found by content rather than by line number.
+
+    The column header is the line naming at least two power columns including the total, possibly continued on
+    the next lines (names are matched to columns by where they end), the units being taken from parentheses (e.g.
+    Power(nW)). Rows are the following lines ending with one number per column, the block name (and module, in
+    parentheses) before them and the depth given by their indentation.
+    """
+    def __init__(self, fileName=None):
+        self.fileName = fileName
+        self.columns = []
+        self.units = {}
+        self.blocks = []
+        self.rocketTokens = None
+        if fileName is not None:
+            self.Parse(open(fileName).readlines())
+
+    def _Header(self, line, columns):
+        """Add the column names (and units) of a header line to columns, a list of (end, name, unit) sorted by the
+        column where each name ends"""
+        for match in _token.finditer(line):
+            token = match.group(0)
+            name = _ColumnName(token)
+            unit = _unit.search(token)
+            if name is not None and name not in [column[1] for column in columns]:
+                columns.append([match.end(), name, unit.group(1) if unit is not None else None])
+            elif unit is not None and len(columns) > 0:
+                # Power(nW) under a name of the line above
+                nearest = min(columns, key=lambda column: abs(column[0] - match.end()))
+                nearest[2] = unit.group(1)
+        columns.sort()
+
+    def Parse(self, lines):
+        rows = []
+        columns = []
+        inHeader = False
+        for line in lines:
+            tokens = line.split()
+            if len(tokens) == 0:
+                continue
+            if self.rocketTokens is None and tokens[0] == 'Rocket':
+                self.rocketTokens = tokens
+            numeric = [_IsNumber(token) for token in tokens]
+            names = [_ColumnName(token) for token in tokens]
+            if ('total' in names and len([name for name in names if name is not None]) >= 2 and '=' not in tokens and
+                    not any(numeric)):
+                columns = []
+                self._Header(line, columns)
+                inHeader = True
+                continue
+            if inHeader and not any(numeric):
+                # Header spread over several lines, ended by the first row or dashed line
+                if line.strip('- \n') == '':
+                    inHeader = False
+                else:
+                    self._Header(line, columns)
+                continue
+            inHeader = False
+            if len(columns) == 0:
+                continue
+
+            self.columns = [column[1] for column in columns]
+            self.units = dict([(column[1], column[2]) for column in columns if column[2] is not None])
+            count = len(columns)
+            if len(tokens) <= count or not all(numeric[-count:]):
+                continue
+            nameTokens = tokens[:-count]
+            module = None
+            if len(nameTokens) > 1 and nameTokens[-1][0] == '(' and nameTokens[-1][-1] == ')':
+                module = nameTokens.pop()[1:-1]
+            values = dict(zip(self.columns, [float(token) for token in tokens[-count:]]))
+            rows.append((len(line) - len(line.lstrip()), ' '.join(nameTokens), module, values, tokens))
+
+        levels = sorted(set([row[0] for row in rows]))
+        self.blocks = [PowerBlock(name, module, levels.index(indent), values, tokens)
+                       for indent, name, module, values, tokens in rows]
+
+    def Find(self, name):
+        """Return the first block named name (or instancing module name), None if there is none"""
+        for block in self.blocks:
+            if block.name == name or block.module == name:
+                return block
+        return None
+
+    def Top(self):
+        """Return the top block (Rocket), or the first one of the report if none is called so"""
+        block = self.Find('Rocket')
+        if block is None and len(self.blocks) > 0:
+            block = self.blocks[0]
+        return block
+
+    def RocketPower(self):
+        """The number the consolidation scripts always used: the fourth word of the first line starting with Rocket
+        (its dynamic power in RTL Compiler reports), 0.0 without one"""
+        if self.rocketTokens is None or len(self.rocketTokens) < 4 or not _IsNumber(self.rocketTokens[3]):
+            return 0.0
+        return float(self.rocketTokens[3])
+
+
+def PowerName(fileName):
+    """Name of the power report of a run, given the name of its instruction count CSV"""
+    powerName = fileName.replace('.instr.csv', '.pwr')
+    if powerName == fileName or not os.path.isfile(powerName):
+        powerName = fileName.replace('.csv', '.pwr')
+    return powerName
+
+
+def ParsePowerReport(fileName):
+    return PowerReport(fileName)
+
+
+def ExpandReports(patterns):
+    """Return the sorted .pwr files named by directories and glob patterns"""
+    fileNames = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.pwr')
+        fileNames.update([fileName for fileName in glob.glob(pattern) if os.path.isfile(fileName)])
+    return sorted(fileNames)
+
+
+def _LoadCache(directory):
+    try:
+        version, reports = cPickle.load(open(os.path.join(directory, _cacheName), 'rb'))
+        if version == _cacheVersion:
+            return reports
+    except (IOError, EOFError, ValueError, AttributeError, ImportError, cPickle.UnpicklingError):
+        pass
+    return {}
+
+
+def _SaveCache(directory, reports):
+    cacheName = os.path.join(directory, _cacheName)
+    temporaryName = '%s.%d' % (cacheName, os.getpid())
+    try:
+        cPickle.dump((_cacheVersion, reports), open(temporaryName, 'wb'), cPickle.HIGHEST_PROTOCOL)
+        os.rename(temporaryName, cacheName)
+    except (IOError, OSError):
+        # A read-only directory only loses the cache
+        pass
+
+
+def ReadReports(fileNames, jobs=None):
+    """Parse power reports in a pool of jobs processes (all CPUs by default), returning a PowerReport per name.
+
+    Reports are cached per directory by mtime and size, only new or modified ones are parsed again.
+    """
+    directories = {}
+    for fileName in fileNames:
+        directories.setdefault(os.path.dirname(os.path.abspath(fileName)), []).append(fileName)
+
+    reports = {}
+    pending = []
+    caches = {}
+    for directory, names in directories.items():
+        caches[directory] = _LoadCache(directory)
+        for fileName in names:
+            info = os.stat(fileName)
+            cached = caches[directory].get(os.path.basename(fileName))
+            if cached is not None and cached[0] == info.st_mtime and cached[1] == info.st_size:
+                reports[fileName] = cached[2]
+            else:
+                pending.append((fileName, info))
+
+    if len(pending) > 0:
+        if jobs == 1 or len(pending) == 1:
+            parsed = [ParsePowerReport(fileName) for fileName, info in pending]
+        else:
+            pool = multiprocessing.Pool(jobs)
+            try:
+                parsed = pool.map(ParsePowerReport, [fileName for fileName, info in pending], chunksize=16)
+            finally:
+                pool.terminate()
+        for (fileName, info), report in zip(pending, parsed):
+            reports[fileName] = report
+            directory = os.path.dirname(os.path.abspath(fileName))
+            caches[directory][os.path.basename(fileName)] = (info.st_mtime, info.st_size, report)
+        for directory in set([os.path.dirname(os.path.abspath(fileName)) for fileName, info in pending]):
+            _SaveCache(directory, caches[directory])
+    return reports
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Read the power per block of power reports')
+
+    parser.add_argument('reports', nargs='+', help='Power reports (.pwr), directories or glob patterns of them')
+    parser.add_argument('-o', '--output', required=False,
+                        help='CSV file receiving report, block, depth, dynamic, leakage and total power per block')
+    parser.add_argument('-d', '--depth', required=False, type=int,
+                        help='Deepest level of the hierarchy written (0 is the top block, default all)')
+    parser.add_argument('-j', '--jobs', required=False, type=int, default=0,
+                        help='Processes parsing reports in parallel (0, the default, uses every CPU)')
+
+    args = parser.parse_args()
+
+    # Through the module, so that cached reports are pickled as powerreport.PowerReport rather than __main__'s
+    import powerreport
+    fileNames = powerreport.ExpandReports(args.reports)
+    reports = powerreport.ReadReports(fileNames, args.jobs or None)
+
+    outputTable = [['report', 'block', 'module', 'depth', 'dynamic', 'leakage', 'total']]
+    for fileName in fileNames:
+        for block in reports[fileName].blocks:
+            if args.depth is None or block.depth <= args.depth:
+                outputTable.append([fileName, block.name, block.module or '', block.depth, block.Dynamic(),
+                                    block.Leakage(), block.Total()])
+
+    if args.output is not None:
+        csv.writer(open(args.output, 'wt')).writerows(outputTable)
+    else:
+        csv.writer(sys.stdout).writerows(outputTable)
@@ -0,0 +1,455 @@
+#!/usr/bin/python
+
+import collections
+import cPickle
+import csv
+import hashlib
+import multiprocessing
+import numpy
+import os
+import tracereader
+
+
+# Pseudo-instructions scored as the instruction they expand to, unless the table has an entry of their own
+_aliases = {'beqz': 'beq', 'bnez': 'bne', 'blez': 'bge', 'bgez': 'bge', 'bltz': 'blt', 'bgtz': 'blt',
+            'bgt': 'blt', 'ble': 'bge', 'bgtu': 'bltu', 'bleu': 'bgeu',
+            'mv': 'addi', 'li': 'addi', 'nop': 'addi', 'not': 'xori', 'sext.w': 'addiw',
+            'neg': 'sub', 'negw': 'subw', 'seqz': 'sltiu', 'snez': 'sltu', 'sltz': 'slt', 'sgtz': 'slt',
+            'j': 'jal', 'jr': 'jalr', 'ret': 'jalr'}
+
+# Bump whenever the content of the compiled tables changes
+_compiledVersion = 1
+
+
+def _CompileTable(content):
+    """Turn the YAML text of a power table into the attributes of a PowerTable, energies scaled per cycle"""
+    # Only needed when the compiled cache is missing or stale
+    import yaml
+
+    inputContent = yaml.load(content)
+
+    info = inputContent['info']
+    table = {'info': info,
+             'unit': info.get('unit', 'unknown'),
+             'frequency': float(info.get('frequency', 0.0)),
+             'library': info.get('library', 'unknown')}
+
+    if table['frequency'] == 0:
+        frequency = 1
+    else:
+        frequency = table['frequency']
+
+    table['stall'] = float(info.get('stall', 0.0)) / (frequency * 1000000)
+    table['leakage'] = float(info.get('leakage', 0.0)) / (frequency * 1000000)
+    table['default'] = float(info.get('default', 0.0)) / (frequency * 1000000)
+
+    instructions = {}
+    for i in inputContent['instructions'].keys():
+        instructions[i] = float(inputContent['instructions'][i]) / (frequency * 1000000)
+    table['instructions'] = instructions
+
+    # Interned opcode index: every mnemonic (or alias) maps to a position of the energies list
+    table['names'] = sorted(instructions.keys())
+    table['energies'] = [instructions[name] for name in table['names']]
+    lookup = dict([(name, opcode) for opcode, name in enumerate(table['names'])])
+    for alias, target in _aliases.items():
+        if alias not in lookup and target in lookup:
+            lookup[alias] = lookup[target]
+    table['lookup'] = lookup
+    return table
+
+
+def _LoadTable(inputFile):
+    """Return the compiled form of a YAML power table, cached next to it in <inputFile>c.
+
+    The cache is used as is while the YAML modification time and size are unchanged; otherwise it is still reused
+    if the YAML content hash matches, and recompiled if not. Failing to write the cache is not an error.
+    """
+    cacheName = inputFile + 'c'
+    status = os.stat(inputFile)
+    cached = None
+    try:
+        cached = cPickle.load(open(cacheName, 'rb'))
+        if cached.get('version') != _compiledVersion:
+            cached = None
+    except Exception:
+        cached = None
+
+    if cached is not None and cached['mtime'] == status.st_mtime and cached['size'] == status.st_size:
+        return cached['table']
+
+    content = open(inputFile).read()
+    digest = hashlib.sha1(content).hexdigest()
+    if cached is not None and cached['hash'] == digest:
+        table = cached['table']
+    else:
+        table = _CompileTable(content)
+
+    try:
+        temporaryName = '%s.%d' % (cacheName, os.getpid())
+        cPickle.dump({'version': _compiledVersion, 'mtime': status.st_mtime, 'size': status.st_size,
+                      'hash': digest, 'table': table}, open(temporaryName, 'wb'), cPickle.HIGHEST_PROTOCOL)
+        os.rename(temporaryName, cacheName)
+    except (IOError, OSError):
+        pass
+    return table
+
+
+class PowerTable:
+    def __init__(self, inputFile):
+        table = _LoadTable(inputFile)
+
+        self.defaultCount = 0
+        self.defaultInstructions = collections.Counter()
+
+        self.info = table['info']
+        self.stall = table['stall']
+        self.unit = table['unit']
+        self.frequency = table['frequency']
+        self.library = table['library']
+        self.leakage = table['leakage']
+        self.default = table['default']
+        self.instructions = table['instructions']
+        self.names = table['names']
+        self.energies = table['energies']
+        self.lookup = table['lookup']
+
+        if self.frequency == 0:
+            print 'Frequency not provided in YAML file, considering energy per instruction'
+
+    def Resolve(self, instruction):
+        """Return the table mnemonic used for instruction, following pseudo-instruction aliases, or None"""
+        opcode = self.lookup.get(instruction)
+        if opcode is None:
+            return None
+        return self.names[opcode]
+
+    def GetPower(self, instruction):
+        opcode = self.lookup.get(instruction)
+        if opcode is not None:
+            return self.energies[opcode]
+        else:
+            self.defaultCount += 1
+            self.defaultInstructions[instruction] += 1
+            return self.default
+
+    def EnergyVector(self, names):
+        """Return the energy of each mnemonic in names as an array, plus a mask of the ones not in the table"""
+        energies = numpy.array(self.energies + [self.default], dtype=numpy.float64)
+        opcodes = numpy.array([self.lookup.get(name, len(self.energies)) for name in names], dtype=numpy.int64)
+        return energies[opcodes], opcodes == len(self.energies)
+
+    @property
+    def GetStallPower(self):
+        return self.stall
+
+    @property
+    def GetLeakage(self):
+        return self.leakage
+
+    @property
+    def GetFrequency(self):
+        return self.frequency
+
+
+class Timeline:
+    """Energy spent in consecutive windows of blockSize cycles, streamed to a CSV file while the trace is scored.
+
+    Every row holds the first cycle of a window followed by its energy under each table. Only running statistics
+    are kept in memory: the peak window and the peak of the moving average over the last `average` windows. A
+    window that is not complete when the trace ends is dropped.
+    """
+    def __init__(self, blockSize, fileName=None, tableNames=None, average=10):
+        self.blockSize = blockSize
+        self.fileName = fileName
+        self.tableNames = tableNames
+        self.average = average
+        self.windows = 0
+        self.peakEnergy = None
+        self.peakCycle = None
+        self.peakAverage = None
+        self._pending = None
+        self._history = None
+        self._outputFile = None
+        self._writer = None
+
+    def _Write(self, energyBlocks):
+        if self.fileName is None:
+            return
+        if self._outputFile is None:
+            # Opened on first use, so timelines can be handed to worker processes before scoring starts
+            self._outputFile = open(self.fileName, 'wt')
+            self._writer = csv.writer(self._outputFile)
+            if self.tableNames is not None:
+                self._writer.writerow(['cycle'] + list(self.tableNames))
+        cycles = numpy.arange(self.windows, self.windows + energyBlocks.shape[1]) * self.blockSize
+        self._writer.writerows([[cycle] + energy for cycle, energy in zip(cycles.tolist(), energyBlocks.T.tolist())])
+
+    def Add(self, power):
+        """Account for the energy of some cycles, one row per table"""
+        # Cycles that do not fill a whole window are kept until the next chunk arrives
+        if self._pending is not None and self._pending.shape[1] > 0:
+            cycles = numpy.hstack((self._pending, power))
+        else:
+            cycles = power
+        blocks = cycles.shape[1] // self.blockSize
+        self._pending = cycles[:, blocks * self.blockSize:]
+        if blocks == 0:
+            return
+        energyBlocks = cycles[:, :blocks * self.blockSize].reshape(len(cycles), blocks, self.blockSize).sum(axis=2)
+        self._Write(energyBlocks)
+
+        peak = energyBlocks.argmax(axis=1)
+        peakEnergy = energyBlocks[numpy.arange(len(energyBlocks)), peak]
+        if self.peakEnergy is None:
+            self.peakEnergy = numpy.zeros(len(energyBlocks))
+            self.peakCycle = numpy.zeros(len(energyBlocks), dtype=numpy.int64)
+            self.peakAverage = numpy.zeros(len(energyBlocks))
+        higher = peakEnergy > self.peakEnergy
+        self.peakEnergy[higher] = peakEnergy[higher]
+        self.peakCycle[higher] = (self.windows + peak[higher]) * self.blockSize
+
+        # Moving sums over `average` windows, carrying the last average - 1 windows over to the next chunk
+        if self._history is not None:
+            recent = numpy.hstack((self._history, energyBlocks))
+        else:
+            recent = energyBlocks
+        if recent.shape[1] >= self.average:
+            sums = numpy.cumsum(numpy.hstack((numpy.zeros((len(recent), 1)), recent)), axis=1)
+            moving = (sums[:, self.average:] - sums[:, :-self.average]) / self.average
+            self.peakAverage = numpy.maximum(self.peakAverage, moving.max(axis=1))
+        self._history = recent[:, max(0, recent.shape[1] - self.average + 1):]
+        self.windows += blocks
+
+    def Close(self):
+        if self._outputFile is not None:
+            self._outputFile.close()
+            self._outputFile = None
+            self._writer = None
+
+
+def MakeTimelines(windows, graphName=None, tableNames=None, average=10):
+    """Return a Timeline per window size. With several sizes, each CSV file name gets its size appended."""
+    timelines = []
+    for window in windows:
+        fileName = graphName
+        if graphName is not None and len(windows) > 1:
+            base, extension = os.path.splitext(graphName)
+            fileName = '%s-%d%s' % (base, window, extension)
+        timelines.append(Timeline(window, fileName, tableNames, average))
+    return timelines
+
+
+class TraceScorer:
+    """Accumulates the energy of a trace chunk by chunk, under one or several power tables at once.
+
+    Chunks are given as arrays of executed flags and opcode ids (see tracereader.ReadTraceArrays). Executed
+    instructions are counted per opcode with numpy.bincount and only turned into energy when a report is
+    requested, so totals do not depend on how the trace was chunked. The energies of all tables are kept in a
+    tables x opcodes matrix; methods taking a table argument report on powerTables[table]. The energy of every
+    cycle is also handed to the given Timelines.
+    """
+    def __init__(self, powerTables, opcodes, timelines=()):
+        if isinstance(powerTables, PowerTable):
+            powerTables = [powerTables]
+        self.powerTables = list(powerTables)
+        self.opcodes = opcodes
+        self.timelines = list(timelines)
+        self.counts = numpy.zeros(0, dtype=numpy.int64)
+        self.stalled = 0
+        self.stall = numpy.array([powerTable.GetStallPower for powerTable in self.powerTables], dtype=numpy.float64)
+        self.energy = numpy.zeros((len(self.powerTables), 0), dtype=numpy.float64)
+        self.unknown = numpy.zeros((len(self.powerTables), 0), dtype=bool)
+
+    def _Grow(self):
+        known = self.energy.shape[1]
+        if known < len(self.opcodes):
+            vectors = [powerTable.EnergyVector(self.opcodes.names[known:]) for powerTable in self.powerTables]
+            self.energy = numpy.hstack((self.energy, numpy.vstack([energy for energy, unknown in vectors])))
+            self.unknown = numpy.hstack((self.unknown, numpy.vstack([unknown for energy, unknown in vectors])))
+            self.counts = numpy.concatenate((self.counts, numpy.zeros(len(self.opcodes) - known, dtype=numpy.int64)))
+
+    def Score(self, executed, ids, weights=None):
+        """Account for one chunk and return the energy spent on each of its cycles, one row per table.
+
+        With weights (see tracereader.TraceParser.ParseFolded) every record counts weights times and nothing is
+        returned, as the records are no longer in cycle order. Timelines need the cycles and take no weights.
+        """
+        self._Grow()
+        if weights is not None:
+            if len(self.timelines) > 0:
+                raise ValueError('Weighted records cannot be added to a timeline')
+            self.counts += numpy.bincount(ids[executed], weights[executed],
+                                          minlength=len(self.counts)).astype(numpy.int64)
+            self.stalled += int(weights[~executed].sum())
+            return None
+
+        self.counts += numpy.bincount(ids[executed], minlength=len(self.counts))
+        self.stalled += len(executed) - int(numpy.count_nonzero(executed))
+
+        power = numpy.where(executed, self.energy[:, ids], self.stall[:, numpy.newaxis])
+        for timeline in self.timelines:
+            timeline.Add(power)
+
+        return power
+
+    def Close(self):
+        for timeline in self.timelines:
+            timeline.Close()
+
+    @property
+    def Running(self):
+        return int(self.counts.sum())
+
+    @property
+    def Stalled(self):
+        return self.stalled
+
+    def RunningPower(self, table=0):
+        self._Grow()
+        return float(numpy.dot(self.energy[table], self.counts))
+
+    def StalledPower(self, table=0):
+        return self.stalled * self.stall[table]
+
+    def DefaultCount(self, table=0):
+        self._Grow()
+        return int(self.counts[self.unknown[table]].sum())
+
+    def DefaultInstructions(self, table=0):
+        self._Grow()
+        return [self.opcodes.names[i] for i in numpy.flatnonzero(self.unknown[table] & (self.counts > 0))]
+
+
+def PrintReport(scorer, table=0):
+    """Print the execution, energy and power report of a TraceScorer under one of its tables"""
+    powerTable = scorer.powerTables[table]
+    running = scorer.Running
+    runningPower = scorer.RunningPower(table)
+    stalled = scorer.Stalled
+    stalledPower = scorer.StalledPower(table)
+
+    print '***** Execution Report *****'
+    print 'Executed Instructions: %d' % (running)
+    print 'Stalled Cycles       : %d' % (stalled)
+    print 'Total Cycles         : %d' % (running + stalled)
+    print '***** Energy Consumption *****'
+    print 'Executed Instructions: %.2f %s' % (runningPower, powerTable.unit)
+    print 'Stalled Cycles       : %.2f %s' % (stalledPower, powerTable.unit)
+    print 'Total Cycles         : %.2f %s' % (runningPower + stalledPower, powerTable.unit)
+    print 'Leakage              : %.2f %s' % ((running + stalled) * powerTable.GetLeakage, powerTable.unit)
+    # Nothing scored yet (e.g. following a trace before its first record) reports no power rather than failing
+    dynamicPower = 0.0
+    totalPower = 0.0
+    if running + stalled > 0:
+        dynamicPower = powerTable.GetFrequency * 1000000 / (running + stalled) * (runningPower + stalledPower)
+        totalPower = (powerTable.GetFrequency * 1000000 / (running + stalled) *
+                      (runningPower + stalledPower + powerTable.GetLeakage * (running + stalled)))
+    print '***** Power Report *****'
+    print 'Leakage              : %.2f uW' % (powerTable.GetLeakage * powerTable.GetFrequency * 1000000)
+    print 'Dynamic Power        : %.2f uW' % dynamicPower
+    print 'Power Total          : %.2f uW' % totalPower
+    for timeline in scorer.timelines:
+        if timeline.windows > 0:
+            windowPower = powerTable.GetFrequency * 1000000 / timeline.blockSize
+            print 'Peak %-16s: %.2f uW at cycle %d' % ('(%d cycles)' % timeline.blockSize,
+                                                         windowPower * timeline.peakEnergy[table],
+                                                         timeline.peakCycle[table])
+            if timeline.windows >= timeline.average:
+                print 'Peak Average %-8s: %.2f uW over %d windows' % ('(%d)' % timeline.blockSize,
+                                                                       windowPower * timeline.peakAverage[table],
+                                                                       timeline.average)
+
+
+def PrintReports(scorer, tableNames, title=None):
+    """Print the report of a TraceScorer under each of its tables, followed by the instructions that used the
+    default power of the table. title (e.g. 'Core 1') heads the report of what was scored, if not the whole trace."""
+    for table, tableName in enumerate(tableNames):
+        library = scorer.powerTables[table].library
+        if title is not None and len(tableNames) > 1:
+            print '***** %s, table %s (%s) *****' % (title, tableName, library)
+        elif title is not None:
+            print '***** %s *****' % title
+        elif len(tableNames) > 1:
+            print '***** Table %s (%s) *****' % (tableName, library)
+        PrintReport(scorer, table)
+
+        if scorer.DefaultCount(table) != 0:
+            print '%d instructions used default power:' % scorer.DefaultCount(table), scorer.DefaultInstructions(table)
+
+
+def _ScoreCore(powerTables, timelines, chunks, results):
+    """Worker: score the chunks of a single core until None arrives, then send back the scorer"""
+    opcodes = tracereader.OpcodeIndex()
+    scorer = TraceScorer(powerTables, opcodes, timelines)
+    for names, executed, ids in iter(chunks.get, None):
+        for name in names:
+            opcodes.Intern(name)
+        scorer.Score(executed, ids)
+    scorer.Close()
+    results.put(scorer)
+
+
+class CoreScorer:
+    """Scores every core of a multi-core trace on its own.
+
+    Each core gets a TraceScorer in a separate process, started the first time the core shows up in the trace
+    and fed through a bounded queue, so cores are scored concurrently. With parallel unset the scorers run in
+    this process instead. Finish must be called before reading self.cores.
+
+    Every core gets its own timelines (see MakeTimelines), written to graphName with '-core<N>' appended.
+    """
+    def __init__(self, powerTables, opcodes, windows=(), graphName=None, tableNames=None, average=10,
+                 parallel=True):
+        self.powerTables = powerTables
+        self.opcodes = opcodes
+        self.windows = windows
+        self.graphName = graphName
+        self.tableNames = tableNames
+        self.average = average
+        self.parallel = parallel
+        self.cores = {}
+        self._workers = {}
+
+    def _Timelines(self, core):
+        graphName = None
+        if self.graphName is not None:
+            base, extension = os.path.splitext(self.graphName)
+            graphName = '%s-core%d%s' % (base, core, extension)
+        return MakeTimelines(self.windows, graphName, self.tableNames, self.average)
+
+    def _Send(self, core, executed, ids):
+        if core not in self._workers:
+            chunks = multiprocessing.Queue(4)
+            results = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_ScoreCore,
+                                              args=(self.powerTables, self._Timelines(core), chunks, results))
+            process.daemon = True
+            process.start()
+            self._workers[core] = [process, chunks, results, 0]
+        worker = self._workers[core]
+        # Workers intern opcodes in the same order, only the names they have not seen yet are sent
+        names = self.opcodes.names[worker[3]:]
+        worker[3] = len(self.opcodes)
+        worker[1].put((names, executed, ids))
+
+    def Score(self, cores, executed, ids):
+        for core in numpy.unique(cores).tolist():
+            mask = cores == core
+            if self.parallel:
+                self._Send(core, executed[mask], ids[mask])
+            else:
+                if core not in self.cores:
+                    self.cores[core] = TraceScorer(self.powerTables, self.opcodes, self._Timelines(core))
+                self.cores[core].Score(executed[mask], ids[mask])
+
+    def Finish(self):
+        for core, worker in self._workers.items():
+            worker[1].put(None)
+        for core, worker in self._workers.items():
+            self.cores[core] = worker[2].get()
+            worker[0].join()
+        self._workers = {}
+        for scorer in self.cores.values():
+            scorer.Close()
+        return self.cores
@@ -0,0 +1,158 @@
+#!/usr/bin/python
+
+import argparse
+import numpy
+import os
+import re
+
+
+# Loaded matrices are cached next to the CSV in <name>.npz, valid while the CSV keeps its mtime and size
+_cacheVersion = 1
+_decimalComma = re.compile(r'^-?\d+,\d+$')
+_runSuffixes = ('.instr.csv', '.csv')
+
+
+def _IsNumber(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+
+def _IsLabel(cell):
+    """Tell whether a header cell precedes the instruction columns (empty, or a title like 'Full Name' or 'Power')"""
+    return cell == '' or cell != cell.lower() or ' ' in cell
+
+
+def NormalizeName(name, decimalComma=False):
+    """Undo the '.' -> ',' conversion of spreadsheets saved with decimal commas (sext,w, 2a_ipc,instr,csv)"""
+    name = name.strip()
+    if decimalComma:
+        name = name.replace(',', '.')
+    return name
+
+
+def NormalizeRun(name, decimalComma=False):
+    """Run name without the .instr.csv or .csv of the file its counts came from"""
+    name = NormalizeName(name, decimalComma)
+    for suffix in _runSuffixes:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def SniffDialect(lines):
+    """Return the (delimiter, decimal comma) convention of the lines of a result CSV"""
+    delimiter = ';' if ';' in lines[0] else ','
+    decimalComma = False
+    if delimiter == ';':
+        for line in lines[1:]:
+            if any([_decimalComma.match(cell) for cell in line.split(';')]):
+                decimalComma = True
+                break
+    return delimiter, decimalComma
+
+
+def _Number(cell, decimalComma):
+    cell = cell.strip()
+    if cell == '':
+        return 0.0
+    if decimalComma:
+        cell = cell.replace(',', '.')
+    return float(cell)
+
+
+def ParseResults(lines, fileName=None):
+    """Parse the lines of a result CSV into (runs, opcodes, counts, power).
+
+    Handles the consolidated matrices (consolidateResults.py, consolidate-instructions.py and their spreadsheet
+    exports, with names and power as leading columns before one column per instruction and an optional Total row)
+    and single runlogstat.py outputs (mnemonic, count rows, named after fileName). Power is NaN for runs without
+    a power column.
+    """
+    lines = [line for line in lines if line.strip() != '']
+    delimiter, decimalComma = SniffDialect(lines)
+    rows = [line.split(delimiter) for line in lines]
+
+    if len(rows[0]) == 2 and _IsNumber(rows[0][1]):
+        # runlogstat.py output, a single run
+        run = NormalizeRun(os.path.basename(fileName or ''))
+        opcodes = numpy.array([NormalizeName(row[0], decimalComma) for row in rows])
+        counts = numpy.array([[_Number(row[1], decimalComma) for row in rows]]).astype(numpy.int64)
+        return (numpy.array([run]), opcodes, counts, numpy.array([numpy.nan]))
+
+    header = rows[0]
+    leading = 0
+    while leading < len(header) and _IsLabel(header[leading].strip()):
+        leading += 1
+    labels = [cell.strip().lower() for cell in header[:leading]]
+    if 'power' in labels:
+        powerColumn = labels.index('power')
+    elif leading >= 2:
+        powerColumn = leading - 1
+    else:
+        powerColumn = None
+
+    opcodes = [NormalizeName(cell, decimalComma) for cell in header[leading:]]
+    if len(opcodes) == 0 or any([_IsNumber(opcode) for opcode in opcodes]):
+        raise ValueError('%s has no instruction columns' % (fileName or 'Result CSV'))
+    runs = []
+    power = []
+    counts = []
+    for row in rows[1:]:
+        if row[0].strip() == 'Total':
+            continue
+        runs.append(NormalizeRun(row[0], decimalComma))
+        power.append(_Number(row[powerColumn], decimalComma) if powerColumn is not None else numpy.nan)
+        values = [_Number(cell, decimalComma) for cell in row[leading:leading + len(opcodes)]]
+        counts.append(values + [0.0] * (len(opcodes) - len(values)))
+
+    counts = numpy.array(counts, dtype=numpy.float64).reshape(len(runs), len(opcodes))
+    return (numpy.array(runs), numpy.array(opcodes), counts.astype(numpy.int64), numpy.array(power))
+
+
+def LoadResults(fileName, useCache=True):
+    """Load a result CSV as (runs, opcodes, counts, power) NumPy arrays: run names, instruction names, the runs x
+    instructions count matrix and the power of every run. See ParseResults for the layouts understood."""
+    cacheName = fileName + '.npz'
+    info = os.stat(fileName)
+    if useCache and os.path.isfile(cacheName):
+        try:
+            cache = numpy.load(cacheName)
+            if (int(cache['version']) == _cacheVersion and float(cache['mtime']) == info.st_mtime and
+                    int(cache['size']) == info.st_size):
+                return (cache['runs'], cache['opcodes'], cache['counts'], cache['power'])
+        except (IOError, KeyError, ValueError):
+            pass
+
+    results = ParseResults(open(fileName, 'rb').read().splitlines(), fileName)
+
+    if useCache:
+        # Written under another name and renamed, so a concurrent load never sees half a cache
+        temporaryName = '%s.%d.npz' % (fileName, os.getpid())
+        try:
+            numpy.savez(temporaryName, version=_cacheVersion, mtime=info.st_mtime, size=info.st_size,
+                        runs=results[0], opcodes=results[1], counts=results[2], power=results[3])
+            os.rename(temporaryName, cacheName)
+        except (IOError, OSError):
+            pass
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Load result CSVs of any dialect and summarize them')
+
+    parser.add_argument('files', nargs='+', help='Result CSV files')
+    parser.add_argument('--no-cache', required=False, action='store_true', help='Neither read nor write .npz caches')
+
+    args = parser.parse_args()
+
+    for fileName in args.files:
+        try:
+            runs, opcodes, counts, power = LoadResults(fileName, not args.no_cache)
+        except ValueError as error:
+            print '%s: %s' % (fileName, error)
+            continue
+        print '%s: %d runs x %d instructions, %d instructions counted, %d runs with power' % (
+            fileName, len(runs), len(opcodes), counts.sum(), numpy.count_nonzero(~numpy.isnan(power)))
@@ -0,0 +1,247 @@
+#!/usr/bin/python
+
+import argparse
+import csv
+import glob
+import hashlib
+import os
+import re
+import sqlite3
+import time
+import powerreport
+from powerreport import PowerName
+
+
+# Runs are the instruction count CSVs written by runlogstat.py (name.instr.csv), with the power read from the
+# name.pwr report next to them, also kept per block (see powerreport.py). Every ingested file is remembered with its
+# mtime, size and hash, so ingesting the same files again only reads those that changed.
+_schema = '''
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime REAL, size INTEGER, hash TEXT);
+CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, path TEXT UNIQUE, name TEXT, power REAL, powerPath TEXT,
+                                 library TEXT, iterations INTEGER, body INTEGER, ingested REAL);
+CREATE TABLE IF NOT EXISTS counts (run INTEGER, mnemonic TEXT, count INTEGER, PRIMARY KEY (run, mnemonic));
+CREATE TABLE IF NOT EXISTS blocks (run INTEGER, block TEXT, module TEXT, depth INTEGER, dynamic REAL, leakage REAL,
+                                   total REAL);
+CREATE INDEX IF NOT EXISTS blocksByRun ON blocks (run);
+CREATE INDEX IF NOT EXISTS runsByName ON runs (name);
+CREATE INDEX IF NOT EXISTS runsByLibrary ON runs (library);
+'''
+
+# Template programs are named <prefix><instruction>_<iterations>x<instructions in the loop body> by gen-templates.py
+_templateName = re.compile(r'_(\d+)x(\d+)(\.|$)')
+
+# Instruction counts predicted by rv64sim.py for template programs, not measured
+_simulatedSuffix = '.sim.csv'
+
+layouts = ['instructions', 'pwr', 'matrix', 'power']
+
+
+def _Hash(fileName):
+    digest = hashlib.sha1()
+    inputFile = open(fileName, 'rb')
+    for block in iter(lambda: inputFile.read(1024 * 1024), ''):
+        digest.update(block)
+    inputFile.close()
+    return digest.hexdigest()
+
+
+def ExpandRuns(patterns):
+    """Return the sorted CSV files named by directories and glob patterns. Directories leave out the instruction
+    counts predicted by rv64sim.py, which are not runs."""
+    fileNames = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            fileNames.update([fileName for fileName in glob.glob(os.path.join(pattern, '*.csv'))
+                              if os.path.isfile(fileName) and not fileName.endswith(_simulatedSuffix)])
+        else:
+            fileNames.update([fileName for fileName in glob.glob(pattern) if os.path.isfile(fileName)])
+    return sorted(fileNames)
+
+
+class ResultStore:
+    """Instruction counts and power of characterization runs, kept in a SQLite database"""
+    def __init__(self, fileName):
+        self.connection = sqlite3.connect(fileName)
+        self.connection.executescript(_schema)
+        self.files = dict((path, (mtime, size, fileHash)) for path, mtime, size, fileHash in
+                          self.connection.execute('SELECT path, mtime, size, hash FROM files'))
+
+    def _Changed(self, fileName):
+        """Tell whether a file differs from when it was last ingested, remembering its new state"""
+        if not os.path.isfile(fileName):
+            changed = fileName in self.files
+            if changed:
+                del self.files[fileName]
+                self.connection.execute('DELETE FROM files WHERE path = ?', (fileName,))
+            return changed
+        info = os.stat(fileName)
+        known = self.files.get(fileName)
+        if known is not None and known[0] == info.st_mtime and known[1] == info.st_size:
+            return False
+        # Touched but maybe not modified, the content decides
+        fileHash = _Hash(fileName)
+        self.files[fileName] = (info.st_mtime, info.st_size, fileHash)
+        self.connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                                (fileName, info.st_mtime, info.st_size, fileHash))
+        return known is None or known[2] != fileHash
+
+    def Ingest(self, fileNames, library=None):
+        """Add or update the runs of the given count CSVs, skipping those unchanged since the last call.
+
+        Returns the number of runs read.
+        """
+        read = 0
+        with self.connection:
+            for fileName in fileNames:
+                fileName = os.path.abspath(fileName)
+                powerName = PowerName(fileName)
+                # Both files are checked, so that both get their state remembered
+                changed = [self._Changed(fileName), self._Changed(powerName)]
+                if not any(changed):
+                    continue
+
+                counts = {}
+                try:
+                    for mnemonic, count in csv.reader(open(fileName)):
+                        counts[mnemonic] = counts.get(mnemonic, 0) + int(count)
+                except ValueError:
+                    print 'Skipping %s, not an instruction count CSV' % fileName
+                    continue
+
+                name = os.path.basename(fileName)
+                template = _templateName.search(name)
+                iterations, body = (int(template.group(1)), int(template.group(2))) if template else (None, None)
+                for table in ('counts', 'blocks'):
+                    self.connection.execute('DELETE FROM %s WHERE run IN (SELECT id FROM runs WHERE path = ?)' % table,
+                                            (fileName,))
+                report = powerreport.PowerReport(powerName if os.path.isfile(powerName) else None)
+                self.connection.execute('DELETE FROM runs WHERE path = ?', (fileName,))
+                cursor = self.connection.execute(
+                    'INSERT INTO runs (path, name, power, powerPath, library, iterations, body, ingested) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (fileName, name, report.RocketPower(), powerName, library,
+                                                        iterations, body, time.time()))
+                run = cursor.lastrowid
+                self.connection.executemany('INSERT INTO counts VALUES (?, ?, ?)',
+                                            [(run, mnemonic, count) for mnemonic, count in counts.items()])
+                self.connection.executemany('INSERT INTO blocks VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                            [(run, block.name, block.module, block.depth, block.Dynamic(),
+                                              block.Leakage(), block.Total()) for block in report.blocks])
+                read += 1
+        return read
+
+    def Runs(self, library=None, pattern=None):
+        """Return (ids, names, powers, powerPaths) of the runs of a library (all if None) whose name matches the
+        shell pattern, sorted by name"""
+        query = 'SELECT id, name, power, powerPath FROM runs'
+        conditions = []
+        parameters = []
+        if library is not None:
+            conditions.append('library = ?')
+            parameters.append(library)
+        if pattern is not None:
+            conditions.append('name GLOB ?')
+            parameters.append(pattern)
+        if len(conditions) > 0:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        rows = self.connection.execute(query + ' ORDER BY name', parameters).fetchall()
+        return ([row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows],
+                [row[3] for row in rows])
+
+    def Counts(self, runs):
+        """Return the instruction counts of the given runs, as a dictionary per run id"""
+        counts = dict((run, {}) for run in runs)
+        for run, mnemonic, count in self.connection.execute('SELECT run, mnemonic, count FROM counts'):
+            if run in counts:
+                counts[run][mnemonic] = count
+        return counts
+
+    def Table(self, layout, library=None, pattern=None):
+        """Return the rows of one of the consolidated layouts:
+
+        instructions: name, power and counts per run, then totals (instructions-15.csv)
+        pwr: consolidateResults.py (name, second part of the name, power and counts per run, then totals)
+        matrix: name, template, power, stall and counts per run (instr-300x300.csv)
+        power: consolidate-power.py (power report and power per run)
+        """
+        ids, names, powers, powerPaths = self.Runs(library, pattern)
+        if layout == 'power':
+            return [[powerPath, power] for powerPath, power in zip(powerPaths, powers)]
+
+        counts = self.Counts(ids)
+        allInstructions = {}
+        for runCounts in counts.values():
+            for mnemonic, count in runCounts.items():
+                allInstructions[mnemonic] = allInstructions.get(mnemonic, 0) + count
+        instructionNames = sorted(allInstructions.keys())
+
+        if layout == 'matrix':
+            instructionNames = ['stall'] + [mnemonic for mnemonic in instructionNames if mnemonic != 'stall']
+            outputTable = [['Full Name', 'Name', 'Power'] + instructionNames]
+            for run, name, power in zip(ids, names, powers):
+                fullName = name.replace('.instr.csv', '')
+                outputTable.append([fullName, fullName.split('_', 1)[-1], power] +
+                                   [counts[run].get(mnemonic, 0) for mnemonic in instructionNames])
+            return outputTable
+
+        leading = 2 if layout == 'instructions' else 3
+        outputTable = [[''] * leading + instructionNames]
+        for run, name, power in zip(ids, names, powers):
+            outputLine = [name, power]
+            if layout == 'pwr':
+                parts = name.split('_')
+                outputLine.insert(1, parts[1] if len(parts) > 1 else '')
+            outputTable.append(outputLine + [counts[run].get(mnemonic, 0) for mnemonic in instructionNames])
+        outputTable.append(['Total'] + [''] * (leading - 1) +
+                           [allInstructions.get(mnemonic) for mnemonic in instructionNames])
+        return outputTable
+
+
+def WriteTable(outputTable, fileName, layout):
+    """Write a consolidated table in the dialect of its layout: spreadsheet exports (pwr and matrix) use ';' and
+    decimal commas, the matrix one with '\\r' between lines"""
+    outputFile = open(fileName, 'wb')
+    if layout == 'pwr' or layout == 'matrix':
+        rows = [';'.join([(repr(value) if isinstance(value, float) else str(value)).replace('.', ',') for value in row])
+                for row in outputTable]
+        if layout == 'matrix':
+            outputFile.write('\r'.join(rows))
+        else:
+            outputFile.write(''.join([row + '\r\n' for row in rows]))
+    else:
+        csv.writer(outputFile).writerows(outputTable)
+    outputFile.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Keep the instruction counts and power of characterization runs '
+                                     'in a SQLite database and export them as consolidated tables')
+
+    parser.add_argument('-d', '--database', required=True, help='SQLite database file')
+    subparsers = parser.add_subparsers(dest='command')
+
+    ingest = subparsers.add_parser('ingest', help='Add runs, skipping those already ingested and unchanged')
+    ingest.add_argument('runs', nargs='+', help='Instruction count CSVs, directories or glob patterns of them')
+    ingest.add_argument('-l', '--library', required=False, help='Library the runs were measured with')
+
+    export = subparsers.add_parser('export', help='Write a consolidated table')
+    export.add_argument('-o', '--output', required=True, help='Output CSV file')
+    export.add_argument('--layout', required=False, default='pwr', choices=layouts,
+                        help='instructions (instructions-15.csv), pwr (consolidateResults.py, as in pwr15.csv), '
+                        'matrix (instr-300x300.csv) or power (consolidate-power.py), default pwr')
+    export.add_argument('-l', '--library', required=False, help='Only export the runs of this library')
+    export.add_argument('-m', '--match', required=False, help='Only export the runs whose name matches this pattern')
+
+    args = parser.parse_args()
+
+    store = ResultStore(args.database)
+    if args.command == 'ingest':
+        started = time.time()
+        fileNames = ExpandRuns(args.runs)
+        read = store.Ingest(fileNames, args.library)
+        print 'Ingested %d of %d runs in %.2f s (%d unchanged or skipped)' % (
+            read, len(fileNames), time.time() - started, len(fileNames) - read)
+    else:
+        outputTable = store.Table(args.layout, args.library, args.match)
+        WriteTable(outputTable, args.output, args.layout)
+        headers = {'instructions': 2, 'pwr': 2, 'matrix': 1, 'power': 0}
+        print 'Wrote %d runs to %s' % (len(outputTable) - headers[args.layout], args.output)
@@ -0,0 +1,219 @@
+#!/usr/bin/python
+
+import argparse
+import cPickle
+import csv
+import numpy
+import os
+import sys
+import powerfit
+import powerreport
+from resultcsv import LoadResults
+from resultstore import ExpandRuns
+
+
+# Bump whenever the content of the saved state changes
+_stateVersion = 1
+
+# Prior variance of the power of an instruction not seen yet, large enough for its first runs to decide it
+_priorVariance = 1e8
+
+# Two-sided 95% normal quantile, the default width of the confidence intervals
+_z95 = 1.959964
+
+
+class RecursiveFit:
+    """Recursive least squares estimate of the power per cycle of every instruction, updated one run at a time.
+
+    Uses the model of powerfit.py (the power of a run is its cycle fractions times the instruction powers). Each
+    run costs O(k^2) for k instructions: the estimate and P, the inverse of the regularized normal matrix, are
+    updated with the gain of the new run instead of solving again. P times the residual variance gives the
+    covariance of the estimate, hence its confidence intervals. Instructions seen for the first time join with
+    estimate 0 and variance _priorVariance. With forget below 1 older runs weigh exponentially less, for a table
+    tracking a design that changes.
+    """
+    def __init__(self, forget=1.0):
+        self.forget = forget
+        self.names = []
+        self.column = {}
+        self.theta = numpy.zeros(0)
+        self.P = numpy.zeros((0, 0))
+        self.totals = numpy.zeros(0, dtype=numpy.int64)
+        self.runs = 0
+        self.squares = 0.0
+        self.seen = {}
+
+    def _Grow(self, names):
+        newNames = sorted(set([name for name in names if name not in self.column]))
+        if len(newNames) == 0:
+            return
+        known = len(self.names)
+        for name in newNames:
+            self.column[name] = len(self.names)
+            self.names.append(name)
+        grown = numpy.zeros((len(self.names), len(self.names)))
+        grown[:known, :known] = self.P
+        grown[known:, known:] = numpy.eye(len(newNames)) * _priorVariance
+        self.P = grown
+        self.theta = numpy.concatenate((self.theta, numpy.zeros(len(newNames))))
+        self.totals = numpy.concatenate((self.totals, numpy.zeros(len(newNames), dtype=numpy.int64)))
+
+    def Add(self, opcodes, counts, power):
+        """Update the estimate with a run: its instruction names, their counts (stall included) and its power.
+
+        Returns the residual of the run under the estimate before the update.
+        """
+        self._Grow(opcodes)
+        x = numpy.zeros(len(self.names))
+        columns = [self.column[opcode] for opcode in opcodes]
+        x[columns] = counts
+        self.totals[columns] += numpy.asarray(counts, dtype=numpy.int64)
+        x /= x.sum()
+
+        Px = self.P.dot(x)
+        gain = Px / (self.forget + x.dot(Px))
+        residual = power - x.dot(self.theta)
+        self.theta += gain * residual
+        self.P = (self.P - numpy.outer(gain, Px)) / self.forget
+        # P stays symmetric in exact arithmetic only
+        self.P = (self.P + self.P.T) / 2
+        self.runs += 1
+        self.squares += (power - x.dot(self.theta)) ** 2
+        return residual
+
+    def Variance(self):
+        """Residual variance of the runs, None while there are no more runs than instructions"""
+        if self.runs <= len(self.names):
+            return None
+        return self.squares / (self.runs - len(self.names))
+
+    def Intervals(self, z=_z95):
+        """Return the half width of the confidence interval of every estimate, None while Variance is"""
+        variance = self.Variance()
+        if variance is None:
+            return None
+        return z * numpy.sqrt(numpy.maximum(numpy.diag(self.P), 0.0) * variance)
+
+    def Powers(self):
+        """Return the estimates as table values: instruction powers, never negative, by name"""
+        return dict(zip(self.names, numpy.maximum(self.theta, 0.0).tolist()))
+
+    def Default(self):
+        """Mean of the executed instruction powers weighted by their counts"""
+        executed = numpy.array([name != 'stall' for name in self.names], dtype=bool)
+        weights = self.totals[executed]
+        if weights.sum() == 0:
+            return 0.0
+        return float(numpy.dot(numpy.maximum(self.theta[executed], 0.0), weights) / weights.sum())
+
+
+def LoadState(fileName, forget=1.0):
+    """Return the RecursiveFit saved in fileName, a new one if there is none"""
+    if not os.path.isfile(fileName):
+        return RecursiveFit(forget)
+    version, attributes = cPickle.load(open(fileName, 'rb'))
+    if version != _stateVersion:
+        raise ValueError('%s holds version %s of the fit state, not %d' % (fileName, version, _stateVersion))
+    state = RecursiveFit()
+    state.__dict__.update(attributes)
+    return state
+
+
+def SaveState(fileName, state):
+    # Saved as plain attributes, so that the state does not depend on the module RecursiveFit was pickled from
+    temporaryName = '%s.%d' % (fileName, os.getpid())
+    cPickle.dump((_stateVersion, state.__dict__), open(temporaryName, 'wb'), cPickle.HIGHEST_PROTOCOL)
+    os.rename(temporaryName, fileName)
+
+
+def AddRuns(state, fileNames):
+    """Add the runs of runlogstat.py CSVs (with the power of the .pwr report next to them) not added before.
+
+    Returns the number of runs added.
+    """
+    added = 0
+    for fileName in fileNames:
+        fileName = os.path.abspath(fileName)
+        info = os.stat(fileName)
+        if fileName in state.seen:
+            if state.seen[fileName] != (info.st_mtime, info.st_size):
+                print 'Skipping %s, changed since it was added (start a new state to replace it)' % fileName
+            continue
+        powerName = powerreport.PowerName(fileName)
+        if not os.path.isfile(powerName):
+            print 'Skipping %s, no power report %s' % (fileName, powerName)
+            continue
+        try:
+            runs, opcodes, counts, power = LoadResults(fileName, False)
+        except ValueError:
+            print 'Skipping %s, not an instruction count CSV' % fileName
+            continue
+        power = powerreport.PowerReport(powerName).RocketPower()
+        if len(runs) != 1 or counts.sum() == 0 or power <= 0:
+            print 'Skipping %s, no instruction or no power' % fileName
+            continue
+        residual = state.Add(opcodes.tolist(), counts[0], power)
+        state.seen[fileName] = (info.st_mtime, info.st_size)
+        added += 1
+        print '%s: %.2f measured, %.2f predicted before the update' % (os.path.basename(fileName), power,
+                                                                        power - residual)
+    return added
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Update a power table fit run by run, as characterization runs '
+                                     'finish')
+
+    parser.add_argument('runs', nargs='*', help='Instruction count CSVs of runlogstat.py (with their .pwr reports), '
+                        'directories or glob patterns of them; runs added before are skipped')
+    parser.add_argument('-s', '--state', required=True, help='File keeping the fit between invocations')
+    parser.add_argument('-o', '--output', required=False, help='YAML power table to write with the current estimate')
+    parser.add_argument('-b', '--base', required=False,
+                        help='Power table the info fields and the instructions not estimated yet are taken from')
+    parser.add_argument('-c', '--confidence', required=False,
+                        help='CSV file receiving the estimate, its 95%% confidence interval and the count of every '
+                        'instruction')
+    parser.add_argument('--forget', required=False, type=float, default=1.0,
+                        help='Forgetting factor of a new state, below 1 to weigh recent runs more (default 1)')
+    parser.add_argument('--leakage', required=False, type=float, help='Leakage power of the table')
+
+    args = parser.parse_args()
+
+    state = LoadState(args.state, args.forget)
+    if len(args.runs) > 0:
+        added = AddRuns(state, ExpandRuns(args.runs))
+        SaveState(args.state, state)
+        print 'Added %d runs, %d runs and %d instructions in the fit' % (added, state.runs, len(state.names))
+    if state.runs == 0:
+        sys.exit('No run in %s yet' % args.state)
+
+    intervals = state.Intervals()
+    if intervals is None:
+        print 'Confidence intervals need more runs than instructions (%d)' % len(state.names)
+    else:
+        print 'Residual standard deviation %.2f, widest 95%% interval +-%.2f (%s)' % (
+            numpy.sqrt(state.Variance()), intervals.max(), state.names[int(numpy.argmax(intervals))])
+
+    if args.confidence is not None:
+        outputTable = [['instruction', 'power', 'low', 'high', 'count']]
+        for column, name in enumerate(state.names):
+            halfWidth = intervals[column] if intervals is not None else numpy.inf
+            outputTable.append([name, state.theta[column], state.theta[column] - halfWidth,
+                                state.theta[column] + halfWidth, state.totals[column]])
+        csv.writer(open(args.confidence, 'wt')).writerows(outputTable)
+
+    if args.output is not None:
+        info, instructions = {'frequency': 50, 'library': 'unknown', 'unit': 'uJ', 'leakage': 0}, {}
+        if args.base is not None:
+            info, instructions = powerfit.ReadTableValues(args.base)
+        powers = state.Powers()
+        if 'stall' in powers:
+            info['stall'] = powers.pop('stall')
+        instructions.update(powers)
+        info['default'] = state.Default()
+        if 'stall' not in info:
+            info['stall'] = info['default']
+        if args.leakage is not None:
+            info['leakage'] = args.leakage
+        powerfit.WriteTable(args.output, info, instructions)
+        print 'Wrote %s' % args.output
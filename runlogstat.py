@@ -1,55 +1,148 @@
 #!/usr/bin/python
 
 import argparse
-import random
-import string
 import sys
 import csv
-import bz2
+import glob
+import multiprocessing
+import os
+import time
+import tracereader
+import bz2parallel
+import ibtrace
+import loopfold
+import powerreport
+import tracesinks
+from tracesinks import HistogramSink, TransitionSink
+from consolidateResults import ConsolidateCounts, ReadPower
 
-def DictToCSV(d):
-    table = []
-    for item in sorted(d.keys()):
-        table.append([item, d[item]])
-    return table
 
-if __name__ == '__main__':
-    random.seed()
+# Files found in a batch directory that are results rather than traces
+_notTraces = ('.csv', '.pwr', '.yaml', '.yamlc', '.npz', '.py', '.sh')
+_traceExtensions = ('.bz2', '.ibt', '.txt', '.out', '.log')
+
+
+def ExpandTraces(patterns):
+    """Return the sorted trace files named by directories and glob patterns"""
+    fileNames = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for name in os.listdir(pattern):
+                fileName = os.path.join(pattern, name)
+                if os.path.isfile(fileName) and os.path.splitext(name)[1] not in _notTraces:
+                    fileNames.add(fileName)
+        else:
+            fileNames.update([fileName for fileName in glob.glob(pattern) if os.path.isfile(fileName)])
+    return sorted(fileNames)
+
+
+def StatsName(fileName):
+    """Name of the CSV runlogstat.py is run to write for a trace: trace extensions replaced by .instr.csv"""
+    base = fileName
+    while os.path.splitext(base)[1] in _traceExtensions:
+        base = os.path.splitext(base)[0]
+    return base + '.instr.csv'
+
+
+def _CountTrace(task):
+    """Worker: count the instructions of a whole trace, returning them with the time it took"""
+    fileName, formatName = task
+    start = time.time()
+    opcodes = tracereader.OpcodeIndex()
+    histogram = HistogramSink(opcodes)
+    if ibtrace.IsIBT(fileName):
+        chunks = tracesinks.ArrayChunks(ibtrace.ReadTraceArrays(fileName, opcodes))
+    else:
+        traceParser = tracereader.TraceParser(opcodes, formatName, loopfold.LoopFolder())
+        chunks = tracesinks.TextChunks(tracereader.ReadBuffers(tracereader.OpenTrace(fileName)), traceParser, True)
+    tracesinks.RunPipeline(chunks, [histogram])
+    return (fileName, histogram.Instructions(), time.time() - start)
 
+
+def RunBatch(fileNames, formatName, jobs, outputName):
+    """Count every trace in a pool of jobs processes and write the consolidated instruction matrix"""
+    allFiles = {}
+    powerInfo = {}
+    started = time.time()
+    totalBytes = 0
+    # Rows are named by the path of their CSV under the directory common to all traces, so that traces with the
+    # same name in different directories get a row each
+    root = os.path.commonprefix([os.path.dirname(os.path.abspath(fileName)) + os.sep for fileName in fileNames])
+    root = root[:root.rfind(os.sep) + 1]
+    pool = multiprocessing.Pool(jobs)
+    try:
+        tasks = [(fileName, formatName) for fileName in fileNames]
+        for done, (fileName, executedInstructions, seconds) in enumerate(pool.imap_unordered(_CountTrace, tasks)):
+            size = os.path.getsize(fileName)
+            totalBytes += size
+            records = sum(executedInstructions.values())
+            print '[%d/%d] %s: %d cycles in %.2f s (%.1f MB/s, %.0f cycles/s)' % (
+                done + 1, len(fileNames), fileName, records, seconds, size / 1e6 / max(seconds, 1e-6),
+                records / max(seconds, 1e-6))
+            sys.stdout.flush()
+            statsName = StatsName(fileName)
+            runName = os.path.relpath(os.path.abspath(statsName), root)
+            allFiles[runName] = executedInstructions
+            powerInfo[runName] = ReadPower(statsName)
+    finally:
+        pool.terminate()
+
+    elapsed = time.time() - started
+    print '%d traces, %.1f MB in %.1f s (%.1f MB/s)' % (len(fileNames), totalBytes / 1e6, elapsed,
+                                                        totalBytes / 1e6 / max(elapsed, 1e-6))
+    print 'Writing', outputName, '...'
+    csv.writer(open(outputName, 'wt')).writerows(ConsolidateCounts(allFiles, powerInfo))
+
+
+if __name__ == '__main__':
     parser = argparse.ArgumentParser(description = 'Read execution log from stdin or file and report number of instructions')
 
-    parser.add_argument('-t', '--trace', required=False, help='Input file containing instruction trace')
+    parser.add_argument('-t', '--trace', required=False, help='Input file containing instruction trace (text, bz2 or .ibt)')
     parser.add_argument('-p', '--power', required=False, help='Input file containing power report')
     parser.add_argument('-f', '--frequency', required=False, help='Processor execution frequency (in MHz)')
     parser.add_argument('-o', '--output', required=False, help='Output CSV file containing report')
+    parser.add_argument('--format', required=False, default='auto', choices=['auto', 'rocket', 'spike'],
+                        help='Trace format, detected from the first lines by default')
+    parser.add_argument('-j', '--jobs', required=False, type=int, default=1,
+                        help='Processes decompressing a bz2 trace in parallel, or counting traces in batch mode '
+                        '(0 uses every CPU)')
+    parser.add_argument('-s', '--sequences', required=False,
+                        help='Also count the sequences of consecutive instructions of every core into this file '
+                        '(sparse CSV, or NumPy arrays if it ends in .npz)')
+    parser.add_argument('-n', '--sequence-size', required=False, type=int, default=2,
+                        help='Instructions per counted sequence, 2 (pairs, the default) to 4')
+    parser.add_argument('-b', '--batch', required=False, nargs='+',
+                        help='Directories or glob patterns of traces, counted in parallel into a single instruction '
+                        'matrix written to --output (the consolidateResults.py layout)')
 
     args = parser.parse_args()
 
-    executedInstructions = {}
+    if args.batch is not None:
+        if args.output is None:
+            parser.error('--batch needs --output')
+        fileNames = ExpandTraces(args.batch)
+        if len(fileNames) == 0:
+            parser.error('no traces found in %s' % ' '.join(args.batch))
+        RunBatch(fileNames, args.format, args.jobs or None, args.output)
+        sys.exit(0)
 
-    if (args.trace == None):
-        inputFile = sys.stdin
-    elif (args.trace[-3:] == 'bz2'):
-        inputFile = bz2.BZ2File(args.trace)
-    else:
-        inputFile = open(args.trace)
-
-    for line in inputFile:
-        if (len(line) > 126):
-            if (line[0] == 'C' and line[2] == ':'):
-                core = int(line[1:2])
-                executed = line[16:17]
-                instruction = string.split(line[126:])[0]
-                if (executed == '1'):
-                    executedInstructions[instruction] = executedInstructions.get(instruction, 0) + 1
-                else:
-                    executedInstructions['stall'] = executedInstructions.get('stall', 0) + 1
-
-    if (args.output != None):
-        csv.writer(open(args.output, 'wt')).writerows(DictToCSV(executedInstructions))
+    opcodes = tracereader.OpcodeIndex()
+    traceParser = tracereader.TraceParser(opcodes, args.format)
+    histogram = HistogramSink(opcodes, args.output)
+    sinks = [histogram]
+    if args.sequences is not None:
+        sinks.append(TransitionSink(opcodes, args.sequences, args.sequence_size))
+
+    if ibtrace.IsIBT(args.trace):
+        chunks = ibtrace.ReadTraceArrays(args.trace, opcodes)
+    elif (args.jobs != 1 and args.trace != None and args.trace[-3:] == 'bz2'):
+        chunks = bz2parallel.ReadTraceArrays(args.trace, traceParser, args.jobs or None)
     else:
-        for instruction in executedInstructions.keys():
-            print instruction, executedInstructions[instruction]
+        chunks = tracereader.ReadTraceArrays(tracereader.OpenTrace(args.trace), traceParser)
+
+    tracesinks.RunPipeline(tracesinks.ArrayChunks(chunks), sinks)
+    for sink in sinks:
+        sink.Finish()
 
     frequency = 0
     if (args.frequency != None):
@@ -57,10 +150,7 @@ if __name__ == '__main__':
 
     powerConsumption = 0
     if (args.power != None):
-        lines = open(args.power).readlines()
-        splited = lines[13].split()
-        if (splited[0] == 'Rocket'):
-            powerConsumption = float(splited[3])
+        powerConsumption = powerreport.PowerReport(args.power).RocketPower()
 
     if (frequency != 0) and (powerConsumption != 0):
         print powerConsumption / frequency
\ No newline at end of file
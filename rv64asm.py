@@ -0,0 +1,362 @@
+#!/usr/bin/python
+
+import argparse
+import re
+import struct
+import sys
+
+
+# Assembles the RV64IM subset written by gen-templates.py (R, I, shift, U, load, store, branch and jump formats,
+# plus the nop, mv, li and j pseudo-instructions and the .align directive) into machine code, without the cross
+# toolchain. Programs are laid out from a base address and written as a minimal ELF or as a hex image.
+
+_registerNames = ['zero', 'ra', 'sp', 'gp', 'tp', 't0', 't1', 't2', 's0', 's1', 'a0', 'a1', 'a2', 'a3', 'a4', 'a5',
+                  'a6', 'a7', 's2', 's3', 's4', 's5', 's6', 's7', 's8', 's9', 's10', 's11', 't3', 't4', 't5', 't6']
+registers = dict([(name, number) for number, name in enumerate(_registerNames)] +
+                 [('x%d' % number, number) for number in range(0, 32)] + [('fp', 8)])
+
+# Mnemonic: (opcode, funct3, funct7) of the register-register instructions
+_rType = {'add': (0x33, 0, 0x00), 'sub': (0x33, 0, 0x20), 'sll': (0x33, 1, 0x00), 'slt': (0x33, 2, 0x00),
+          'sltu': (0x33, 3, 0x00), 'xor': (0x33, 4, 0x00), 'srl': (0x33, 5, 0x00), 'sra': (0x33, 5, 0x20),
+          'or': (0x33, 6, 0x00), 'and': (0x33, 7, 0x00),
+          'mul': (0x33, 0, 0x01), 'mulh': (0x33, 1, 0x01), 'mulhsu': (0x33, 2, 0x01), 'mulhu': (0x33, 3, 0x01),
+          'div': (0x33, 4, 0x01), 'divu': (0x33, 5, 0x01), 'rem': (0x33, 6, 0x01), 'remu': (0x33, 7, 0x01),
+          'addw': (0x3b, 0, 0x00), 'subw': (0x3b, 0, 0x20), 'sllw': (0x3b, 1, 0x00), 'srlw': (0x3b, 5, 0x00),
+          'sraw': (0x3b, 5, 0x20), 'mulw': (0x3b, 0, 0x01), 'divw': (0x3b, 4, 0x01), 'divuw': (0x3b, 5, 0x01),
+          'remw': (0x3b, 6, 0x01), 'remuw': (0x3b, 7, 0x01)}
+
+# Mnemonic: (opcode, funct3) of the instructions with a 12 bit signed immediate
+_iType = {'addi': (0x13, 0), 'slti': (0x13, 2), 'sltiu': (0x13, 3), 'xori': (0x13, 4), 'ori': (0x13, 6),
+          'andi': (0x13, 7), 'addiw': (0x1b, 0), 'jalr': (0x67, 0)}
+
+# Mnemonic: (opcode, funct3, upper immediate bits, shift amount bits) of the shifts by an immediate
+_shifts = {'slli': (0x13, 1, 0x000, 6), 'srli': (0x13, 5, 0x000, 6), 'srai': (0x13, 5, 0x400, 6),
+           'slliw': (0x1b, 1, 0x000, 5), 'srliw': (0x1b, 5, 0x000, 5), 'sraiw': (0x1b, 5, 0x400, 5)}
+
+_loads = {'lb': 0, 'lh': 1, 'lw': 2, 'ld': 3, 'lbu': 4, 'lhu': 5, 'lwu': 6}
+_stores = {'sb': 0, 'sh': 1, 'sw': 2, 'sd': 3}
+_uType = {'lui': 0x37, 'auipc': 0x17}
+_branches = {'beq': 0, 'bne': 1, 'blt': 4, 'bge': 5, 'bltu': 6, 'bgeu': 7}
+
+_nop = 0x00000013
+_memoryOperand = re.compile(r'^(.*)\((\w+)\)$')
+_label = re.compile(r'^([A-Za-z_.$][\w.$]*):\s*(.*)$')
+
+
+def _Register(name):
+    if name not in registers:
+        raise ValueError('unknown register %s' % name)
+    return registers[name]
+
+
+def _Immediate(text):
+    return int(text, 0)
+
+
+def _Check(value, bits, signed=True):
+    if signed:
+        low, high = -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+    else:
+        low, high = 0, (1 << bits) - 1
+    if value < low or value > high:
+        raise ValueError('immediate %d does not fit in %d bits' % (value, bits))
+    return value & ((1 << bits) - 1)
+
+
+def EncodeR(opcode, funct3, funct7, rd, rs1, rs2):
+    return (funct7 << 25) | (rs2 << 20) | (rs1 << 15) | (funct3 << 12) | (rd << 7) | opcode
+
+
+def EncodeI(opcode, funct3, rd, rs1, immediate):
+    return (_Check(immediate, 12) << 20) | (rs1 << 15) | (funct3 << 12) | (rd << 7) | opcode
+
+
+def EncodeS(opcode, funct3, rs1, rs2, immediate):
+    immediate = _Check(immediate, 12)
+    return ((immediate >> 5) << 25) | (rs2 << 20) | (rs1 << 15) | (funct3 << 12) | ((immediate & 0x1f) << 7) | opcode
+
+
+def EncodeB(funct3, rs1, rs2, offset):
+    if offset & 1:
+        raise ValueError('branch offset %d is odd' % offset)
+    offset = _Check(offset, 13)
+    return (((offset >> 12) & 1) << 31) | (((offset >> 5) & 0x3f) << 25) | (rs2 << 20) | (rs1 << 15) | \
+        (funct3 << 12) | (((offset >> 1) & 0xf) << 8) | (((offset >> 11) & 1) << 7) | 0x63
+
+
+def EncodeU(opcode, rd, immediate):
+    return (_Check(immediate, 20, False) << 12) | (rd << 7) | opcode
+
+
+def EncodeJ(rd, offset):
+    if offset & 1:
+        raise ValueError('jump offset %d is odd' % offset)
+    offset = _Check(offset, 21)
+    return (((offset >> 20) & 1) << 31) | (((offset >> 1) & 0x3ff) << 21) | (((offset >> 11) & 1) << 20) | \
+        (((offset >> 12) & 0xff) << 12) | (rd << 7) | 0x6f
+
+
+def _SignExtend(value, bits):
+    value &= (1 << bits) - 1
+    if value >> (bits - 1):
+        value -= 1 << bits
+    return value
+
+
+def _LoadImmediate(rd, value):
+    value = _SignExtend(value, 64)
+    low = _SignExtend(value, 12)
+    if value == low:
+        return [EncodeI(0x13, 0, rd, 0, value)]
+    if -(1 << 31) <= value < (1 << 31):
+        words = [EncodeU(0x37, rd, ((value + 0x800) >> 12) & 0xfffff)]
+        if low != 0:
+            words.append(EncodeI(0x1b, 0, rd, rd, low))
+        return words
+    upper = (value - low) >> 12
+    shift = 12
+    while upper & 1 == 0:
+        upper >>= 1
+        shift += 1
+    if shift > 12 and not -2048 <= upper < 2048 and -(1 << 31) <= (upper << 12) < (1 << 31):
+        # Leave the low 12 bits of the upper part zero, so that it is a single lui
+        shift -= 12
+        upper <<= 12
+    words = _LoadImmediate(rd, upper) + [EncodeI(0x13, 1, rd, rd, shift)]
+    if low != 0:
+        words.append(EncodeI(0x13, 0, rd, rd, low))
+    return words
+
+
+def LoadImmediate(rd, value):
+    """Return the words of li rd, value, the sequence LLVM expands it to: addi alone, lui and addiw for 32 bit
+    values, and for wider ones the upper bits loaded the same way, shifted left by slli, plus addi of the low 12
+    bits. Positive values may rather be loaded shifted left, with ones or zeros shifted in, and shifted back with
+    srli."""
+    words = _LoadImmediate(rd, value)
+    value = _SignExtend(value, 64)
+    if len(words) > 2 and value > 0:
+        zeros = 64 - value.bit_length()
+        ones = (1 << zeros) - 1
+        shifted = (value << zeros) & ((1 << 64) - 1)
+        for candidate in [shifted | ones, shifted & ~ones]:
+            sequence = _LoadImmediate(rd, candidate) + [EncodeI(0x13, 5, rd, rd, zeros)]
+            if len(sequence) < len(words):
+                words = sequence
+    return words
+
+
+def _Size(mnemonic, operands):
+    """Bytes taken by an instruction, known before labels are"""
+    if mnemonic == 'li':
+        return 4 * len(LoadImmediate(_Register(operands[0]), _Immediate(operands[1])))
+    return 4
+
+
+def EncodeInstruction(mnemonic, operands, address=0, symbols=None):
+    """Return the words of one instruction, branch and jump targets being labels of symbols or absolute
+    addresses"""
+    def Target(text):
+        if symbols is not None and text in symbols:
+            return symbols[text] - address
+        return _Immediate(text) - address
+
+    def Memory(text):
+        match = _memoryOperand.match(text)
+        if match is None:
+            raise ValueError('expected offset(register), not %s' % text)
+        return _Immediate(match.group(1) or '0'), _Register(match.group(2))
+
+    if mnemonic in _rType:
+        opcode, funct3, funct7 = _rType[mnemonic]
+        return [EncodeR(opcode, funct3, funct7, *[_Register(operand) for operand in operands])]
+    if mnemonic == 'jalr' and len(operands) == 1:
+        return [EncodeI(0x67, 0, 1, _Register(operands[0]), 0)]
+    if mnemonic in _iType:
+        opcode, funct3 = _iType[mnemonic]
+        return [EncodeI(opcode, funct3, _Register(operands[0]), _Register(operands[1]), _Immediate(operands[2]))]
+    if mnemonic in _shifts:
+        opcode, funct3, upper, bits = _shifts[mnemonic]
+        shift = _Check(_Immediate(operands[2]), bits, False)
+        return [EncodeI(opcode, funct3, _Register(operands[0]), _Register(operands[1]), upper | shift)]
+    if mnemonic in _loads:
+        offset, base = Memory(operands[1])
+        return [EncodeI(0x03, _loads[mnemonic], _Register(operands[0]), base, offset)]
+    if mnemonic in _stores:
+        offset, base = Memory(operands[1])
+        return [EncodeS(0x23, _stores[mnemonic], base, _Register(operands[0]), offset)]
+    if mnemonic in _uType:
+        return [EncodeU(_uType[mnemonic], _Register(operands[0]), _Immediate(operands[1]))]
+    if mnemonic in _branches:
+        return [EncodeB(_branches[mnemonic], _Register(operands[0]), _Register(operands[1]), Target(operands[2]))]
+    if mnemonic == 'jal':
+        if len(operands) == 1:
+            return [EncodeJ(1, Target(operands[0]))]
+        return [EncodeJ(_Register(operands[0]), Target(operands[1]))]
+    if mnemonic == 'j':
+        return [EncodeJ(0, Target(operands[0]))]
+    if mnemonic == 'nop':
+        return [_nop]
+    if mnemonic == 'mv':
+        return [EncodeI(0x13, 0, _Register(operands[0]), _Register(operands[1]), 0)]
+    if mnemonic == 'li':
+        return LoadImmediate(_Register(operands[0]), _Immediate(operands[1]))
+    raise ValueError('unsupported instruction %s' % mnemonic)
+
+
+def _Statements(text):
+    """Yield (line number, label, mnemonic, operands) of the lines of an assembly program"""
+    for number, line in enumerate(text.splitlines()):
+        line = line.split('#')[0].strip()
+        label = None
+        match = _label.match(line)
+        if match is not None:
+            label, line = match.group(1), match.group(2).strip()
+        if line == '':
+            if label is not None:
+                yield number + 1, label, None, []
+            continue
+        fields = line.split(None, 1)
+        operands = [operand.strip() for operand in fields[1].split(',')] if len(fields) > 1 else []
+        yield number + 1, label, fields[0], operands
+
+
+def Assemble(text, base=0):
+    """Assemble a program laid out from base, returning (image, symbols): its bytes and the address of its labels.
+
+    Two passes: the first places the labels, the second encodes. .align n pads with nops to 2 ** n bytes, the
+    other directives are ignored.
+    """
+    statements = list(_Statements(text))
+    symbols = {}
+    address = base
+    for number, label, mnemonic, operands in statements:
+        try:
+            if label is not None:
+                symbols[label] = address
+            if mnemonic is None:
+                continue
+            if mnemonic == '.align':
+                alignment = 1 << _Immediate(operands[0])
+                address += -(address - base) % alignment
+            elif mnemonic[0] != '.':
+                address += _Size(mnemonic, operands)
+        except (ValueError, IndexError, TypeError) as error:
+            raise ValueError('line %d: %s' % (number, error))
+
+    image = bytearray()
+    for number, label, mnemonic, operands in statements:
+        if mnemonic is None:
+            continue
+        try:
+            if mnemonic == '.align':
+                alignment = 1 << _Immediate(operands[0])
+                padding = -len(image) % alignment
+                image.extend(struct.pack('<I', _nop) * (padding // 4) + '\0' * (padding % 4))
+            elif mnemonic[0] != '.':
+                words = EncodeInstruction(mnemonic, operands, base + len(image), symbols)
+                image.extend(struct.pack('<%dI' % len(words), *words))
+        except (ValueError, IndexError, TypeError) as error:
+            raise ValueError('line %d: %s' % (number, error))
+    return image, symbols
+
+
+def ELF(image, base=0, entry=None):
+    """Return a minimal RV64 executable: the ELF header and a single loadable, executable segment holding image"""
+    if entry is None:
+        entry = base
+    offset = 0x1000
+    header = struct.pack('<4sBBBBB7xHHIQQQIHHHHHH', '\x7fELF', 2, 1, 1, 0, 0, 2, 243, 1, entry, 64, 0, 0, 64, 56, 1,
+                         64, 0, 0)
+    segment = struct.pack('<IIQQQQQQ', 1, 5, offset, base, base, len(image), len(image), offset)
+    return header + segment + '\0' * (offset - len(header) - len(segment)) + str(image)
+
+
+def HexImage(image, width=16):
+    """Return image as the lines of a hex memory image, width bytes per line with the highest address first (as
+    elf2hex writes it for the Rocket emulator +loadmem)"""
+    padded = str(image) + '\0' * (-len(image) % width)
+    return ''.join([padded[start:start + width][::-1].encode('hex') + '\n' for start in range(0, len(padded), width)])
+
+
+# (assembly, reference encoding) pairs, as listed by objdump, checked by --selftest
+_references = [('add a0, a0, a1', 0x00b50533), ('sub a0, a0, a1', 0x40b50533), ('mul a0, a0, a1', 0x02b50533),
+               ('addw a0, a0, a1', 0x00b5053b), ('sllw a0, a0, a1', 0x00b5153b), ('divw a0, a0, a1', 0x02b5453b),
+               ('remu a0, a0, a1', 0x02b57533), ('addi sp, sp, -16', 0xff010113), ('addiw a0, a0, 1', 0x0015051b),
+               ('slli a0, a0, 32', 0x02051513), ('srli a0, a0, 1', 0x00155513), ('srai a0, a0, 63', 0x43f55513),
+               ('sraiw a0, a0, 1', 0x4015551b), ('ld ra, 8(sp)', 0x00813083), ('lw a5, -20(s0)', 0xfec42783),
+               ('sd ra, 8(sp)', 0x00113423), ('sw a5, -20(s0)', 0xfef42623), ('lui a0, 0x12345', 0x12345537),
+               ('auipc t0, 0', 0x00000297), ('jalr zero, ra, 0', 0x00008067), ('nop', 0x00000013),
+               ('mv a0, a1', 0x00058513), ('li a0, 1', 0x00100513), ('beq x0, x0, 0', 0x00000063),
+               ('bne a0, a1, 8', 0x00b51463), ('jal ra, 16', 0x010000ef), ('j 0', 0x0000006f)]
+
+
+def _Execute(words):
+    """Value left in the destination register by a li sequence (addi, lui, addiw, slli and srli only)"""
+    value = 0
+    for word in words:
+        opcode, funct3 = word & 0x7f, (word >> 12) & 7
+        immediate = _SignExtend(word >> 20, 12)
+        if opcode == 0x37:
+            value = _SignExtend(word & 0xfffff000, 32)
+        elif opcode == 0x1b:
+            value = _SignExtend(value + immediate, 32)
+        elif opcode == 0x13 and funct3 == 1:
+            value = _SignExtend(value << (immediate & 0x3f), 64)
+        elif opcode == 0x13 and funct3 == 5:
+            value = (value & ((1 << 64) - 1)) >> (immediate & 0x3f)
+        elif ((word >> 15) & 0x1f) == 0:
+            value = immediate
+        else:
+            value = _SignExtend(value + immediate, 64)
+    return value
+
+
+def SelfTest():
+    """Check the encoder against the reference encodings and li against its own expansion, returning the failures"""
+    failures = []
+    for assembly, reference in _references:
+        fields = assembly.split(None, 1)
+        operands = [operand.strip() for operand in fields[1].split(',')] if len(fields) > 1 else []
+        words = EncodeInstruction(fields[0], operands)
+        if words != [reference]:
+            failures.append('%s: %s instead of %08x' % (assembly, ' '.join(['%08x' % word for word in words]),
+                                                         reference))
+    for value in [0, 1, -1, 2047, -2048, 2048, 4096, 0x7ffff800, 0x7fffffff, -0x80000000, 0x80000000, 0xffffffff,
+                  0x100000000, 0x123456789abcdef0, -0x123456789abcdef, (1 << 63) - 1, -(1 << 63)]:
+        if _Execute(LoadImmediate(10, value)) != _SignExtend(value, 64):
+            failures.append('li a0, %d loads %d' % (value, _Execute(LoadImmediate(10, value))))
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Assemble template programs into RV64IM machine code, without the '
+                                     'cross toolchain')
+
+    parser.add_argument('input', nargs='?', help='Assembly program (gen-templates.py output)')
+    parser.add_argument('-o', '--output', required=False,
+                        help='Output file, a hex image if it ends in .hex and an ELF executable otherwise')
+    parser.add_argument('-b', '--base', required=False, default='0', help='Load address of the program (default 0)')
+    parser.add_argument('-w', '--width', required=False, type=int, default=16,
+                        help='Bytes per line of hex images (default 16)')
+    parser.add_argument('--selftest', required=False, action='store_true',
+                        help='Check the encoder against reference encodings and exit')
+
+    args = parser.parse_args()
+
+    if args.selftest:
+        failures = SelfTest()
+        for failure in failures:
+            print failure
+        print '%d encodings checked, %d failed' % (len(_references), len(failures))
+        sys.exit(1 if len(failures) > 0 else 0)
+    if args.input is None or args.output is None:
+        parser.error('give an input program and an output file, or --selftest')
+
+    base = int(args.base, 0)
+    image, symbols = Assemble(open(args.input).read(), base)
+    if args.output[-4:] == '.hex':
+        open(args.output, 'wt').write(HexImage(image, args.width))
+    else:
+        open(args.output, 'wb').write(ELF(image, base, symbols.get('_start', base)))
+    print '%s: %d bytes at 0x%x' % (args.output, len(image), base)
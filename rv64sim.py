@@ -0,0 +1,471 @@
+#!/usr/bin/python
+
+import argparse
+import collections
+import csv
+import multiprocessing
+import numpy
+import os
+import struct
+import sys
+import time
+import rv64asm
+import tracereader
+from powertable import PowerTable, TraceScorer, PrintReports
+from tracesinks import DictToCSV
+
+
+# Functional RV64IM simulator for template programs (gen-templates.py assembly, or the ELF and hex images of
+# rv64asm.py). Every basic block is translated once into a Python function updating the registers, so that a loop
+# body runs as straight-line Python code; instructions are only counted per block visit. Instructions are named as
+# the Rocket trace disassembler names them (li, mv, nop, sext.w, bnez, j...), so that the counts can be compared
+# with runlogstat.py outputs, which also count stalled cycles, unknown here.
+
+M = (1 << 64) - 1
+
+DEFAULT_MEMORY = 0x10000
+DEFAULT_LIMIT = 10 ** 9
+SIMULATED_SUFFIX = '.sim.csv'
+
+_rNames = dict([((opcode, funct3, funct7), name) for name, (opcode, funct3, funct7) in rv64asm._rType.items()])
+_iNames = dict([((opcode, funct3), name) for name, (opcode, funct3) in rv64asm._iType.items()])
+_shiftNames = collections.defaultdict(list)
+for _name, (_opcode, _funct3, _upper, _bits) in rv64asm._shifts.items():
+    _shiftNames[(_opcode, _funct3)].append((_name, _bits))
+_loadNames = dict([(funct3, name) for name, funct3 in rv64asm._loads.items()])
+_storeNames = dict([(funct3, name) for name, funct3 in rv64asm._stores.items()])
+_branchNames = dict([(funct3, name) for name, funct3 in rv64asm._branches.items()])
+
+# struct format and size of the loads and stores
+_loadFormats = {'lb': ('<b', 1), 'lh': ('<h', 2), 'lw': ('<i', 4), 'ld': ('<q', 8), 'lbu': ('<B', 1),
+                'lhu': ('<H', 2), 'lwu': ('<I', 4)}
+_storeFormats = {'sb': ('<B', 1), 'sh': ('<H', 2), 'sw': ('<I', 4), 'sd': ('<Q', 8)}
+
+# Python expressions of the result of every operation, a and b being the source registers and i the immediate
+_operations = {'add': '({a} + {b}) & M', 'sub': '({a} - {b}) & M', 'sll': '({a} << ({b} & 63)) & M',
+               'srl': '{a} >> ({b} & 63)', 'sra': '(S({a}) >> ({b} & 63)) & M', 'slt': 'int(S({a}) < S({b}))',
+               'sltu': 'int({a} < {b})', 'xor': '{a} ^ {b}', 'or': '{a} | {b}', 'and': '{a} & {b}',
+               'mul': '({a} * {b}) & M', 'mulh': '((S({a}) * S({b})) >> 64) & M',
+               'mulhsu': '((S({a}) * {b}) >> 64) & M', 'mulhu': '({a} * {b}) >> 64',
+               'div': 'Div({a}, {b})', 'divu': 'Divu({a}, {b})', 'rem': 'Rem({a}, {b})', 'remu': 'Remu({a}, {b})',
+               'addw': 'W({a} + {b})', 'subw': 'W({a} - {b})', 'sllw': 'W({a} << ({b} & 31))',
+               'srlw': 'W(({a} & 0xffffffff) >> ({b} & 31))', 'sraw': 'W(S32({a}) >> ({b} & 31))',
+               'mulw': 'W({a} * {b})', 'divw': 'W(Div(W({a}), W({b})))',
+               'divuw': 'W(Divu({a} & 0xffffffff, {b} & 0xffffffff))', 'remw': 'W(Rem(W({a}), W({b})))',
+               'remuw': 'W(Remu({a} & 0xffffffff, {b} & 0xffffffff))',
+               'addi': '({a} + {i}) & M', 'slti': 'int(S({a}) < {i})', 'sltiu': 'int({a} < {u})',
+               'xori': '{a} ^ {u}', 'ori': '{a} | {u}', 'andi': '{a} & {u}', 'addiw': 'W({a} + {i})',
+               'slli': '({a} << {i}) & M', 'srli': '{a} >> {i}', 'srai': '(S({a}) >> {i}) & M',
+               'slliw': 'W({a} << {i})', 'srliw': 'W(({a} & 0xffffffff) >> {i})', 'sraiw': 'W(S32({a}) >> {i})'}
+
+_conditions = {'beq': '{a} == {b}', 'bne': '{a} != {b}', 'blt': 'S({a}) < S({b})', 'bge': 'S({a}) >= S({b})',
+               'bltu': '{a} < {b}', 'bgeu': '{a} >= {b}'}
+
+
+def S(value):
+    """Signed value of a register"""
+    return (value ^ 0x8000000000000000) - 0x8000000000000000
+
+
+def S32(value):
+    return ((value & 0xffffffff) ^ 0x80000000) - 0x80000000
+
+
+def W(value):
+    """Register holding the low 32 bits of value, sign extended"""
+    return S32(value) & M
+
+
+def Div(a, b):
+    a, b = S(a), S(b)
+    if b == 0:
+        return M
+    quotient = abs(a) // abs(b)
+    return (quotient if (a < 0) == (b < 0) else -quotient) & M
+
+
+def Divu(a, b):
+    return a // b if b != 0 else M
+
+
+def Rem(a, b):
+    a, b = S(a), S(b)
+    if b == 0:
+        return a & M
+    remainder = abs(a) % abs(b)
+    return (remainder if a >= 0 else -remainder) & M
+
+
+def Remu(a, b):
+    return a % b if b != 0 else a
+
+
+def Decode(word):
+    """Return (name, operation, rd, rs1, rs2, immediate) of an instruction word, name being the mnemonic of the
+    Rocket trace (pseudo-instructions included) and operation the instruction executed; None if not RV64IM"""
+    opcode, rd, funct3 = word & 0x7f, (word >> 7) & 0x1f, (word >> 12) & 7
+    rs1, rs2, funct7 = (word >> 15) & 0x1f, (word >> 20) & 0x1f, word >> 25
+    immediate = rv64asm._SignExtend(word >> 20, 12)
+
+    if (opcode, funct3, funct7) in _rNames:
+        operation = _rNames[(opcode, funct3, funct7)]
+        name = operation
+        if operation in ('sub', 'subw') and rs1 == 0:
+            name = 'neg' if operation == 'sub' else 'negw'
+        elif operation == 'sltu' and rs1 == 0:
+            name = 'snez'
+        elif operation == 'slt' and rs2 == 0:
+            name = 'sltz'
+        elif operation == 'slt' and rs1 == 0:
+            name = 'sgtz'
+        return name, operation, rd, rs1, rs2, immediate
+    if (opcode, funct3) in _shiftNames:
+        for operation, bits in _shiftNames[(opcode, funct3)]:
+            if (word >> 20) & ~((1 << bits) - 1) == rv64asm._shifts[operation][2]:
+                return operation, operation, rd, rs1, rs2, (word >> 20) & ((1 << bits) - 1)
+        return None
+    if (opcode, funct3) in _iNames:
+        operation = _iNames[(opcode, funct3)]
+        name = operation
+        if operation == 'addi':
+            if rd == 0 and rs1 == 0 and immediate == 0:
+                name = 'nop'
+            elif rs1 == 0:
+                name = 'li'
+            elif immediate == 0:
+                name = 'mv'
+        elif operation == 'addiw' and immediate == 0:
+            name = 'sext.w'
+        elif operation == 'sltiu' and immediate == 1:
+            name = 'seqz'
+        elif operation == 'xori' and immediate == -1:
+            name = 'not'
+        elif operation == 'jalr' and rd == 0:
+            name = 'ret' if rs1 == 1 and immediate == 0 else 'jr'
+        return name, operation, rd, rs1, rs2, immediate
+    if opcode == 0x03 and funct3 in _loadNames:
+        return _loadNames[funct3], _loadNames[funct3], rd, rs1, rs2, immediate
+    if opcode == 0x23 and funct3 in _storeNames:
+        offset = rv64asm._SignExtend(((word >> 25) << 5) | rd, 12)
+        return _storeNames[funct3], _storeNames[funct3], 0, rs1, rs2, offset
+    if opcode in (0x37, 0x17):
+        operation = 'lui' if opcode == 0x37 else 'auipc'
+        return operation, operation, rd, rs1, rs2, rv64asm._SignExtend(word & 0xfffff000, 32)
+    if opcode == 0x63 and funct3 in _branchNames:
+        operation = _branchNames[funct3]
+        offset = rv64asm._SignExtend((((word >> 31) & 1) << 12) | (((word >> 7) & 1) << 11) |
+                                     (((word >> 25) & 0x3f) << 5) | (((word >> 8) & 0xf) << 1), 13)
+        name = operation
+        if rs2 == 0 and operation in ('beq', 'bne', 'blt', 'bge'):
+            name = {'beq': 'beqz', 'bne': 'bnez', 'blt': 'bltz', 'bge': 'bgez'}[operation]
+        elif rs1 == 0 and operation in ('blt', 'bge'):
+            name = 'bgtz' if operation == 'blt' else 'blez'
+        return name, operation, rd, rs1, rs2, offset
+    if opcode == 0x6f:
+        offset = rv64asm._SignExtend((((word >> 31) & 1) << 20) | (((word >> 12) & 0xff) << 12) |
+                                     (((word >> 20) & 1) << 11) | (((word >> 21) & 0x3ff) << 1), 21)
+        return 'j' if rd == 0 else 'jal', 'jal', rd, rs1, rs2, offset
+    return None
+
+
+def LoadProgram(fileName, base=0):
+    """Return (image, address, entry) of a program: its bytes, where they are loaded and where it starts.
+
+    Assembly (.s) is assembled at base, hex images (.hex) are loaded at base and ELF executables where their
+    segments say.
+    """
+    if fileName[-2:] == '.s':
+        image, symbols = rv64asm.Assemble(open(fileName).read(), base)
+        return image, base, symbols.get('_start', base)
+    if fileName[-4:] == '.hex':
+        image = bytearray(''.join([line.strip().decode('hex')[::-1] for line in open(fileName) if line.strip()]))
+        return image, base, base
+
+    content = open(fileName, 'rb').read()
+    if content[:4] != '\x7fELF' or ord(content[4]) != 2:
+        raise ValueError('%s is not a 64 bit ELF executable, a hex image or assembly' % fileName)
+    entry, headerOffset = struct.unpack_from('<QQ', content, 24)
+    headerSize, headerCount = struct.unpack_from('<HH', content, 54)
+    segments = []
+    for header in range(0, headerCount):
+        kind, flags, offset, address, physical, fileSize, memorySize, align = struct.unpack_from(
+            '<IIQQQQQQ', content, headerOffset + header * headerSize)
+        if kind == 1:
+            segments.append((address, content[offset:offset + fileSize], memorySize))
+    start = min([address for address, data, memorySize in segments])
+    image = bytearray(max([address + memorySize for address, data, memorySize in segments]) - start)
+    for address, data, memorySize in segments:
+        image[address - start:address - start + len(data)] = data
+    return image, start, entry
+
+
+class Simulator:
+    """Runs a program over memoryBytes of memory from base, counting the instructions executed per mnemonic.
+
+    Accesses outside the memory, misaligned accesses and stores into the program are faults, counted by kind and
+    first address (or raised as ValueError when strict). Unmapped loads read 0 and unmapped stores are dropped,
+    so that the run goes on; stores into the program do not change the translated code. The run stops when the
+    program jumps out of its image, on a jump to itself (the end: beq x0, x0, end of the templates), on an illegal
+    instruction or after limit instructions.
+    """
+    def __init__(self, image, address, entry, base=0, memoryBytes=DEFAULT_MEMORY, strict=False):
+        if address < base or address + len(image) > base + memoryBytes:
+            raise ValueError('program at 0x%x-0x%x out of the memory at 0x%x-0x%x' % (
+                address, address + len(image), base, base + memoryBytes))
+        self.base = base
+        self.memory = bytearray(memoryBytes)
+        self.memory[address - base:address - base + len(image)] = image
+        self.imageStart = address
+        self.imageEnd = address + len(image)
+        self.entry = entry
+        self.strict = strict
+        self.x = [0] * 32
+        self.faults = collections.Counter()
+        self.firstFaults = {}
+        self.blocks = {}
+        self.blockNames = []
+        self.blockCounts = []
+        self.visits = []
+        self.stop = None
+        self.stopPC = None
+
+    def _Fault(self, kind, pc, address):
+        if self.strict:
+            raise ValueError('%s access to 0x%x at pc 0x%x' % (kind, address, pc))
+        self.faults[kind] += 1
+        if kind not in self.firstFaults:
+            self.firstFaults[kind] = (pc, address)
+
+    def Load(self, address, unpack, size, pc):
+        offset = address - self.base
+        if address & (size - 1) == 0 and 0 <= offset <= len(self.memory) - size:
+            return unpack(self.memory, offset)[0] & M
+        if address & (size - 1) != 0:
+            self._Fault('misaligned', pc, address)
+        if offset < 0 or offset + size > len(self.memory):
+            self._Fault('unmapped', pc, address)
+            return 0
+        return unpack(self.memory, offset)[0] & M
+
+    def Store(self, address, pack, size, value, pc):
+        offset = address - self.base
+        if address & (size - 1) != 0:
+            self._Fault('misaligned', pc, address)
+        if offset < 0 or offset + size > len(self.memory):
+            self._Fault('unmapped', pc, address)
+            return
+        if address < self.imageEnd and address + size > self.imageStart:
+            self._Fault('code', pc, address)
+        pack(self.memory, offset, value & ((1 << (8 * size)) - 1))
+
+    def _Word(self, pc):
+        if pc < self.imageStart or pc + 4 > self.imageEnd or pc % 4 != 0:
+            return None
+        return struct.unpack_from('<I', self.memory, pc - self.base)[0]
+
+    def _Translate(self, start):
+        """Translate the basic block at start into a function of the registers returning the next pc"""
+        lines = ['def Block(x):']
+        names = collections.Counter()
+        pc = start
+        while True:
+            word = self._Word(pc)
+            decoded = Decode(word) if word is not None else None
+            if decoded is None:
+                if pc == start:
+                    return None
+                lines.append('    return %d' % pc)
+                break
+            name, operation, rd, rs1, rs2, immediate = decoded
+            names[name] += 1
+            a = 'x[%d]' % rs1 if rs1 != 0 else '0'
+            b = 'x[%d]' % rs2 if rs2 != 0 else '0'
+            d = 'x[%d]' % rd
+            following = pc + 4
+            if operation in _conditions:
+                lines.append('    return %d if %s else %d' % ((pc + immediate) & M,
+                                                               _conditions[operation].format(a=a, b=b), following))
+                break
+            elif operation == 'jal':
+                if rd != 0:
+                    lines.append('    %s = %d' % (d, following))
+                lines.append('    return %d' % ((pc + immediate) & M))
+                break
+            elif operation == 'jalr':
+                lines.append('    target = (%s + %d) & %d' % (a, immediate, M & ~1))
+                if rd != 0:
+                    lines.append('    %s = %d' % (d, following))
+                lines.append('    return target')
+                break
+            elif operation in _loadFormats:
+                size = _loadFormats[operation][1]
+                load = 'Load((%s + %d) & M, %s, %d, %d)' % (a, immediate, operation, size, pc)
+                lines.append('    %s = %s' % (d, load) if rd != 0 else '    ' + load)
+            elif operation in _storeFormats:
+                size = _storeFormats[operation][1]
+                lines.append('    Store((%s + %d) & M, %s, %d, %s, %d)' % (a, immediate, operation, size, b, pc))
+            elif rd == 0:
+                pass
+            elif operation == 'lui':
+                lines.append('    %s = %d' % (d, immediate & M))
+            elif operation == 'auipc':
+                lines.append('    %s = %d' % (d, (pc + immediate) & M))
+            else:
+                lines.append('    %s = %s' % (d, _operations[operation].format(a=a, b=b, i=immediate,
+                                                                               u=immediate & M)))
+            pc = following
+
+        namespace = {'M': M, 'S': S, 'S32': S32, 'W': W, 'Div': Div, 'Divu': Divu, 'Rem': Rem, 'Remu': Remu,
+                     'Load': self.Load, 'Store': self.Store}
+        # loads and stores get the packing function of their width, named after them
+        namespace.update([(name, struct.Struct(fmt).unpack_from) for name, (fmt, size) in _loadFormats.items()])
+        namespace.update([(name, struct.Struct(fmt).pack_into) for name, (fmt, size) in _storeFormats.items()])
+        exec compile('\n'.join(lines) + '\n', '<block 0x%x>' % start, 'exec') in namespace
+        selfLoop = pc == start and lines[-1].startswith('    return %d if' % start)
+        block = (len(self.visits), namespace['Block'], sum(names.values()), selfLoop)
+        self.blocks[start] = block
+        self.blockNames.append(names)
+        self.visits.append(0)
+        return block
+
+    def Run(self, limit=DEFAULT_LIMIT):
+        """Run the program until it stops, returning the number of instructions executed"""
+        pc = self.entry
+        executed = 0
+        x = self.x
+        blocks = self.blocks
+        visits = self.visits
+        while executed < limit:
+            block = blocks.get(pc)
+            if block is None:
+                if pc < self.imageStart or pc >= self.imageEnd:
+                    self.stop = 'exit'
+                    break
+                block = self._Translate(pc)
+                if block is None:
+                    self.stop = 'illegal instruction'
+                    break
+            index, function, count, selfLoop = block
+            visits[index] += 1
+            executed += count
+            following = function(x)
+            if following == pc and selfLoop:
+                # the jump to itself was already counted by the block jumping to it
+                visits[index] -= 1
+                executed -= count
+                self.stop = 'halt'
+                break
+            pc = following
+        else:
+            self.stop = 'limit'
+        self.stopPC = pc
+        return executed
+
+    def Instructions(self):
+        """Return the instructions executed per mnemonic"""
+        counts = collections.Counter()
+        for names, visits in zip(self.blockNames, self.visits):
+            if visits > 0:
+                for name, count in names.items():
+                    counts[name] += count * visits
+        return dict(counts)
+
+
+def EnergyReport(instructions, tableName):
+    """Print the ib-power.py report of the instruction counts under a power table, with the instructions that used
+    its default power"""
+    opcodes = tracereader.OpcodeIndex()
+    names = sorted(instructions.keys())
+    ids = numpy.array([opcodes.Intern(name) for name in names], dtype=numpy.int64)
+    scorer = TraceScorer([PowerTable(tableName)], opcodes)
+    scorer.Score(numpy.ones(len(ids), dtype=bool), ids, numpy.array([instructions[name] for name in names],
+                                                                     dtype=numpy.float64))
+    PrintReports(scorer, [tableName])
+
+
+def SimulatedName(fileName):
+    """Name of the predicted instruction count CSV of a program. Not .instr.csv, the name of the counts measured by
+    runlogstat.py, so that resultstore.py never takes predictions for runs."""
+    return os.path.splitext(fileName)[0] + SIMULATED_SUFFIX
+
+
+def SimulateProgram(task):
+    """Run a program and write its instruction counts, returning (fileName, instructions, executed, stop, faults,
+    first faults, seconds)"""
+    fileName, outputName, base, memoryBytes, limit, strict = task
+    started = time.time()
+    try:
+        image, address, entry = LoadProgram(fileName, base)
+        simulator = Simulator(image, address, entry, base, memoryBytes, strict)
+    except (ValueError, IOError, struct.error) as error:
+        # A program that does not assemble or load is as broken as one that faults, the batch goes on
+        return (fileName, {}, 0, 'not loaded: %s' % error, {}, {}, time.time() - started)
+    try:
+        simulator.Run(limit)
+    except ValueError as error:
+        simulator.stop = 'stopped by a %s' % error
+    instructions = simulator.Instructions()
+    executed = sum(instructions.values())
+    if outputName is not None:
+        outputFile = open(outputName, 'wt')
+        csv.writer(outputFile).writerows(DictToCSV(instructions))
+        outputFile.close()
+    return (fileName, instructions, executed, simulator.stop, dict(simulator.faults), simulator.firstFaults,
+            time.time() - started)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Run template programs in a functional RV64IM simulator and write '
+                                     'their instruction counts, as runlogstat.py does for Rocket traces')
+
+    parser.add_argument('programs', nargs='+', help='Programs: assembly (.s), hex images (.hex) or ELF executables')
+    parser.add_argument('-o', '--output', required=False,
+                        help='CSV file receiving the instruction counts of a single program (default '
+                        '<program>%s next to every program)' % SIMULATED_SUFFIX)
+    parser.add_argument('-t', '--table', required=False,
+                        help='Instruction Based Power Table to print the energy estimate of every program with')
+    parser.add_argument('-b', '--base', required=False, default='0',
+                        help='Address of the memory, where assembly and hex images are loaded (default 0)')
+    parser.add_argument('-m', '--memory', required=False, default=str(DEFAULT_MEMORY),
+                        help='Bytes of memory (default 0x%x)' % DEFAULT_MEMORY)
+    parser.add_argument('-l', '--limit', required=False, type=int, default=DEFAULT_LIMIT,
+                        help='Instructions after which a program is stopped (default %d)' % DEFAULT_LIMIT)
+    parser.add_argument('--strict', required=False, action='store_true',
+                        help='Stop a program at its first unmapped, misaligned or code access')
+    parser.add_argument('-j', '--jobs', required=False, type=int, default=1,
+                        help='Programs simulated in parallel (0 uses every CPU)')
+
+    args = parser.parse_args()
+
+    if args.output is not None and len(args.programs) > 1:
+        parser.error('--output takes a single program')
+    tasks = [(fileName, args.output or SimulatedName(fileName), int(args.base, 0), int(args.memory, 0), args.limit,
+              args.strict) for fileName in args.programs]
+
+    pool = None
+    if args.jobs == 1 or len(tasks) == 1:
+        results = (SimulateProgram(task) for task in tasks)
+    else:
+        pool = multiprocessing.Pool(args.jobs or None)
+        results = pool.imap(SimulateProgram, tasks)
+
+    broken = 0
+    try:
+        for fileName, instructions, executed, stop, faults, firstFaults, seconds in results:
+            print '%s: %d instructions, %s, %.2f M instructions/s' % (fileName, executed, stop,
+                                                                       executed / max(seconds, 1e-6) / 1e6)
+            for kind in sorted(faults.keys()):
+                print '    %d %s accesses, first to 0x%x at pc 0x%x' % (faults[kind], kind, firstFaults[kind][1],
+                                                                         firstFaults[kind][0])
+            if len(faults) > 0 or stop not in ('exit', 'halt'):
+                broken += 1
+            if args.table is not None and executed > 0:
+                EnergyReport(instructions, args.table)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if len(tasks) > 1:
+        print '%d of %d programs with faults or not ending' % (broken, len(tasks))
+    sys.exit(1 if broken > 0 else 0)
@@ -0,0 +1,32 @@
+#!/usr/bin/python
+
+import struct
+import unittest
+import rv64asm
+
+
+class EncodingTest(unittest.TestCase):
+    def testReferences(self):
+        for assembly, reference in rv64asm._references:
+            fields = assembly.split(None, 1)
+            operands = [operand.strip() for operand in fields[1].split(',')] if len(fields) > 1 else []
+            self.assertEqual(rv64asm.EncodeInstruction(fields[0], operands), [reference], assembly)
+
+    def testSelfTest(self):
+        self.assertEqual(rv64asm.SelfTest(), [])
+
+    def testLabels(self):
+        image, symbols = rv64asm.Assemble('_start:\n  li t0, 3\nloop:\n  addi t0, t0, -1\n  bne t0, zero, loop\n', 0x100)
+        self.assertEqual(symbols, {'_start': 0x100, 'loop': 0x104})
+        self.assertEqual(struct.unpack('<3I', str(image)), (0x00300293, 0xfff28293, 0xfe029ee3))
+
+    def testELFEntry(self):
+        image, symbols = rv64asm.Assemble('  nop\n_start:\n  nop\n', 0x80000000)
+        content = rv64asm.ELF(image, 0x80000000, symbols['_start'])
+        self.assertEqual(struct.unpack_from('<Q', content, 24)[0], 0x80000004)
+        self.assertEqual(struct.unpack_from('<QQ', content, 64 + 16), (0x80000000, 0x80000000))
+        self.assertEqual(content[0x1000:], str(image))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+
+import argparse
+import os
+import tracereader
+import bz2parallel
+import ibtrace
+import loopfold
+import tracesinks
+from powertable import PowerTable, MakeTimelines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Read an instruction trace once and produce the instruction '
+                                     'histogram (runlogstat.py), energy report and timeline (ib-power.py) in one pass')
+
+    parser.add_argument('-i', '--input', required=False, help='Input file containing instruction trace (text, bz2 or .ibt)')
+    parser.add_argument('-s', '--stats', required=False,
+                        help='CSV file receiving the executed instructions per mnemonic, as written by runlogstat.py')
+    parser.add_argument('--sequences', required=False,
+                        help='File receiving the counts of consecutive instruction sequences of every core '
+                        '(sparse CSV, or NumPy arrays if it ends in .npz)')
+    parser.add_argument('-n', '--sequence-size', required=False, type=int, default=2,
+                        help='Instructions per counted sequence, 2 (pairs, the default) to 4')
+    parser.add_argument('--no-stalls', required=False, action='store_true',
+                        help='Leave stalled cycles out of the sequences, which then only hold executed instructions '
+                        '(by default a stall is a sequence element of its own)')
+    parser.add_argument('-t', '--table', required=False, nargs='+', action='append',
+                        help='Instruction Based Power Table to report the energy with, several tables can be given')
+    parser.add_argument('-g', '--graph', required=False,
+                        help='CSV file receiving the energy of every window of cycles, one row per window')
+    parser.add_argument('-w', '--window', required=False,
+                        help='Comma separated window sizes in cycles for the timeline and peak power (default 1000)')
+    parser.add_argument('-a', '--average', required=False, type=int, default=10,
+                        help='Number of windows in the moving average power (default 10)')
+    parser.add_argument('--format', required=False, default='auto', choices=['auto', 'rocket', 'spike'],
+                        help='Trace format, detected from the first lines by default')
+    parser.add_argument('--no-loops', required=False, action='store_true',
+                        help='Parse and score every record, instead of folding repeated loop iterations')
+    parser.add_argument('-j', '--jobs', required=False, type=int, default=1,
+                        help='Processes decompressing a bz2 trace in parallel (0 uses every CPU)')
+
+    args = parser.parse_args()
+
+    opcodes = tracereader.OpcodeIndex()
+    sinks = []
+    if args.stats is not None:
+        sinks.append(tracesinks.HistogramSink(opcodes, args.stats))
+    if args.sequences is not None:
+        sinks.append(tracesinks.TransitionSink(opcodes, args.sequences, args.sequence_size,
+                                                 not args.no_stalls))
+
+    if args.table is not None:
+        tableNames = sum(args.table, [])
+        powerTables = [PowerTable(tableName) for tableName in tableNames]
+        windows = []
+        if args.window is not None:
+            windows = [int(window) for window in args.window.split(',')]
+        elif args.graph is not None:
+            windows = [1000]
+        if any([window < 1 for window in windows]):
+            parser.error('window sizes must be at least 1 cycle, not %s' % args.window)
+        if args.average < 1:
+            parser.error('the moving average needs at least 1 window, not %d' % args.average)
+        tableColumns = [os.path.splitext(os.path.basename(tableName))[0] for tableName in tableNames]
+        sinks.append(tracesinks.EnergySink(powerTables, opcodes, tableNames,
+                                           MakeTimelines(windows, args.graph, tableColumns, args.average)))
+
+    if len(sinks) == 0:
+        parser.error('nothing to do, give --stats, --sequences and/or --table')
+
+    folder = None
+    if not args.no_loops:
+        folder = loopfold.LoopFolder()
+    traceParser = tracereader.TraceParser(opcodes, args.format, folder)
+
+    if ibtrace.IsIBT(args.input):
+        chunks = tracesinks.ArrayChunks(ibtrace.ReadTraceArrays(args.input, opcodes))
+    elif args.jobs != 1 and args.input is not None and args.input[-3:] == 'bz2':
+        chunks = tracesinks.ArrayChunks(bz2parallel.ReadTraceArrays(args.input, traceParser, args.jobs or None))
+    else:
+        chunks = tracesinks.TextChunks(tracereader.ReadBuffers(tracereader.OpenTrace(args.input)), traceParser,
+                                       all([sink.folded for sink in sinks]))
+
+    tracesinks.RunPipeline(chunks, sinks)
+
+    if traceParser.skipped > 0:
+        print '%d malformed trace lines skipped' % traceParser.skipped
+
+    for sink in sinks:
+        sink.Finish()
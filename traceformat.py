@@ -0,0 +1,159 @@
+#!/usr/bin/python
+
+import numpy
+
+
+# Longest mnemonic extracted by the vectorized path, longer ones go through the per-line fallback
+_mnemonicWidth = 16
+_whitespace = numpy.array([ord(' '), ord('\t'), ord('\r'), ord('\n')], dtype=numpy.uint8)
+
+
+def _Gather(content, offsets, ends, width):
+    """Return the width bytes of content starting at each offset as a 2D array, blanking anything past ends"""
+    columns = offsets[:, numpy.newaxis] + numpy.arange(0, width)
+    window = content[numpy.minimum(columns, len(content) - 1)]
+    window[columns >= ends[:, numpy.newaxis]] = ord(' ')
+    return window
+
+
+def ExtractMnemonics(data, content, offsets, ends, opcodes):
+    """Intern the first whitespace separated word found at each offset, up to the matching end of line.
+
+    Returns the opcode ids and a mask of the lines where a word was found. Words are compared as fixed-width byte
+    strings, only those that are unusual (leading blanks, very long words) are extracted line by line.
+    """
+    window = _Gather(content, offsets, ends, _mnemonicWidth)
+    blank = numpy.in1d(window, _whitespace).reshape(window.shape)
+    tokenEnd = numpy.where(blank.any(axis=1), blank.argmax(axis=1), _mnemonicWidth)
+    regular = ~blank[:, 0] & (tokenEnd < _mnemonicWidth)
+    window[numpy.arange(0, _mnemonicWidth) >= tokenEnd[:, numpy.newaxis]] = 0
+
+    ids = numpy.zeros(len(offsets), dtype=numpy.int32)
+    found = regular.copy()
+    if regular.any():
+        tokens = numpy.ascontiguousarray(window[regular]).view('S%d' % _mnemonicWidth).ravel()
+        names, first, inverse = numpy.unique(tokens, return_index=True, return_inverse=True)
+        # Intern in order of first appearance, like a line by line parser would
+        table = numpy.zeros(len(names), dtype=numpy.int32)
+        for name in numpy.argsort(first, kind='mergesort').tolist():
+            table[name] = opcodes.Intern(str(names[name]))
+        ids[regular] = table[inverse]
+
+    for line in numpy.flatnonzero(~regular).tolist():
+        words = data[offsets[line]:ends[line]].split()
+        if len(words) > 0:
+            ids[line] = opcodes.Intern(words[0])
+            found[line] = True
+    return ids, found
+
+
+class FixedColumnFormat:
+    """A trace format whose fields sit at fixed columns of every record line.
+
+    markers maps columns to the characters identifying a record line, core is the (start, end) columns of the
+    decimal core number, executed the column of the executed flag (None if every record is an executed
+    instruction) and mnemonic the column where the disassembled instruction starts. key lists the (start, end)
+    columns telling records apart for loop folding (see loopfold.py): records with equal keys must be the same
+    instruction (same core, flag, pc and instruction word).
+    """
+    def __init__(self, name, markers, core, executed, mnemonic, key):
+        self.name = name
+        self.markers = markers
+        self.core = core
+        self.executed = executed
+        self.mnemonic = mnemonic
+        self.key = key
+
+    def Detect(self, data):
+        """Tell whether some of the first lines of data look like records of this format"""
+        for line in data[:65536].splitlines()[:100]:
+            if self.IsRecord(line):
+                return True
+        return False
+
+    def IsRecord(self, line):
+        if len(line) <= self.mnemonic:
+            return False
+        for column, character in self.markers.items():
+            if line[column] != character:
+                return False
+        return True
+
+    def _Keys(self, content, first):
+        columns = numpy.concatenate([numpy.arange(start, end) for start, end in self.key])
+        return content[first[:, numpy.newaxis] + columns]
+
+    def Parse(self, data, content, starts, ends, opcodes, folder=None):
+        """Parse the lines [starts, ends) of data (content being the same bytes as a numpy array).
+
+        Returns (positions, cores, executed, ids, skipped, index): the indexes of the record lines, the fields of
+        the distinct records, the number of lines marked as records but too short to hold an instruction and the
+        distinct record of every record line. Records are only told apart by a LoopFolder, without one index is
+        None and every record is distinct.
+        """
+        length = ends - starts
+        marked = length > max(self.markers.keys())
+        for column, character in self.markers.items():
+            marked[marked] &= content[starts[marked] + column] == ord(character)
+        positions = numpy.flatnonzero(marked & (length > self.mnemonic))
+        skipped = int(numpy.count_nonzero(marked)) - len(positions)
+
+        index = None
+        distinct = positions
+        if folder is not None and len(positions) > 0:
+            source = folder.Fold(self._Keys(content, starts[positions]))
+            isFirst = source == numpy.arange(0, len(positions))
+            index = numpy.cumsum(isFirst) - 1
+            index = index[source]
+            distinct = positions[isFirst]
+
+        ids, found = ExtractMnemonics(data, content, starts[distinct] + self.mnemonic, ends[distinct], opcodes)
+        if not found.all():
+            skipped += len(positions) - int(numpy.count_nonzero(found[index] if index is not None else found))
+            if index is not None:
+                kept = found[index]
+                positions = positions[kept]
+                index = (numpy.cumsum(found) - 1)[index[kept]]
+            else:
+                positions = positions[found]
+            distinct = distinct[found]
+            ids = ids[found]
+        first = starts[distinct]
+
+        digits = _Gather(content, first + self.core[0], first + self.core[1], self.core[1] - self.core[0])
+        isDigit = (digits >= ord('0')) & (digits <= ord('9'))
+        cores = numpy.zeros(len(distinct), dtype=numpy.int64)
+        for column in range(0, digits.shape[1]):
+            cores = numpy.where(isDigit[:, column], cores * 10 + digits[:, column] - ord('0'), cores)
+
+        if self.executed is None:
+            executed = numpy.ones(len(distinct), dtype=bool)
+        else:
+            executed = content[first + self.executed] == ord('1')
+        return (positions, cores.astype(numpy.uint8), executed, ids, skipped, index)
+
+
+# Rocket emulator: C0:      12345 [1] pc=[...] W[...][.] R[...] R[...] inst=[...] DASM
+RocketFormat = FixedColumnFormat('rocket', {0: 'C', 2: ':'}, (1, 2), 16, 126, [(1, 2), (16, 17), (23, 33), (116, 124)])
+
+# Spike -l (disassembly lines, also printed with --log-commits): core   0: 0x<pc 16> (0x<inst 8>) DASM
+# The commit lines of --log-commits (core   0: 3 0x...) carry no mnemonic and are not records.
+SpikeFormat = FixedColumnFormat('spike', {0: 'c', 1: 'o', 2: 'r', 3: 'e', 8: ':', 10: '0', 11: 'x', 29: '('},
+                                (4, 8), None, 42, [(4, 8), (12, 28), (32, 40)])
+
+formats = [RocketFormat, SpikeFormat]
+
+
+def GetFormat(name):
+    for traceFormat in formats:
+        if traceFormat.name == name:
+            return traceFormat
+    raise ValueError('Unknown trace format %s' % name)
+
+
+def DetectFormat(data):
+    """Return the first known format matching the beginning of data, Rocket if none does"""
+    for traceFormat in formats:
+        if traceFormat.Detect(data):
+            return traceFormat
+    return RocketFormat
@@ -0,0 +1,216 @@
+#!/usr/bin/python
+
+import bz2
+import numpy
+import os
+import select
+import stat
+import sys
+import time
+import traceformat
+
+
+# Bytes of trace text (rounded to whole lines) or number of records handed out at a time. Memory use is bounded
+# by these values, not by the length of the trace.
+DEFAULT_BUFFER_SIZE = 8 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 65536
+
+
+class OpcodeIndex:
+    """Interns mnemonics to small consecutive integer ids, in order of first appearance"""
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+    def Intern(self, name):
+        opcode = self.ids.get(name)
+        if opcode is None:
+            opcode = len(self.names)
+            self.ids[name] = opcode
+            self.names.append(name)
+        return opcode
+
+    def __len__(self):
+        return len(self.names)
+
+
+class MultiStreamBZ2File:
+    """Reads a bz2 file made of several concatenated streams, as written by pbzip2 or cat.
+
+    bz2.BZ2File stops at the end of the first stream; here a new decompressor takes over the data left after each
+    stream end, so the whole file is read.
+    """
+    def __init__(self, fileName, readSize=1024 * 1024):
+        self.inputFile = open(fileName, 'rb')
+        self.readSize = readSize
+        self.decompressor = bz2.BZ2Decompressor()
+        self.buffer = ''
+
+    def _Decompress(self, data):
+        pieces = [self.buffer]
+        while len(data) > 0:
+            try:
+                pieces.append(self.decompressor.decompress(data))
+            except EOFError:
+                # The previous stream ended exactly at the end of the data read before
+                self.decompressor = bz2.BZ2Decompressor()
+                continue
+            data = self.decompressor.unused_data
+            if len(data) > 0:
+                self.decompressor = bz2.BZ2Decompressor()
+        self.buffer = ''.join(pieces)
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            data = self.inputFile.read(self.readSize)
+            if len(data) == 0:
+                break
+            self._Decompress(data)
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def close(self):
+        self.inputFile.close()
+
+
+def OpenTrace(fileName):
+    """Open an instruction trace for reading. None means stdin, names ending in bz2 are decompressed on the fly
+    (all their streams)."""
+    if fileName is None:
+        return sys.stdin
+    elif fileName[-3:] == 'bz2':
+        return MultiStreamBZ2File(fileName)
+    else:
+        return open(fileName)
+
+
+def ReadBuffers(inputFile, bufferSize=DEFAULT_BUFFER_SIZE):
+    """Yield the content of inputFile in strings of about bufferSize bytes, each holding whole lines"""
+    partial = ''
+    while True:
+        data = inputFile.read(bufferSize)
+        if len(data) == 0:
+            break
+        end = data.rfind('\n') + 1
+        if end == 0:
+            partial += data
+            continue
+        yield partial + data[:end]
+        partial = data[end:]
+    if len(partial) > 0:
+        yield partial
+
+
+def FollowBuffers(fileName, pollInterval=0.5, idleTimeout=None, bufferSize=DEFAULT_BUFFER_SIZE):
+    """Yield the content of a trace that is still being written, in strings holding whole lines.
+
+    fileName may be a regular file, which is tailed as it grows, or a FIFO (None means stdin), which is read until
+    the writer closes it. An empty string is yielded every pollInterval seconds without new data, so the caller can
+    report while waiting. Following stops at the end of a FIFO or after idleTimeout seconds without new data.
+    Incomplete lines are held back until their newline arrives.
+    """
+    if fileName is None:
+        descriptor = sys.stdin.fileno()
+    else:
+        descriptor = os.open(fileName, os.O_RDONLY)
+    try:
+        tail = not stat.S_ISFIFO(os.fstat(descriptor).st_mode) and not os.isatty(descriptor)
+
+        partial = ''
+        lastData = time.time()
+        while True:
+            data = None
+            if tail:
+                data = os.read(descriptor, bufferSize)
+                if len(data) == 0:
+                    data = None
+                    time.sleep(pollInterval)
+            elif len(select.select([descriptor], [], [], pollInterval)[0]) > 0:
+                data = os.read(descriptor, bufferSize)
+                if len(data) == 0:
+                    break
+
+            if data is None:
+                if idleTimeout is not None and time.time() - lastData > idleTimeout:
+                    break
+                yield ''
+                continue
+            lastData = time.time()
+
+            end = data.rfind('\n') + 1
+            if end == 0:
+                partial += data
+                continue
+            yield partial + data[:end]
+            partial = data[end:]
+
+        if len(partial) > 0:
+            yield partial
+    finally:
+        if fileName is not None:
+            os.close(descriptor)
+
+
+class TraceParser:
+    """Parses buffers of trace text into arrays, without splitting them into lines.
+
+    The trace format (see traceformat.py) is given by name, or detected on the first buffer when None. Mnemonics
+    are interned through opcodes (an OpcodeIndex). Lines that look like records but hold no instruction are
+    counted in self.skipped. With a loopfold.LoopFolder, records repeating an earlier record of the same buffer
+    (loop iterations) take their fields from it instead of being parsed again.
+    """
+    def __init__(self, opcodes, formatName=None, folder=None):
+        self.opcodes = opcodes
+        self.traceFormat = None
+        if formatName is not None and formatName != 'auto':
+            self.traceFormat = traceformat.GetFormat(formatName)
+        self.folder = folder
+        self.skipped = 0
+
+    def _Parse(self, data):
+        if self.traceFormat is None:
+            self.traceFormat = traceformat.DetectFormat(data)
+        content = numpy.frombuffer(data, dtype=numpy.uint8)
+        ends = numpy.flatnonzero(content == ord('\n'))
+        if len(data) > 0 and data[-1] != '\n':
+            ends = numpy.append(ends, len(data))
+        starts = numpy.zeros(len(ends), dtype=ends.dtype)
+        starts[1:] = ends[:-1] + 1
+        positions, cores, executed, ids, skipped, index = self.traceFormat.Parse(data, content, starts, ends,
+                                                                                 self.opcodes, self.folder)
+        self.skipped += skipped
+        return (starts, ends, positions, cores, executed, ids, index)
+
+    def Parse(self, data):
+        """Parse a string of whole lines.
+
+        Returns (starts, ends, positions, cores, executed, ids): where every line starts and ends (newline excluded),
+        the index of the line of every record, and the core, executed flag and opcode id of every record.
+        """
+        starts, ends, positions, cores, executed, ids, index = self._Parse(data)
+        if index is not None:
+            cores, executed, ids = cores[index], executed[index], ids[index]
+        return (starts, ends, positions, cores, executed, ids)
+
+    def ParseFolded(self, data):
+        """Parse a string of whole lines, returning each distinct record once.
+
+        Returns (cores, executed, ids, weights), weights being the number of records of data every distinct record
+        stands for (None when every record is distinct, as without a folder). Only fit for totals, as the order of
+        the records is lost.
+        """
+        starts, ends, positions, cores, executed, ids, index = self._Parse(data)
+        weights = None
+        if index is not None:
+            weights = numpy.bincount(index, minlength=len(ids))
+        return (cores, executed, ids, weights)
+
+
+def ReadTraceArrays(inputFile, parser, bufferSize=DEFAULT_BUFFER_SIZE):
+    """Yield (cores, executed, ids) arrays for every buffer of inputFile, parsed with a TraceParser"""
+    for data in ReadBuffers(inputFile, bufferSize):
+        starts, ends, positions, cores, executed, ids = parser.Parse(data)
+        if len(positions) > 0:
+            yield (cores, executed, ids)
@@ -0,0 +1,209 @@
+#!/usr/bin/python
+
+import csv
+import numpy
+from powertable import TraceScorer, PrintReports
+
+
+# A sink receives every chunk of a trace pass through Add(cores, executed, ids, weights) and produces its output in
+# Finish. Sinks with folded set accept the distinct records of a chunk with weights (see
+# tracereader.TraceParser.ParseFolded), the others get every record in trace order with weights None.
+
+
+def DictToCSV(d):
+    table = []
+    for item in sorted(d.keys()):
+        table.append([item, d[item]])
+    return table
+
+
+class HistogramSink:
+    """Counts the executed instructions per mnemonic and the stalled cycles, as runlogstat.py does"""
+    folded = True
+
+    def __init__(self, opcodes, fileName=None):
+        self.opcodes = opcodes
+        self.fileName = fileName
+        self.counts = numpy.zeros(0, dtype=numpy.int64)
+        self.stalled = 0
+
+    def Add(self, cores, executed, ids, weights=None):
+        chunkCounts = numpy.bincount(ids[executed], None if weights is None else weights[executed],
+                                     minlength=len(self.opcodes)).astype(numpy.int64)
+        chunkCounts[:len(self.counts)] += self.counts
+        self.counts = chunkCounts
+        if weights is None:
+            self.stalled += len(executed) - int(numpy.count_nonzero(executed))
+        else:
+            self.stalled += int(weights[~executed].sum())
+
+    def Instructions(self):
+        """Return the executed instructions per mnemonic, plus 'stall' for the stalled cycles if any"""
+        executedInstructions = {}
+        for opcode in numpy.flatnonzero(self.counts):
+            executedInstructions[self.opcodes.names[opcode]] = int(self.counts[opcode])
+        if self.stalled > 0:
+            executedInstructions['stall'] = int(self.stalled)
+        return executedInstructions
+
+    def Finish(self):
+        executedInstructions = self.Instructions()
+        if self.fileName is not None:
+            outputFile = open(self.fileName, 'wt')
+            csv.writer(outputFile).writerows(DictToCSV(executedInstructions))
+            outputFile.close()
+        else:
+            for instruction in executedInstructions.keys():
+                print instruction, executedInstructions[instruction]
+
+
+class EnergySink:
+    """Scores the trace under one or several power tables and prints the ib-power.py report of each.
+
+    Timelines (see powertable.MakeTimelines) need every cycle in order, so a sink with timelines does not take
+    folded chunks.
+    """
+    def __init__(self, powerTables, opcodes, tableNames, timelines=()):
+        self.scorer = TraceScorer(powerTables, opcodes, timelines)
+        self.tableNames = tableNames
+        self.folded = len(self.scorer.timelines) == 0
+
+    def Add(self, cores, executed, ids, weights=None):
+        self.scorer.Score(executed, ids, weights)
+
+    def Finish(self):
+        self.scorer.Close()
+        PrintReports(self.scorer, self.tableNames)
+
+
+class TransitionSink:
+    """Counts the sequences of size consecutive instructions (opcode pairs by default) of every core.
+
+    Instructions are numbered as opcode id + 1, 0 standing for a stalled cycle (left out of the sequences with
+    stalls unset). Pairs are counted in a dense opcodes x opcodes matrix per core, updated with a single bincount
+    of the pair indexes of each chunk. Longer sequences are packed 16 bits per instruction into a uint64 code and
+    counted sparsely. Finish writes the nonzero counts to fileName, as .npz if it ends so and as CSV rows of
+    core, mnemonics and count otherwise.
+    """
+    folded = False
+
+    def __init__(self, opcodes, fileName, size=2, stalls=True):
+        if size < 2 or size > 4:
+            raise ValueError('Instruction sequences must hold 2 to 4 instructions, not %d' % size)
+        self.opcodes = opcodes
+        self.fileName = fileName
+        self.size = size
+        self.stalls = stalls
+        self.pairs = {}
+        self.codes = {}
+        self.history = {}
+
+    def Add(self, cores, executed, ids, weights=None):
+        if weights is not None:
+            raise ValueError('Instruction sequences need every record in trace order')
+        if len(self.opcodes) + 1 > 65536:
+            raise ValueError('Too many distinct opcodes for instruction sequences: %d' % len(self.opcodes))
+        tokens = numpy.where(executed, ids.astype(numpy.int64) + 1, 0)
+        for core in numpy.unique(cores).tolist():
+            selected = cores == core
+            if not self.stalls:
+                selected &= executed
+            sequence = numpy.concatenate((self.history.get(core, numpy.zeros(0, dtype=numpy.int64)),
+                                          tokens[selected]))
+            self.history[core] = sequence[max(0, len(sequence) - self.size + 1):]
+            if len(sequence) < self.size:
+                continue
+            if self.size == 2:
+                self._AddPairs(core, sequence)
+            else:
+                self._AddCodes(core, sequence)
+
+    def _AddPairs(self, core, sequence):
+        count = len(self.opcodes) + 1
+        pairs = numpy.bincount(sequence[:-1] * count + sequence[1:], minlength=count * count)
+        matrix = self.pairs.get(core)
+        if matrix is None or matrix.shape[0] < count:
+            grown = numpy.zeros((count, count), dtype=numpy.int64)
+            if matrix is not None:
+                grown[:matrix.shape[0], :matrix.shape[1]] = matrix
+            matrix = grown
+            self.pairs[core] = matrix
+        matrix += pairs.reshape(count, count)
+
+    def _AddCodes(self, core, sequence):
+        length = len(sequence) - self.size + 1
+        codes = numpy.zeros(length, dtype=numpy.uint64)
+        for offset in range(0, self.size):
+            codes = (codes << numpy.uint64(16)) | sequence[offset:offset + length].astype(numpy.uint64)
+        codes, counts = numpy.unique(codes, return_counts=True)
+        if core in self.codes:
+            known, knownCounts = self.codes[core]
+            codes, index = numpy.unique(numpy.concatenate((known, codes)), return_inverse=True)
+            counts = numpy.bincount(index, numpy.concatenate((knownCounts, counts))).astype(numpy.int64)
+        self.codes[core] = (codes, counts)
+
+    def Names(self):
+        return ['stall'] + self.opcodes.names
+
+    def Sequences(self):
+        """Return (cores, sequences, counts): the core, instruction numbers (one column per position) and count of
+        every sequence seen, by core and decreasing count"""
+        allCores = []
+        allSequences = []
+        allCounts = []
+        for core, matrix in self.pairs.items():
+            first, second = numpy.nonzero(matrix)
+            allSequences.append(numpy.column_stack((first, second)))
+            allCounts.append(matrix[first, second])
+            allCores.append(numpy.repeat(core, len(first)))
+        for core, (codes, counts) in self.codes.items():
+            shifts = numpy.arange(self.size - 1, -1, -1).astype(numpy.uint64) * numpy.uint64(16)
+            allSequences.append(((codes[:, numpy.newaxis] >> shifts) & numpy.uint64(0xffff)).astype(numpy.int64))
+            allCounts.append(counts)
+            allCores.append(numpy.repeat(core, len(codes)))
+        if len(allCounts) == 0:
+            return (numpy.zeros(0, dtype=numpy.int64), numpy.zeros((0, self.size), dtype=numpy.int64),
+                    numpy.zeros(0, dtype=numpy.int64))
+        cores = numpy.concatenate(allCores)
+        sequences = numpy.vstack(allSequences)
+        counts = numpy.concatenate(allCounts)
+        order = numpy.lexsort((-counts, cores))
+        return (cores[order], sequences[order], counts[order])
+
+    def Finish(self):
+        cores, sequences, counts = self.Sequences()
+        if self.fileName[-4:] == '.npz':
+            numpy.savez_compressed(self.fileName, names=numpy.array(self.Names()), cores=cores, sequences=sequences,
+                                   counts=counts)
+        else:
+            names = self.Names()
+            outputFile = open(self.fileName, 'wt')
+            writer = csv.writer(outputFile)
+            for core, sequence, count in zip(cores.tolist(), sequences.tolist(), counts.tolist()):
+                writer.writerow([core] + [names[token] for token in sequence] + [count])
+            outputFile.close()
+
+
+def RunPipeline(chunks, sinks):
+    """Hand every (cores, executed, ids, weights) chunk to all sinks, which are finished by the caller"""
+    for cores, executed, ids, weights in chunks:
+        for sink in sinks:
+            sink.Add(cores, executed, ids, weights)
+
+
+def TextChunks(buffers, parser, folded):
+    """Parse buffers of trace text into pipeline chunks, folding repeated records when every sink allows it"""
+    for data in buffers:
+        if len(data) == 0:
+            continue
+        if folded:
+            yield parser.ParseFolded(data)
+        else:
+            starts, ends, positions, cores, executed, ids = parser.Parse(data)
+            yield (cores, executed, ids, None)
+
+
+def ArrayChunks(chunks):
+    """Turn (cores, executed, ids) chunks (tracereader, bz2parallel and ibtrace readers) into pipeline chunks"""
+    for cores, executed, ids in chunks:
+        yield (cores, executed, ids, None)
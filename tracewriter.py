@@ -0,0 +1,86 @@
+#!/usr/bin/python
+
+import bz2
+import gzip
+import numpy
+import sys
+
+
+def OpenAnnotated(fileName):
+    """Open the annotated trace output. None means stdout, .bz2, .gz and .xz names are compressed on the fly."""
+    if fileName is None:
+        return sys.stdout
+    elif fileName[-4:] == '.bz2':
+        return bz2.BZ2File(fileName, 'w')
+    elif fileName[-3:] == '.gz':
+        return gzip.open(fileName, 'wb')
+    elif fileName[-3:] == '.xz':
+        try:
+            import lzma
+        except ImportError:
+            from backports import lzma
+        return lzma.open(fileName, 'wb')
+    else:
+        return open(fileName, 'wt')
+
+
+def ParseRange(text):
+    """Parse a 'start:end' cycle range where either end may be left out"""
+    start, end = text.split(':')
+    return (int(start) if start != '' else 0, int(end) if end != '' else None)
+
+
+class AnnotatedTraceWriter:
+    """Writes trace lines with the energy of each cycle appended, one chunk per write call.
+
+    Selecting cores or a [start, end) cycle range restricts the output to the matching trace records, dropping
+    every other line. Cycles are numbered in trace order, as in the power timeline.
+    """
+    def __init__(self, outputFile, units, cores=None, cycles=None):
+        self.outputFile = outputFile
+        self.units = units
+        self.cores = cores
+        self.cycles = cycles
+        self.cycle = 0
+        self._format = ' ' + ' '.join(['\t%s ' + unit.replace('%', '%%') for unit in units]) + '\n'
+
+    def _Annotations(self, power):
+        """Return the text appended to each record, power holding one row per table"""
+        lineFormat = self._format
+        return [lineFormat % tuple(recordPower) for recordPower in power.T.tolist()]
+
+    def Write(self, data, starts, ends, positions, cores, power):
+        """Write a buffer of whole lines, given where its lines start and end (see tracereader.TraceParser), the
+        line, core and energy per table of its records"""
+        first = self.cycle
+        self.cycle += len(positions)
+        output = []
+
+        if self.cores is None and self.cycles is None:
+            cursor = 0
+            for end, annotation in zip(ends[positions].tolist(), self._Annotations(power)):
+                output.append(data[cursor:end])
+                output.append(annotation)
+                cursor = end + 1
+            output.append(data[cursor:])
+        else:
+            selected = numpy.ones(len(positions), dtype=bool)
+            if self.cores is not None:
+                selected &= numpy.in1d(cores, self.cores)
+            if self.cycles is not None:
+                start, end = self.cycles
+                cycles = numpy.arange(first, first + len(positions))
+                selected &= cycles >= start
+                if end is not None:
+                    selected &= cycles < end
+            records = numpy.flatnonzero(selected)
+            for start, end, annotation in zip(starts[positions[records]].tolist(), ends[positions[records]].tolist(),
+                                              self._Annotations(power[:, records])):
+                output.append(data[start:end])
+                output.append(annotation)
+
+        self.outputFile.write(''.join(output))
+
+    def Close(self):
+        if self.outputFile is not sys.stdout:
+            self.outputFile.close()